@@ -1,16 +1,28 @@
 import os
+import contextlib
+import functools
 import luigi
 import law
 import select
 import subprocess
 from law.util import interruptable_popen
-from rich.console import Console
-from law.util import merge_dicts
+from law.util import merge_dicts, make_list
 from datetime import datetime
 from law.contrib.htcondor.job import HTCondorJobManager
 from tempfile import mkdtemp
 from getpass import getuser
 from law.config import Config
+from helpers.IdleJobBudget import IdleJobBudget
+from helpers.HTCondorEventLog import HTCondorEventLogReader
+from helpers.JobLogs import (
+    JobLogIndex,
+    compress_log,
+    enforce_retention,
+    periodic_run,
+    rotate_log,
+)
+from helpers.StatusIndex import ProductionStatusIndex
+from tracing import instrument_base_task, instrument_task_class
 
 try:
     from luigi.parameter import UnconsumedParameterWarning
@@ -21,6 +33,8 @@ try:
 except:
     pass
 
+# both contribs are needed on import, htcondor for the base class of HTCondorWorkflow and wlcg
+# for the targets of all remote tasks, loading them is cheap compared to law and luigi
 law.contrib.load("wlcg")
 law.contrib.load("htcondor")
 # try to get the terminal width, if this fails, we are probably in a remote job, set it to 140
@@ -28,7 +42,37 @@ try:
     current_width = os.get_terminal_size().columns
 except OSError:
     current_width = 140
-console = Console(width=current_width)
+
+
+class LazyConsole(object):
+    """
+    Console, that only imports rich and creates the rich console when it is first used. Importing
+    rich is a large part of the import time of the framework, which is paid by every law command
+    and every job, also if nothing is printed.
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._console = None
+
+    def __getattr__(self, name):
+        if self._console is None:
+            from rich.console import Console
+
+            self._console = Console(**self._kwargs)
+        return getattr(self._console, name)
+
+
+def __getattr__(name):
+    # the rich Console class is still available as framework.Console, but only imported on request
+    if name == "Console":
+        from rich.console import Console
+
+        return Console
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+console = LazyConsole(width=current_width)
 
 # Determine startup time to use as default production_tag
 # LOCAL_TIMESTAMP is used by remote workflows to ensure consistent tags
@@ -45,6 +89,68 @@ else:
     startup_dir = os.getcwd()
 
 
+@functools.lru_cache(maxsize=None)
+def get_distribution():
+    """
+    The function `get_distribution` determines the distribution and version of the submitting
+    machine. It is only run once per process, as it spawns subprocesses.
+
+    :return: a tuple of the distribution name and version
+    """
+    # check if lsb_release is installed, if not, use the information from /etc/os-release
+    try:
+        distro = (
+            subprocess.check_output(
+                "lsb_release -i | cut -f2", stderr=subprocess.STDOUT
+            )
+            .decode()
+            .replace("Linux", "")
+            .replace("linux", "")
+            .strip()
+        )
+        os_version = (
+            subprocess.check_output(
+                "lsb_release -r | cut -f2", stderr=subprocess.STDOUT
+            )
+            .decode()
+            .strip()
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        distro = (
+            subprocess.check_output(
+                "cat /etc/os-release | grep '^NAME=' | cut -f2 -d='' | tr -d '\"'",
+                shell=True,
+            )
+            .decode()
+            .replace("Linux", "")
+            .replace("linux", "")
+            .strip()
+        )
+        os_version = (
+            subprocess.check_output(
+                "cat /etc/os-release | grep '^VERSION_ID=' | cut -f2 -d='' | tr -d '\"'",
+                shell=True,
+            )
+            .decode()
+            .strip()
+        )
+
+    return distro, os_version
+
+
+def production_log_dir(production_tag):
+    """
+    The function `production_log_dir` returns the directory of the HTCondor job logs, the log index
+    and the status index of a production.
+
+    :param production_tag: The production tag
+    :return: the path of the directory
+    """
+    _cfg = Config.instance()
+    job_file_dir = _cfg.get_expanded("job", "job_file_dir")
+    return os.path.join(os.path.dirname(job_file_dir), "logs", production_tag)
+
+
 class Task(law.Task):
     local_user = getuser()
     wlcg_path = luigi.Parameter(description="Base-path to remote file location.")
@@ -66,6 +172,11 @@ class Task(law.Task):
     )
     output_collection_cls = law.NestedSiblingFileCollection
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # time the scheduling methods of all tasks, if tracing is enabled, see tracing.py
+        instrument_task_class(cls)
+
     # Path of local targets.
     #   Composed from the analysis path set during the setup.sh
     #   or the local_output_path if is_local_output is set,
@@ -206,10 +317,13 @@ class Task(law.Task):
         else:
             raise Exception("No command provided.")
 
-    def run_command_readable(self, command=[], sourcescript=[], run_location=None):
+    def run_command_readable(
+        self, command=[], sourcescript=[], run_location=None, pass_fds=()
+    ):
         """
         This can be used, to run a command, where you want to read the output while the command is running.
-        redirect both stdout and stderr to the same output.
+        redirect both stdout and stderr to the same output. The file descriptors in pass_fds are
+        inherited by the command.
         """
         if command:
             if isinstance(command, str):
@@ -232,6 +346,7 @@ class Task(law.Task):
                     env=run_env,
                     cwd=run_location,
                     encoding="utf-8",
+                    pass_fds=pass_fds,
                 )
                 while True:
                     reads = [p.stdout.fileno(), p.stderr.fileno()]
@@ -257,6 +372,41 @@ class Task(law.Task):
             raise Exception("No command provided.")
 
 
+instrument_base_task(Task)
+
+
+class EventLogJobManager(HTCondorJobManager):
+    """
+    HTCondor job manager, that reads the job states from the event logs of the jobs, which are
+    written by the schedd anyway. Only jobs, that are not found in the logs, are queried with
+    condor_q and condor_history.
+    """
+
+    def __init__(self, event_logs, **kwargs):
+        super(EventLogJobManager, self).__init__(**kwargs)
+        self.event_log = HTCondorEventLogReader(event_logs)
+
+    def query(self, job_id, silent=False, **kwargs):
+        chunking = isinstance(job_id, (list, tuple))
+        job_ids = make_list(job_id)
+        states = self.event_log.update()
+        query_data = {}
+        missing_ids = []
+        for _job_id in job_ids:
+            if _job_id in states:
+                query_data[_job_id] = self.job_status_dict(**states[_job_id])
+            else:
+                missing_ids.append(_job_id)
+        if missing_ids:
+            missing_data = super(EventLogJobManager, self).query(
+                missing_ids, silent=silent, **kwargs
+            )
+            if missing_data is None:
+                return None
+            query_data.update(missing_data)
+        return query_data if chunking else query_data[job_id]
+
+
 class HTCondorWorkflow(Task, law.htcondor.HTCondorWorkflow):
     ENV_NAME = luigi.Parameter(description="Environment to be used in HTCondor job.")
     htcondor_accounting_group = luigi.Parameter(
@@ -300,56 +450,60 @@ class HTCondorWorkflow(Task, law.htcondor.HTCondorWorkflow):
         default=[],
         description="Additional files to be included in the job tarball. Will be unpacked in the run directory",
     )
+    tarball_excludes = luigi.ListParameter(
+        default=[],
+        description="Patterns of files to be excluded from the job tarball, e.g. build directories of additional files.",
+    )
     remote_source_script = luigi.Parameter(
         description="Script to source environment in remote jobs. Leave empty if not needed. Defaults to use with docker images",
         default="source /opt/conda/bin/activate env",
     )
+    htcondor_max_materialize = luigi.IntParameter(
+        default=0,
+        description="Maximum number of jobs of a submission materialized in the schedd at the same time (late materialization). 0 disables the limit.",
+    )
+    htcondor_max_idle = luigi.IntParameter(
+        default=0,
+        description="Maximum number of idle jobs of a submission, further jobs are materialized when jobs start (late materialization). 0 disables the limit.",
+    )
+    htcondor_event_log_status = luigi.BoolParameter(
+        default=True,
+        significant=False,
+        description="Read the job states from the HTCondor event logs instead of querying the schedd. Jobs not found in the logs are still queried.",
+    )
+    htcondor_production_max_idle = luigi.IntParameter(
+        default=0,
+        significant=False,
+        description="Maximum number of idle jobs of all workflows of the production together, jobs beyond are submitted when others start. 0 disables the limit.",
+    )
+    htcondor_compress_logs = luigi.BoolParameter(
+        default=True,
+        significant=False,
+        description="Compress the stdout and stderr files of jobs once they are finished or failed.",
+    )
+    htcondor_log_retention = luigi.IntParameter(
+        default=0,
+        significant=False,
+        description="Maximum size (MB) of the job logs of the production, the oldest compressed logs are removed beyond. 0 disables the limit.",
+    )
+    htcondor_event_log_max_size = luigi.IntParameter(
+        default=100,
+        significant=False,
+        description="Maximum size (MB) of the event log of a workflow, larger event logs are compressed and a new one is started when the workflow is run. 0 disables the rotation.",
+    )
 
-    # Use proxy file located in $X509_USER_PROXY or /tmp/x509up_u$(id) if empty
-    htcondor_user_proxy = law.wlcg.get_vomsproxy_file()
+    @property
+    def htcondor_user_proxy(self):
+        # Use proxy file located in $X509_USER_PROXY or /tmp/x509up_u$(id) if empty,
+        # resolved on submission instead of at import time
+        return law.wlcg.get_vomsproxy_file()
 
     def get_submission_os(self):
         # function to check, if running on centos7, rhel9 or Ubuntu22
         # Other OS are not permitted
         # based on this, the correct docker image is chosen, overwriting the htcondor_docker_image parameter
-        # check if lsb_release is installed, if not, use the information from /etc/os-release
         # Please note that this selection can be somewhat unstable. Modify if neccessary.
-        try:
-            distro = (
-                subprocess.check_output(
-                    "lsb_release -i | cut -f2", stderr=subprocess.STDOUT
-                )
-                .decode()
-                .replace("Linux", "")
-                .replace("linux", "")
-                .strip()
-            )
-            os_version = (
-                subprocess.check_output(
-                    "lsb_release -r | cut -f2", stderr=subprocess.STDOUT
-                )
-                .decode()
-                .strip()
-            )
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            distro = (
-                subprocess.check_output(
-                    "cat /etc/os-release | grep '^NAME=' | cut -f2 -d='' | tr -d '\"'",
-                    shell=True,
-                )
-                .decode()
-                .replace("Linux", "")
-                .replace("linux", "")
-                .strip()
-            )
-            os_version = (
-                subprocess.check_output(
-                    "cat /etc/os-release | grep '^VERSION_ID=' | cut -f2 -d='' | tr -d '\"'",
-                    shell=True,
-                )
-                .decode()
-                .strip()
-            )
+        distro, os_version = get_distribution()
 
         image_name = None
 
@@ -373,6 +527,8 @@ class HTCondorWorkflow(Task, law.htcondor.HTCondorWorkflow):
 
     def htcondor_create_job_manager(self, **kwargs):
         kwargs = merge_dicts(self.htcondor_job_manager_defaults, kwargs)
+        if self.htcondor_event_log_status:
+            return EventLogJobManager([self.htcondor_log_files()["log"]], **kwargs)
         return HTCondorJobManager(**kwargs)
 
     def htcondor_output_directory(self):
@@ -402,48 +558,223 @@ class HTCondorWorkflow(Task, law.htcondor.HTCondorWorkflow):
         hostfile = self.bootstrap_file
         return law.util.rel_path(__file__, hostfile)
 
-    def htcondor_job_config(self, config, job_num, branches):
+    def htcondor_submission_context(self):
+        """
+        The function `htcondor_submission_context` computes the parts of the job configuration, that
+        are the same for all jobs of the workflow, only once: the log files, the submission settings
+        including the docker image, and the render variables. The job tarball is created and
+        uploaded here if it does not exist yet.
+
+        :return: a dictionary with the log files, the custom content and the render variables
+        """
+        if getattr(self, "_submission_context", None) is not None:
+            return self._submission_context
         analysis_name = os.getenv("ANA_NAME")
-        task_name = self.__class__.__name__
-        _cfg = Config.instance()
-        job_file_dir = _cfg.get_expanded("job", "job_file_dir")
-        logdir = os.path.join(
-            os.path.dirname(job_file_dir), "logs", self.production_tag
-        )
-        for file_ in ["Log", "Output", "Error"]:
-            os.makedirs(os.path.join(logdir, file_), exist_ok=True)
-        logfile = os.path.join(logdir, "Log", task_name + ".txt")
-        outfile = os.path.join(logdir, "Output", task_name + ".txt")
-        errfile = os.path.join(logdir, "Error", task_name + ".txt")
-
-        # Write job config file
-        config.custom_content = []
-        config.custom_content.append(
-            ("accounting_group", self.htcondor_accounting_group)
-        )
-        config.log = os.path.join(logfile)
-        config.stdout = os.path.join(outfile)
-        config.stderr = os.path.join(errfile)
+        logfiles = self.htcondor_log_files()
 
-        # config.custom_content.append(("stream_error", "True"))  # Remove before commit
-        # config.custom_content.append(("stream_output", "True"))  #
+        custom_content = []
+        custom_content.append(("accounting_group", self.htcondor_accounting_group))
+        # custom_content.append(("stream_error", "True"))  # Remove before commit
+        # custom_content.append(("stream_output", "True"))  #
         if self.htcondor_requirements:
-            config.custom_content.append(("Requirements", self.htcondor_requirements))
-        config.custom_content.append(("+RemoteJob", self.htcondor_remote_job))
-        config.custom_content.append(("universe", self.htcondor_universe))
+            custom_content.append(("Requirements", self.htcondor_requirements))
+        custom_content.append(("+RemoteJob", self.htcondor_remote_job))
+        custom_content.append(("universe", self.htcondor_universe))
         if self.htcondor_docker_image != "Automatic":
-            config.custom_content.append(("docker_image", self.htcondor_docker_image))
+            custom_content.append(("docker_image", self.htcondor_docker_image))
         else:
-            config.custom_content.append(("docker_image", self.get_submission_os()))
-        config.custom_content.append(("+RequestWalltime", self.htcondor_walltime))
-        config.custom_content.append(("x509userproxy", self.htcondor_user_proxy))
-        config.custom_content.append(("request_cpus", self.htcondor_request_cpus))
+            custom_content.append(("docker_image", self.get_submission_os()))
+        custom_content.append(("+RequestWalltime", self.htcondor_walltime))
+        custom_content.append(("x509userproxy", self.htcondor_user_proxy))
+        custom_content.append(("request_cpus", self.htcondor_request_cpus))
         # Only include "request_gpus" if any are requested, as nodes with GPU are otherwise excluded
         if float(self.htcondor_request_gpus) > 0:
-            config.custom_content.append(("request_gpus", self.htcondor_request_gpus))
-        config.custom_content.append(("RequestMemory", self.htcondor_request_memory))
-        config.custom_content.append(("RequestDisk", self.htcondor_request_disk))
+            custom_content.append(("request_gpus", self.htcondor_request_gpus))
+        custom_content.append(("RequestMemory", self.htcondor_request_memory))
+        custom_content.append(("RequestDisk", self.htcondor_request_disk))
+        # late materialization keeps the schedd responsive for large submissions
+        if self.htcondor_max_materialize > 0:
+            custom_content.append(("max_materialize", self.htcondor_max_materialize))
+        if self.htcondor_max_idle > 0:
+            custom_content.append(("max_idle", self.htcondor_max_idle))
+
+        tarball = self.htcondor_job_tarball(analysis_name)
+
+        render_variables = {}
+        render_variables["USER"] = self.local_user
+        render_variables["ANA_NAME"] = analysis_name
+        render_variables["ENV_NAME"] = self.ENV_NAME
+        render_variables["TAG"] = self.production_tag
+        render_variables["NTHREADS"] = self.htcondor_request_cpus
+        render_variables["LUIGIPORT"] = os.getenv("LUIGIPORT")
+        render_variables["SOURCE_SCRIPT"] = self.remote_source_script
+
+        render_variables["IS_LOCAL_OUTPUT"] = str(self.is_local_output)
+        if not self.is_local_output:
+            render_variables["TARBALL_PATH"] = (
+                os.path.expandvars(self.wlcg_path) + tarball.path
+            )
+        else:
+            render_variables["TARBALL_PATH"] = (
+                os.path.expandvars(self.local_output_path) + tarball.path
+            )
+        render_variables["LOCAL_TIMESTAMP"] = startup_time
+        render_variables["LOCAL_PWD"] = startup_dir
+        # only needed for $ANA_NAME=ML_train see setup.sh line 158
+        if os.getenv("MODULE_PYTHONPATH"):
+            render_variables["MODULE_PYTHONPATH"] = os.getenv("MODULE_PYTHONPATH")
+
+        self._submission_context = {
+            "logfiles": logfiles,
+            "custom_content": custom_content,
+            "render_variables": render_variables,
+        }
+        return self._submission_context
+
+    def htcondor_log_subdir(self):
+        """
+        The function `htcondor_log_subdir` returns an additional directory of the log files below the
+        directories of the production, to separate the logs of different workflows of a task.
+        """
+        return ""
+
+    def htcondor_log_files(self):
+        """
+        The function `htcondor_log_files` returns the path of the HTCondor event log, that is shared by
+        all jobs of the workflow, and the directories of the standard output and error of the jobs,
+        in which each submission gets its own shard. The directories are created once.
+
+        :return: a dictionary with the path of the log and the stdout and stderr directories
+        """
+        if getattr(self, "_log_files", None) is not None:
+            return self._log_files
+        task_name = self.__class__.__name__
+        logdir = self.htcondor_log_dir()
+        folder = os.path.join(logdir, "Log", self.htcondor_log_subdir())
+        os.makedirs(folder, exist_ok=True)
+        self._log_files = {"log": os.path.join(folder, task_name + ".txt")}
+        for key, file_ in [("stdout", "Output"), ("stderr", "Error")]:
+            folder = os.path.join(logdir, file_, self.htcondor_log_subdir(), task_name)
+            os.makedirs(folder, exist_ok=True)
+            self._log_files[key] = folder
+        return self._log_files
+
+    def htcondor_log_dir(self):
+        """
+        The function `htcondor_log_dir` returns the directory of all job logs of the production.
+        """
+        return production_log_dir(self.production_tag)
+
+    def htcondor_log_index(self):
+        """
+        The function `htcondor_log_index` returns the index of the stdout and stderr files of all jobs
+        of the production, see helpers/JobLogs.py to look up the logs of a branch.
+        """
+        return JobLogIndex(os.path.join(self.htcondor_log_dir(), "log_index.jsonl"))
+
+    def htcondor_job_logs(self, job_num, branches):
+        """
+        The function `htcondor_job_logs` creates a new shard for the stdout and stderr files of the
+        jobs of a submission, so that resubmitted jobs do not overwrite the logs of earlier attempts
+        and no directory collects the logs of all jobs. The jobs are added to the log index.
 
+        :param job_num: The job number, or a list of job numbers for grouped submissions
+        :param branches: The branches of the job, or a list of them for grouped submissions
+        :return: the paths of the stdout and stderr files, law adds the postfix of each job
+        """
+        task_name = self.__class__.__name__
+        logfiles = self.htcondor_log_files()
+        shard = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        paths = {}
+        for key in ["stdout", "stderr"]:
+            folder = os.path.join(logfiles[key], shard)
+            os.makedirs(folder, exist_ok=True)
+            paths[key] = os.path.join(folder, task_name + ".txt")
+
+        if not isinstance(job_num, (list, tuple)):
+            job_num, branches = [job_num], [branches]
+        entries = []
+        if not hasattr(self, "_job_logs"):
+            self._job_logs = {}
+        for _job_num, _branches in zip(job_num, branches):
+            # same postfix as added by law
+            postfix = "_{}To{}".format(_branches[0], _branches[-1] + 1)
+            job_paths = [
+                law.job.base.BaseJobFileFactory.postfix_output_file(paths[key], postfix)
+                for key in ["stdout", "stderr"]
+            ]
+            self._job_logs[_job_num] = job_paths
+            entries.append(
+                {
+                    "task": task_name,
+                    "subdir": self.htcondor_log_subdir(),
+                    "job_num": _job_num,
+                    "branches": list(_branches),
+                    "stdout": job_paths[0],
+                    "stderr": job_paths[1],
+                }
+            )
+        self.htcondor_log_index().append(entries)
+        return paths
+
+    def cleanup_job_logs(self):
+        """
+        The function `cleanup_job_logs` compresses the logs of jobs, that are finished or failed, and
+        removes the oldest compressed logs of the production, if they exceed the retention limit. The
+        size of the logs is checked at most every ten minutes by one of the workflows of the
+        production.
+        """
+        proxy = self.workflow_proxy
+        job_logs = getattr(self, "_job_logs", {})
+        if self.htcondor_compress_logs and job_logs:
+            done = (
+                proxy.job_manager.FINISHED,
+                proxy.job_manager.FAILED,
+                proxy.job_manager.RETRY,
+            )
+            for job_num, data in proxy.job_data.jobs.items():
+                if data["status"] not in done or job_num not in job_logs:
+                    continue
+                # resubmitted jobs get new paths, so each attempt is compressed once
+                for path in job_logs.pop(job_num):
+                    compress_log(path)
+        if self.htcondor_log_retention > 0:
+            logdir = self.htcondor_log_dir()
+            # the logs are shared by all workflows of the production, one of them is enough
+            with periodic_run(os.path.join(logdir, "retention.stamp"), 600) as due:
+                if not due:
+                    return
+                removed = enforce_retention(
+                    [os.path.join(logdir, name) for name in ["Output", "Error", "Log"]],
+                    self.htcondor_log_retention * 1024**2,
+                )
+            if removed:
+                console.log(f"Removed {removed} old job logs of {self.production_tag}")
+
+    def rotate_event_log(self):
+        """
+        The function `rotate_event_log` compresses the event log of the workflow, if it exceeds its
+        size limit, and starts a new one. Jobs, that are not found in the new event log, are queried
+        from the schedd, the compressed event logs are covered by the retention limit.
+        """
+        if self.htcondor_event_log_max_size <= 0:
+            return
+        rotated = rotate_log(
+            self.htcondor_log_files()["log"],
+            self.htcondor_event_log_max_size * 1024**2,
+        )
+        if rotated:
+            console.log(f"Rotated the event log of {self.task_family} to {rotated}")
+
+    def htcondor_job_tarball(self, analysis_name):
+        """
+        The function `htcondor_job_tarball` returns the target of the job tarball, it is created and
+        uploaded if it is not available remotely.
+
+        :param analysis_name: The name of the analysis, used to select the config files
+        :return: the target of the job tarball
+        """
+        task_name = self.__class__.__name__
         # Ensure tarball dir exists
         if not os.path.exists(f"tarballs/{self.production_tag}"):
             os.makedirs(f"tarballs/{self.production_tag}")
@@ -495,6 +826,10 @@ class HTCondorWorkflow(Task, law.htcondor.HTCondorWorkflow):
                 "*.pyc",
                 "--exclude",
                 "*.git",
+            ]
+            for pattern in self.tarball_excludes:
+                command += ["--exclude", pattern]
+            command += [
                 "-czf",
                 tarball_local.path,
                 "processor",
@@ -521,28 +856,130 @@ class HTCondorWorkflow(Task, law.htcondor.HTCondorWorkflow):
             tarball.parent.touch()
             tarball.copy_from_local(src=tarball_local.path)
             console.rule("Framework tarball uploaded!")
-        config.render_variables["USER"] = self.local_user
-        config.render_variables["ANA_NAME"] = os.getenv("ANA_NAME")
-        config.render_variables["ENV_NAME"] = self.ENV_NAME
-        config.render_variables["TAG"] = self.production_tag
-        config.render_variables["NTHREADS"] = self.htcondor_request_cpus
-        config.render_variables["LUIGIPORT"] = os.getenv("LUIGIPORT")
-        config.render_variables["SOURCE_SCRIPT"] = self.remote_source_script
-
-        config.render_variables["IS_LOCAL_OUTPUT"] = str(self.is_local_output)
-        if not self.is_local_output:
-            config.render_variables["TARBALL_PATH"] = (
-                os.path.expandvars(self.wlcg_path) + tarball.path
-            )
-        else:
-            config.render_variables["TARBALL_PATH"] = (
-                os.path.expandvars(self.local_output_path) + tarball.path
-            )
-        config.render_variables["LOCAL_TIMESTAMP"] = startup_time
-        config.render_variables["LOCAL_PWD"] = startup_dir
-        # only needed for $ANA_NAME=ML_train see setup.sh line 158
-        if os.getenv("MODULE_PYTHONPATH"):
-            config.render_variables["MODULE_PYTHONPATH"] = os.getenv(
-                "MODULE_PYTHONPATH"
-            )
+        return tarball
+
+    def htcondor_idle_budget(self):
+        """
+        The function `htcondor_idle_budget` returns the cap on the idle jobs shared by all workflows
+        of the production, or None if it is disabled.
+        """
+        if self.htcondor_production_max_idle <= 0:
+            return None
+        return IdleJobBudget(
+            os.path.join("tarballs", self.production_tag, "idle_jobs.json"),
+            self.htcondor_production_max_idle,
+        )
+
+    def apply_idle_budget(self, budget, poll_data):
+        """
+        The function `apply_idle_budget` limits the number of parallel jobs of the workflow, so that
+        only as many jobs are submitted as the idle cap of the production leaves free.
+
+        :param budget: The IdleJobBudget of the production
+        :param poll_data: The polling attributes of the workflow
+        """
+        proxy = self.workflow_proxy
+        idle = sum(
+            1
+            for data in proxy.job_data.jobs.values()
+            if data["status"] == proxy.job_manager.PENDING
+        )
+        allowed = budget.allowance(self.task_id, idle)
+        n_parallel = poll_data.n_active + allowed
+        if self.parallel_jobs > 0:
+            n_parallel = min(n_parallel, self.parallel_jobs)
+        # 0 would mean no limit, so at least one job is always allowed
+        proxy._set_parallel_jobs(max(n_parallel, 1))
+
+    def htcondor_status_index(self):
+        """
+        The function `htcondor_status_index` returns the status index of the production, that is read
+        by scripts/ProductionStatus.py.
+        """
+        return ProductionStatusIndex(
+            os.path.join(self.htcondor_log_dir(), "status_index.json")
+        )
+
+    def register_status(self):
+        """
+        The function `register_status` adds the outputs of all branches of the workflow to the status
+        index of the production, so that the monitor can follow the workflow without building the
+        task graph.
+        """
+        outputs = self.output()
+        # e.g. when only controlling the jobs of an earlier submission
+        if "collection" not in outputs:
+            return
+        collection = outputs["collection"]
+        outputs = {
+            branch: [target.path for target in law.util.flatten(targets)]
+            for branch, targets in collection.targets.items()
+        }
+        event_log = None
+        if self.htcondor_event_log_status:
+            event_log = self.htcondor_log_files()["log"]
+        self.htcondor_status_index().register(
+            self.task_id,
+            self.task_family,
+            self.htcondor_log_subdir() or self.task_family,
+            not self.is_local_output,
+            outputs,
+            event_log,
+        )
+
+    def register_failing_branches(self):
+        """
+        The function `register_failing_branches` stores the branches, whose latest job failed, in the
+        status index of the production, whenever they change.
+        """
+        proxy = self.workflow_proxy
+        failed = (proxy.job_manager.FAILED, proxy.job_manager.RETRY)
+        branches = sorted(
+            branch
+            for data in proxy.job_data.jobs.values()
+            if data["status"] in failed
+            for branch in data["branches"]
+        )
+        if branches != getattr(self, "_failing_branches", []):
+            self._failing_branches = branches
+            self.htcondor_status_index().set_failing(self.task_id, branches)
+
+    @contextlib.contextmanager
+    def htcondor_workflow_run_context(self):
+        self.rotate_event_log()
+        self.register_status()
+        budget = self.htcondor_idle_budget()
+        if budget is None:
+            yield
+            return
+        # limit the initial submission as well
+        self.apply_idle_budget(budget, self.workflow_proxy.poll_data)
+        try:
+            yield
+        finally:
+            budget.release(self.task_id)
+
+    def htcondor_poll_callback(self, poll_data):
+        budget = self.htcondor_idle_budget()
+        if budget is not None:
+            self.apply_idle_budget(budget, poll_data)
+        self.register_failing_branches()
+        self.cleanup_job_logs()
+
+    def htcondor_post_poll_callback(self, success, duration):
+        # compress the logs of the jobs, that finished in the last polling iteration
+        self.cleanup_job_logs()
+
+    def htcondor_job_config(self, config, job_num, branches):
+        # everything except the job specifics is computed once per workflow
+        context = self.htcondor_submission_context()
+        config.custom_content = list(context["custom_content"])
+        # the event log is shared by all jobs of the workflow, it is set directly, as law would add
+        # the postfix of each job to it
+        config.log = None
+        config.custom_content.append(("log", context["logfiles"]["log"]))
+        joblogs = self.htcondor_job_logs(job_num, branches)
+        config.stdout = joblogs["stdout"]
+        config.stderr = joblogs["stderr"]
+        config.render_variables.update(context["render_variables"])
         return config
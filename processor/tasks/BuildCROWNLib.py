@@ -1,51 +1,132 @@
 import luigi
 import os
-from framework import Task
+import hashlib
+import subprocess
 from framework import console
+from CROWNBase import CROWNCompileBase
 
+# the hash of the CROWN library is computed only once per process
+_crownlib_hashes = {}
 
-class BuildCROWNLib(Task):
+
+def get_crownlib_hash(crown_path, compile_script):
     """
-    Compile the CROWN shared libary to be used for all executables with the given configuration
+    The function `get_crownlib_hash` returns a SHA-256 hash identifying the CROWN library build. It is
+    computed from the git revision of CROWN, all uncommitted changes, the names and contents of all
+    untracked files, that are not ignored, the CROWN init.sh, which defines the toolchain, and the
+    compile script.
+
+    :param crown_path: The path to the CROWN repository
+    :param compile_script: The script used to compile the library
+    :return: the hash as a hex string
+    """
+    if crown_path not in _crownlib_hashes:
+        revision = subprocess.check_output(
+            ["git", "-C", crown_path, "rev-parse", "HEAD"]
+        )
+        diff = subprocess.check_output(["git", "-C", crown_path, "diff", "HEAD"])
+        untracked = subprocess.check_output(
+            [
+                "git",
+                "-C",
+                crown_path,
+                "ls-files",
+                "--others",
+                "--exclude-standard",
+                "-z",
+            ]
+        )
+        hash = hashlib.sha256()
+        hash.update(revision)
+        hash.update(diff)
+        # new source files are not part of the diff
+        for filename in sorted(untracked.split(b"\0")):
+            path = os.path.join(crown_path, os.fsdecode(filename))
+            if not filename or not os.path.isfile(path):
+                continue
+            hash.update(filename + b"\0")
+            with open(path, "rb") as f:
+                hash.update(f.read())
+        for filename in [os.path.join(crown_path, "init.sh"), compile_script]:
+            with open(filename, "rb") as f:
+                hash.update(f.read())
+        _crownlib_hashes[crown_path] = hash.hexdigest()
+    return _crownlib_hashes[crown_path]
+
+
+def set_crownlib_hash(crown_path, hash):
+    """
+    The function `set_crownlib_hash` sets the hash of the CROWN library, for environments without the
+    CROWN git repository, like remote build jobs.
+
+    :param crown_path: The path to the CROWN source
+    :param hash: The hash determined from the CROWN repository
+    """
+    _crownlib_hashes[crown_path] = hash
+
+
+class BuildCROWNLib(CROWNCompileBase):
+    """
+    Compile the CROWN shared libary to be used for all executables with the given configuration.
+    The library only depends on the CROWN source and the toolchain, so it is stored under its
+    content hash and shared by all friend names and productions.
     """
 
     # configuration variables
     build_dir = luigi.Parameter()
     install_dir = luigi.Parameter()
-    production_tag = luigi.Parameter()
-    friend_name = luigi.Parameter(default="ntuples")
+    production_tag = luigi.Parameter(significant=False)
+    friend_name = luigi.Parameter(default="ntuples", significant=False)
+
+    def crown_path(self):
+        return os.path.abspath("CROWN")
+
+    def compile_script(self):
+        return os.path.join(
+            str(os.path.abspath("processor")),
+            "tasks",
+            "scripts",
+            "compile_crown_lib.sh",
+        )
+
+    def crownlib_hash(self):
+        return get_crownlib_hash(self.crown_path(), self.compile_script())
+
+    # the library is shared between productions, so the production_tag is not part of the path
+    def local_path(self, *path):
+        return os.path.join(
+            (
+                self.local_output_path
+                if self.is_local_output
+                else os.getenv("ANALYSIS_DATA_PATH")
+            ),
+            self.__class__.__name__,
+            *path,
+        )
+
+    def remote_path(self, *path):
+        return os.path.join(self.__class__.__name__, *path)
 
     def output(self):
-        target = self.remote_target(f"{self.friend_name}/libCROWNLIB.so")
+        target = self.remote_target(f"{self.crownlib_hash()}/libCROWNLIB.so")
         return target
 
     def run(self):
         # get output file path
         output = self.output()
         # also use the tag for the local tarball creation
+        _hash = self.crownlib_hash()
         _install_dir = os.path.abspath(
-            os.path.join(
-                str(self.install_dir),
-                str(self.production_tag),
-                f"crownlib_{self.friend_name}",
-            )
+            os.path.join(str(self.install_dir), "crownlib", _hash)
         )
         _build_dir = os.path.abspath(
-            os.path.join(
-                str(self.build_dir),
-                str(self.production_tag),
-                f"crownlib_{self.friend_name}",
-            )
-        )
-        _crown_path = os.path.abspath("CROWN")
-        _compile_script = os.path.join(
-            str(os.path.abspath("processor")),
-            "tasks",
-            "scripts",
-            "compile_crown_lib.sh",
+            os.path.join(str(self.build_dir), "crownlib", _hash)
         )
+        _crown_path = self.crown_path()
+        _compile_script = self.compile_script()
         _local_libfile = os.path.join(_install_dir, "lib", output.basename)
-        if os.path.exists(os.path.join(_install_dir, output.basename)):
+        console.log(f"CROWNlib hash: {_hash}")
+        if os.path.exists(_local_libfile):
             console.log(f"lib already existing in tarball directory {_install_dir}")
             output.parent.touch()
             output.copy_from_local(_local_libfile)
@@ -73,7 +154,20 @@ class BuildCROWNLib(Task):
                 _install_dir,  # INSTALLDIR=$2
                 _build_dir,  # BUILDDIR=$3
             ]
-            self.run_command_readable(command)
+            # configure the optional compiler cache via the environment of the compile script
+            compiler_cache = self.compiler_cache()
+            command = (
+                compiler_cache.environment(
+                    os.path.commonpath([_crown_path, _build_dir])
+                )
+                + command
+            )
+            # share the cores with all other builds running on this machine
+            with self.compile_slot_allocator().slots(log=console.log) as jobserver:
+                command = jobserver.environment() + command
+                command.append(str(jobserver.jobs))  # MAKE_JOBS=$4
+                self.run_command_readable(command, pass_fds=jobserver.pass_fds)
+            compiler_cache.report(_build_dir, log=console.log)
             console.rule("Finished build of CROWNlib")
             output.parent.touch()
             output.copy_from_local(_local_libfile)
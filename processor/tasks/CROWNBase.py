@@ -3,12 +3,23 @@ import luigi
 import os
 import json
 import shutil
+import subprocess
+import tarfile
 from framework import console
 from law.config import Config
 from framework import HTCondorWorkflow, Task
 from law.task.base import WrapperTask
-from rich.table import Table
-from helpers.helpers import convert_to_comma_seperated
+from helpers.helpers import convert_to_comma_seperated, create_abspath
+from helpers.BuildSlots import BuildSlotAllocator
+from helpers.CompilerCache import CompilerCache
+from helpers.LightROOTFile import (
+    LightROOTFile,
+    UnsupportedROOTFile,
+    ENTRIES_RESHUFFLED,
+    read_string_vector_map,
+)
+from helpers.PayloadProfiler import PayloadProfiler
+from helpers.JobAccounting import PayloadAccounting
 import hashlib
 
 # import timeout_decorator
@@ -122,6 +133,10 @@ class ProduceBase(WrapperTask):
         data["sample_types"] = set()
         data["eras"] = set()
         data["details"] = {}
+        # one nick per sample type and era, used to get the quantities maps of combined friend builds
+        data["pair_nicks"] = {}
+        from rich.table import Table
+
         table = Table(title=f"Samples (selected Scopes: {self.scopes})")
         table.add_column("Samplenick", justify="left")
         table.add_column("Era", justify="left")
@@ -145,6 +160,9 @@ class ProduceBase(WrapperTask):
             # used to built the CROWN executable
             data["eras"].add(data["details"][nick]["era"])
             data["sample_types"].add(data["details"][nick]["sample_type"])
+            data["pair_nicks"].setdefault(sample_data["sample_type"], {}).setdefault(
+                data["details"][nick]["era"], nick
+            )
             if not self.silent:
                 table.add_row(
                     nick,
@@ -174,6 +192,21 @@ class CROWNExecuteBase(HTCondorWorkflow, law.LocalWorkflow):
     config = luigi.Parameter()
     production_tag = luigi.Parameter()
     files_per_task = luigi.IntParameter()
+    profile = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="Profile the CROWN executable of all branches with perf, or by sampling /proc if perf is not usable. The profile is uploaded to the profiles directory next to the branch outputs.",
+    )
+    profile_branches = luigi.IntParameter(
+        default=0,
+        significant=False,
+        description="Number of branches per workflow, spread evenly over the branch map, that are profiled even without --profile.",
+    )
+    payload_accounting = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="Write the resources used by the CROWN executable of each branch to the job output, they are collected by ProductionEfficiencyReport.",
+    )
 
     def htcondor_output_directory(self):
         """
@@ -209,6 +242,8 @@ class CROWNExecuteBase(HTCondorWorkflow, law.LocalWorkflow):
         class_name = self.__class__.__name__
         if "Friend" in class_name:
             task_name = [class_name + self.nick, self.friend_name]
+        elif "Shard" in class_name:
+            task_name = [class_name + self.nick, self.shift_shard]
         else:
             task_name = [class_name + self.nick]
         _cfg = Config.instance()
@@ -231,22 +266,406 @@ class CROWNExecuteBase(HTCondorWorkflow, law.LocalWorkflow):
             condor_batch_name_pattern = (
                 f"{self.nick}-{self.analysis}-{self.friend_name}-{self.production_tag}"
             )
+        elif "Shard" in class_name:
+            condor_batch_name_pattern = f"{self.nick}-{self.analysis}-{self.config}-{self.shift_shard}-{self.production_tag}"
         else:
             condor_batch_name_pattern = (
                 f"{self.nick}-{self.analysis}-{self.config}-{self.production_tag}"
             )
         config = super().htcondor_job_config(config, job_num, branches)
         config.custom_content.append(("JobBatchName", condor_batch_name_pattern))
-        for type in ["log", "stdout", "stderr"]:
-            logfilepath = getattr(config, type)
-            # split the filename, and add the sample nick as an additional folder
-            logfolder, logfile = os.path.split(logfilepath)
-            logfolder = os.path.join(logfolder, self.nick)
-            # create the new path
-            os.makedirs(logfolder, exist_ok=True)
-            setattr(config, type, os.path.join(logfolder, logfile))
         return config
 
+    def htcondor_log_subdir(self):
+        # add the sample nick as an additional folder
+        return self.nick
+
+    def unpack_tarball(self, tarball_target, workdir, executable):
+        """
+        The function `unpack_tarball` unpacks a CROWN tarball into the workdir, if the executable
+        is not there yet. Concurrent tasks in the same workdir wait until the unpacking is done.
+
+        :param tarball_target: The target of the tarball
+        :param workdir: The directory the tarball is unpacked to
+        :param executable: The name of the executable, used to check if the tarball was unpacked
+        """
+        console.log("Getting CROWN tarball from {}".format(tarball_target.uri()))
+        with tarball_target.localize("r") as _file:
+            _tarballpath = _file.path
+        tempfile = os.path.join(workdir, "unpacking_{}".format(executable))
+        while os.path.exists(tempfile):
+            time.sleep(1)
+        if not os.path.exists(os.path.join(workdir, executable)) and not os.path.exists(
+            tempfile
+        ):
+            # create a temp file to signal that we are unpacking
+            open(tempfile, "a").close()
+            tar = tarfile.open(_tarballpath, "r:gz")
+            tar.extractall(workdir)
+            os.remove(tempfile)
+
+    def unpack_layers(self, manifest_target, workdir, cache_dir):
+        """
+        The function `unpack_layers` unpacks a layered CROWN build into the workdir. The base layer and
+        the executable layers are unpacked once into the cache directory, so that jobs on the same node
+        can share them, and are linked into the workdir.
+
+        :param manifest_target: The target of the layer manifest written by CROWNBuildLayered
+        :param workdir: The directory the layers are linked into
+        :param cache_dir: The directory the layers are cached in
+        """
+        with manifest_target.localize("r") as _file:
+            manifest = _file.load()
+        create_abspath(cache_dir)
+        _base_dir = os.path.join(cache_dir, manifest["base"]["hash"])
+        if os.path.exists(_base_dir):
+            console.log(f"Using cached base layer {_base_dir}")
+        else:
+            console.log(f"Getting CROWN base layer {manifest['base']['hash']}")
+            with self.layer_target(manifest["base"]["path"]).localize("r") as _file:
+                # unpack to a temporary directory first, other jobs may unpack the same layer
+                _tmp_dir = f"{_base_dir}.{os.getpid()}.tmp"
+                with tarfile.open(_file.path, "r:gz") as tar:
+                    tar.extractall(_tmp_dir)
+                try:
+                    os.rename(_tmp_dir, _base_dir)
+                except OSError:
+                    shutil.rmtree(_tmp_dir)
+        _executable = manifest["executable"]["name"]
+        if not os.path.exists(os.path.join(_base_dir, _executable)):
+            console.log(f"Getting CROWN executable layer {_executable}")
+            with self.layer_target(manifest["executable"]["path"]).localize(
+                "r"
+            ) as _file:
+                _tmp_dir = os.path.join(_base_dir, f".{_executable}.{os.getpid()}.tmp")
+                with tarfile.open(_file.path, "r:gz") as tar:
+                    tar.extractall(_tmp_dir)
+                os.replace(
+                    os.path.join(_tmp_dir, _executable),
+                    os.path.join(_base_dir, _executable),
+                )
+                shutil.rmtree(_tmp_dir)
+        # link the cached layers into the workdir, the outputs are written to the workdir only
+        for name in os.listdir(_base_dir):
+            if name.startswith("."):
+                continue
+            _link = os.path.join(workdir, name)
+            if not os.path.lexists(_link):
+                os.symlink(os.path.join(_base_dir, name), _link)
+
+    def layer_target(self, path):
+        if self.is_local_output:
+            return law.LocalFileTarget(path)
+        return law.wlcg.WLCGFileTarget(path)
+
+    def run_executable(self, executable, arguments, workdir, env):
+        """
+        The function `run_executable` runs a CROWN executable in the workdir and logs its output.
+
+        :param executable: The executable, relative to the workdir
+        :param arguments: The list of arguments passed to the executable
+        :param workdir: The directory the executable is run in
+        :param env: The environment used to run the executable
+        """
+        command = [executable] + arguments
+        profiler = None
+        if self.profile_branch():
+            profiler = PayloadProfiler(
+                os.path.join(workdir, "profiles"),
+                f"{self.nick}_{self.branch}_{os.path.basename(executable)}",
+            )
+            command = profiler.wrap(command)
+            console.log(
+                f"Profiling the executable with {'perf' if profiler.use_perf else '/proc sampling'}"
+            )
+        accounting = self.start_accounting()
+        with subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=1,
+            universal_newlines=True,
+            env=env,
+            cwd=workdir,
+        ) as p:
+            if profiler is not None:
+                profiler.start(p.pid)
+            for line in p.stdout:
+                if line != "\n":
+                    console.log(line.replace("\n", ""))
+            for line in p.stderr:
+                if line != "\n":
+                    console.log("Error: {}".format(line.replace("\n", "")))
+        self.log_accounting(accounting, executable, p.returncode)
+        # the profile is uploaded for failed runs as well
+        if profiler is not None:
+            self.upload_profile(profiler.stop(p.returncode))
+        if p.returncode != 0:
+            console.log("Error when running crown {}".format([executable] + arguments))
+            console.log("crown returned non-zero exit status {}".format(p.returncode))
+            raise Exception("crown failed")
+        console.log("Successful")
+
+    def start_accounting(self):
+        """
+        The function `start_accounting` starts the accounting of the payload, if requested via
+        `payload_accounting`.
+
+        :return: the started PayloadAccounting, or None
+        """
+        if not self.payload_accounting:
+            return None
+        accounting = PayloadAccounting()
+        accounting.start()
+        return accounting
+
+    def log_accounting(self, accounting, executable, returncode):
+        """
+        The function `log_accounting` writes the resources used by the payload to the job output,
+        they are collected by ProductionEfficiencyReport. The line is written without the log
+        formatting of the console, which might wrap it.
+
+        :param accounting: The PayloadAccounting started before the payload, or None
+        :param executable: The executable of the payload
+        :param returncode: The exit code of the payload
+        """
+        if accounting is None:
+            return
+        record = accounting.stop(
+            task=self.__class__.__name__,
+            nick=self.nick,
+            branch=self.branch,
+            era=self.era,
+            sample_type=self.sample_type,
+            config=self.config,
+            executable=os.path.basename(executable),
+            returncode=returncode,
+        )
+        console.out(record, highlight=False)
+
+    def profile_branch(self):
+        """
+        The function `profile_branch` checks if the executable of the branch is profiled, either
+        because profiling is enabled for all branches, or because the branch is one of the
+        `profile_branches` branches spread evenly over the branch map.
+        """
+        if self.profile:
+            return True
+        if self.profile_branches <= 0:
+            return False
+        branches = sorted(self.branch_map)
+        n_profiled = min(self.profile_branches, len(branches))
+        profiled = {
+            branches[i * len(branches) // n_profiled] for i in range(n_profiled)
+        }
+        return self.branch in profiled
+
+    def upload_profile(self, files):
+        """
+        The function `upload_profile` uploads the profile files to the profiles directory next to
+        the first output of the branch.
+
+        :param files: The local profile files
+        """
+        profile_dir = law.util.flatten(self.output())[0].parent.child(
+            "profiles", type="d"
+        )
+        profile_dir.touch()
+        for filename in files:
+            target = profile_dir.child(os.path.basename(filename), type="f")
+            target.copy_from_local(filename)
+            console.log(f"Uploaded profile {target.uri()}")
+
+    def reset_status_bit(self, filename, workdir):
+        """
+        The function `reset_status_bit` resets the kEntriesReshuffled bit of the ntuple, that is set if
+        the file was produced in multithreaded mode, otherwise, no friends can be added to the tree.
+        The tree header is patched in place, ROOT is only used if the file cannot be patched.
+
+        :param filename: The local CROWN output file
+        :param workdir: The directory containing the init.sh of the CROWN tarball
+        """
+        try:
+            reset = LightROOTFile(filename).reset_tree_bit("ntuple", ENTRIES_RESHUFFLED)
+            console.log(f"Reset status bit of {reset} ntuple cycles in {filename}")
+            return
+        except UnsupportedROOTFile as e:
+            console.log(f"Cannot patch {filename} in place ({e}), using ROOT")
+        self.run_command(
+            command=[
+                "python3",
+                "processor/tasks/helpers/ResetROOTStatusBit.py",
+                "--input {}".format(filename),
+                "--use-root",
+            ],
+            sourcescript=[
+                "{}/init.sh".format(workdir),
+            ],
+            silent=True,
+        )
+
+    def create_quantities_map(self, inputfile, workdir, scope, target):
+        """
+        The function `create_quantities_map` creates the quantities map of a CROWN output file and
+        uploads it to the given target. The map is read without ROOT if possible.
+
+        :param inputfile: The local CROWN output file
+        :param workdir: The directory containing the init.sh of the CROWN tarball
+        :param scope: The scope of the output file
+        :param target: The target the quantities map is uploaded to
+        """
+        console.log("Creating quantities_map.json")
+        target.parent.touch()
+        local_outputfile = os.path.join(workdir, "quantities_map.json")
+        era = self.branch_data["era"]
+        sample_type = self.branch_data["sample_type"]
+        try:
+            data = read_string_vector_map(inputfile, "shift_quantities_map")
+        except UnsupportedROOTFile as e:
+            console.log(f"Cannot read the quantities map without ROOT ({e})")
+            self.run_command(
+                command=[
+                    "python3",
+                    "processor/tasks/helpers/GetQuantitiesMap.py",
+                    "--input {}".format(inputfile),
+                    "--era {}".format(era),
+                    "--scope {}".format(scope),
+                    "--sample_type {}".format(sample_type),
+                    "--output {}".format(local_outputfile),
+                ],
+                sourcescript=[
+                    "{}/init.sh".format(workdir),
+                ],
+                silent=True,
+            )
+        else:
+            quantities_map = {
+                era: {
+                    sample_type: {
+                        scope: {
+                            shift: sorted(quantities)
+                            for shift, quantities in data.items()
+                        }
+                    }
+                }
+            }
+            with open(local_outputfile, "w") as f:
+                json.dump(quantities_map, f)
+        target.copy_from_local(local_outputfile)
+        console.log("Uploaded {}".format(target.uri()))
+
+    def run_friend_chunked(
+        self, executable, outputfile, inputfiles, scope, workdir, env, chunks
+    ):
+        """
+        The function `run_friend_chunked` runs a friend executable in parallel processes on
+        contiguous entry ranges of its inputs. Each process runs single threaded, so the entry order
+        within a chunk is preserved. The friend chunks are merged in order afterwards and the merged
+        friend is checked to align entry-by-entry with the input ntuple.
+
+        :param executable: The friend executable, relative to the workdir
+        :param outputfile: The outputfile name passed to the executable, without the scope suffix
+        :param inputfiles: The input ntuple, followed by all friend inputs of the executable
+        :param scope: The scope of the friend
+        :param workdir: The directory containing the unpacked friend tarball
+        :param env: The environment used to run the executable
+        :param chunks: The number of parallel processes
+        """
+        _chunkdir = os.path.join(workdir, outputfile.replace(".root", "_chunks"))
+        create_abspath(_chunkdir)
+        # split all inputs at the same entry boundaries
+        console.rule(f"Splitting inputs into {chunks} chunks")
+        chunk_inputs = []
+        entries = set()
+        for i, inputfile in enumerate(inputfiles):
+            manifest = os.path.join(_chunkdir, f"input_{i}.json")
+            self.run_command(
+                command=[
+                    "python3",
+                    "processor/tasks/helpers/SplitNtuple.py",
+                    "--input {}".format(inputfile),
+                    "--output {}".format(
+                        os.path.join(_chunkdir, f"input_{i}_chunk{{chunk}}.root")
+                    ),
+                    "--chunks {}".format(chunks),
+                    "--manifest {}".format(manifest),
+                ],
+                sourcescript=[
+                    "{}/init.sh".format(workdir),
+                ],
+                silent=True,
+            )
+            with open(manifest, "r") as f:
+                split = json.load(f)
+            entries.add(split["entries"])
+            chunk_inputs.append([chunk["file"] for chunk in split["chunks"]])
+        if len(entries) != 1:
+            raise Exception(
+                f"Inputs {inputfiles} have different numbers of entries: {entries}"
+            )
+        n_chunks = len(chunk_inputs[0])
+        # run the executable on all chunks in parallel
+        console.rule(f"Running {executable} on {n_chunks} chunks")
+        accounting = self.start_accounting()
+        processes = []
+        for chunk in range(n_chunks):
+            logfile = open(os.path.join(_chunkdir, f"chunk{chunk}.log"), "w")
+            command = [executable, f"chunk{chunk}_{outputfile}"] + [
+                inputs[chunk] for inputs in chunk_inputs
+            ]
+            console.log(f"Running command: {command}")
+            processes.append(
+                (
+                    subprocess.Popen(
+                        command,
+                        stdout=logfile,
+                        stderr=subprocess.STDOUT,
+                        env=env,
+                        cwd=workdir,
+                    ),
+                    logfile,
+                )
+            )
+        failed = []
+        for chunk, (p, logfile) in enumerate(processes):
+            p.wait()
+            logfile.close()
+            if p.returncode != 0:
+                failed.append(chunk)
+        self.log_accounting(accounting, executable, 1 if failed else 0)
+        for chunk in failed:
+            console.log(f"crown returned non-zero exit status for chunk {chunk}:")
+            with open(os.path.join(_chunkdir, f"chunk{chunk}.log"), "r") as f:
+                for line in f.readlines()[-50:]:
+                    console.log("Error: {}".format(line.replace("\n", "")))
+        if failed:
+            raise Exception("crown failed")
+        # merge the friend chunks in order and verify the alignment with the original input
+        # ntuple, not with its split copies
+        console.rule("Merging friend chunks")
+        _scope_outputfile = outputfile.replace(".root", "_{}.root".format(scope))
+        chunk_outputs = [
+            os.path.join(workdir, f"chunk{chunk}_{_scope_outputfile}")
+            for chunk in range(n_chunks)
+        ]
+        self.run_command(
+            command=[
+                "python3",
+                "processor/tasks/helpers/MergeFriendChunks.py",
+                "--inputs {}".format(" ".join(chunk_outputs)),
+                "--output {}".format(os.path.join(workdir, _scope_outputfile)),
+                "--references {}".format(inputfiles[0]),
+            ],
+            sourcescript=[
+                "{}/init.sh".format(workdir),
+            ],
+            silent=True,
+        )
+        for chunk_output in chunk_outputs:
+            os.remove(chunk_output)
+        shutil.rmtree(_chunkdir)
+        console.log("Successful")
+
     def modify_polling_status_line(self, status_line):
         """
         The function `modify_polling_status_line` modifies the status line that is printed during polling by
@@ -260,12 +679,97 @@ class CROWNExecuteBase(HTCondorWorkflow, law.LocalWorkflow):
         class_name = self.__class__.__name__
         if "Friend" in class_name:
             status_line_pattern = f"{self.nick} (Analysis: {self.analysis} FriendConfig: {self.friend_config} Tag: {self.production_tag})"
+        elif "Shard" in class_name:
+            status_line_pattern = f"{self.nick} (Analysis: {self.analysis} Config: {self.config} Shard: {self.shift_shard} Tag: {self.production_tag})"
         else:
             status_line_pattern = f"{self.nick} (Analysis: {self.analysis} Config: {self.config} Tag: {self.production_tag})"
         return f"{status_line} - {law.util.colored(status_line_pattern, color='light_cyan')}"
 
 
-class CROWNBuildBase(Task):
+class CROWNProductionWorkflow(HTCondorWorkflow, law.LocalWorkflow):
+    """
+    Base of the workflows, that run the CROWNRun branches of all samples of a production in shared
+    jobs, e.g. the packed and pilot production modes. The job files are stored per task instead of
+    per sample.
+    """
+
+    # prefix of the HTCondor batch name of the jobs
+    batch_name_prefix = None
+
+    def htcondor_create_job_file_factory(self):
+        task_name = self.__class__.__name__
+        _cfg = Config.instance()
+        job_file_dir = _cfg.get_expanded("job", "job_file_dir")
+        job_files = os.path.join(
+            job_file_dir,
+            self.production_tag,
+            task_name,
+            "files",
+        )
+        factory = super(HTCondorWorkflow, self).htcondor_create_job_file_factory(
+            dir=job_files,
+            mkdtemp=False,
+        )
+        return factory
+
+    def htcondor_job_config(self, config, job_num, branches):
+        config = super().htcondor_job_config(config, job_num, branches)
+        config.custom_content.append(
+            (
+                "JobBatchName",
+                f"{self.batch_name_prefix}-{self.analysis}-{self.config}-{self.production_tag}",
+            )
+        )
+        return config
+
+
+class CROWNCompileBase(Task):
+    """
+    Options of the compilation shared by the build of the CROWN library and all CROWN builds
+    """
+
+    compile_slots = luigi.IntParameter(
+        default=0,
+        significant=False,
+        description="Number of compile jobs shared by all builds running at the same time on this machine, 0 uses all cores.",
+    )
+    compile_slot_state = luigi.Parameter(
+        default="build/compile_slots.json",
+        significant=False,
+        description="State file of the compile slots, shared by all builds on this machine.",
+    )
+    compiler_launcher = luigi.Parameter(
+        default="",
+        significant=False,
+        description="Compiler cache used as compiler launcher of the builds, ccache or sccache, empty to disable the cache.",
+    )
+    compiler_cache_dir = luigi.Parameter(
+        default="build/compiler_cache",
+        significant=False,
+        description="Directory of the compiler cache, shared by all builds.",
+    )
+    compiler_cache_size = luigi.Parameter(
+        default="20G",
+        significant=False,
+        description="Size limit of the compiler cache.",
+    )
+
+    def compile_slot_allocator(self):
+        """
+        The function `compile_slot_allocator` returns the allocator of the machine-wide compile slots.
+        """
+        return BuildSlotAllocator(self.compile_slot_state, self.compile_slots)
+
+    def compiler_cache(self):
+        """
+        The function `compiler_cache` returns the optional compiler cache of the builds.
+        """
+        return CompilerCache(
+            self.compiler_launcher, self.compiler_cache_dir, self.compiler_cache_size
+        )
+
+
+class CROWNBuildBase(CROWNCompileBase):
     # configuration variables
     scopes = luigi.ListParameter()
     shifts = luigi.Parameter()
@@ -276,12 +780,31 @@ class CROWNBuildBase(Task):
     analysis = luigi.Parameter()
     config = luigi.Parameter(significant=False)
     htcondor_request_cpus = luigi.IntParameter(default=1)
+    single_threaded = luigi.BoolParameter(
+        default=False,
+        description="Build the executables single threaded, so that the entries are written in the order of the input files, regardless of the requested cpus.",
+    )
     production_tag = luigi.Parameter()
+    remote_build = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="Compile in HTCondor jobs instead of on the submitting machine, see CROWNBuildRemote.",
+    )
+    combined_build = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="Pack the tarball of a friend build from a build of all sample types and eras, see CROWNBuildFriendCombined.",
+    )
+    pair_nicks = luigi.DictParameter(
+        significant=False,
+        default={},
+        description="Mapping of sample types to a mapping of eras to one nick of the sample type and era, used by the combined build.",
+    )
 
     def get_tarball_hash(self):
         """
         The function `get_tarball_hash` generates a SHA-256 hash based on concatenated and sorted lists of
-        sample types, eras, scopes, and shifts.
+        sample types, eras, scopes, and shifts. Single threaded builds get their own hash.
         :return: The `get_tarball_hash` method returns a SHA-256 hash of a string created by concatenating
         sorted and comma-separated lists of sample types, eras, scopes, and shifts.
         """
@@ -303,9 +826,82 @@ class CROWNBuildBase(Task):
         scopes = convert_to_comma_seperated(scopes)
         shifts = convert_to_comma_seperated(shifts)
         id_list = f"{sample_types};{eras};{scopes};{shifts}"
+        if self.single_threaded:
+            id_list += ";single_threaded"
         hash = hashlib.sha256(str(id_list).encode()).hexdigest()
         return hash
 
+    def check_remote_build(self):
+        """
+        The function `check_remote_build` checks, that the output of the task was uploaded by the job of
+        the remote build.
+        """
+        output = self.output()
+        if not output.exists():
+            raise Exception(
+                f"The remote build did not upload {output.path}, check the logs of the CROWNBuildRemote jobs"
+            )
+        console.log(f"Using {output.path} from the remote build")
+
+    def all_pair_nicks(self):
+        """
+        The function `all_pair_nicks` returns the pair_nicks of the production, including the sample
+        type and era of the task itself.
+
+        :return: a mapping of sample types to a mapping of eras to one nick
+        """
+        pair_nicks = {
+            sample_type: dict(eras) for sample_type, eras in self.pair_nicks.items()
+        }
+        pair_nicks.setdefault(self.sample_type, {}).setdefault(self.era, self.nick)
+        return pair_nicks
+
+    def combined_friend_build(self):
+        """
+        The function `combined_friend_build` returns the combined friend build, that the tarball of a
+        friend build is packed from.
+
+        :return: the CROWNBuildFriendCombined task
+        """
+        # imported here, as CROWNBuildFriendCombined depends on this module
+        from CROWNBuildFriendCombined import CROWNBuildFriendCombined
+
+        return CROWNBuildFriendCombined.req(self, pair_nicks=self.all_pair_nicks())
+
+    def pack_from_combined_build(self):
+        """
+        The function `pack_from_combined_build` packs the tarball of the sample type and era of a friend
+        build from the install directory of the combined friend build and uploads it.
+        """
+        output = self.output()
+        _unpacked_dir = os.path.join(
+            str(self.install_dir), self.combined_friend_build().install_tag()
+        )
+        if not os.path.exists(_unpacked_dir):
+            raise FileNotFoundError(
+                f"No combined friend build found in {_unpacked_dir}"
+            )
+        _tarball = os.path.join(
+            str(self.install_dir),
+            f"{self.production_tag}/CROWNFriends_{self.analysis}_{self.friend_config}_{self.friend_name}_{self.sample_type}_{self.era}",
+            output.basename,
+        )
+        _executable = f"{self.friend_config}_{self.sample_type}_{self.era}"
+        if not any(
+            name == _executable or name.startswith(f"{_executable}_")
+            for name in os.listdir(_unpacked_dir)
+        ):
+            raise Exception(
+                f"The combined friend build in {_unpacked_dir} does not contain {_executable}"
+            )
+        console.log(f"Creating tarball for {self.sample_type} {self.era}")
+        self.pack_tarball(
+            _unpacked_dir, _tarball, f"{self.friend_config}_", _executable
+        )
+        self.upload_tarball(output, _tarball, 10)
+        os.remove(_tarball)
+        console.rule(f"Finished {self.task_family}")
+
     def setup_build_environment(self, build_dir, install_dir, crownlib):
         """
         The function sets up the build environment by creating build and install directories, localizing a
@@ -336,6 +932,34 @@ class CROWNBuildBase(Task):
 
         return build_dir, install_dir
 
+    def pack_tarball(self, unpacked_dir, tarball, executable_prefix, executable):
+        """
+        The function `pack_tarball` packs the install directory of a combined build into a tarball, that
+        only contains the executables of a single sample type and era.
+
+        :param unpacked_dir: The install directory of the combined build
+        :param tarball: The path of the tarball
+        :param executable_prefix: The prefix of all executables in the install directory
+        :param executable: The name of the executable to keep, executables with additional suffixes
+        like the scope are kept as well
+        """
+
+        def exclude_files(tarinfo):
+            filename = os.path.basename(tarinfo.name)
+            if filename.endswith(".tar.gz") or filename.endswith(".hash"):
+                return None
+            if (
+                filename.startswith(executable_prefix)
+                and filename != executable
+                and not filename.startswith(f"{executable}_")
+            ):
+                return None
+            return tarinfo
+
+        os.makedirs(os.path.dirname(tarball), exist_ok=True)
+        with tarfile.open(tarball, "w:gz") as tar:
+            tar.add(unpacked_dir, arcname=".", filter=exclude_files)
+
     # @timeout_decorator.timeout(10)
     def copy_from_local_with_timeout(self, output, path):
         output.copy_from_local(path)
@@ -3,8 +3,39 @@ import luigi
 from framework import console
 from BuildCROWNLib import BuildCROWNLib
 from CROWNBase import CROWNBuildBase
+from CROWNBuildRemote import remote_build_requirement, ntuple_build_groups
 from helpers.helpers import convert_to_comma_seperated
 import tarfile
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+
+def shard_suffix(shift_shard):
+    """
+    The function `shard_suffix` returns the suffix of the build directories and tarballs of a shift shard.
+
+    :param shift_shard: The name of the shift shard, empty for the standard build
+    :return: an empty string for the standard build, otherwise `_` followed by the shard name
+    """
+    return f"_{shift_shard}" if shift_shard else ""
+
+
+def write_tarball(tarball, members):
+    """
+    The function `write_tarball` writes a gzipped tarball with the given members. It is run in a
+    separate process for each tarball, so that the tarballs are compressed in parallel.
+
+    :param tarball: The path of the tarball
+    :param members: A list of tuples of the path and the name in the archive of each member,
+    directories are added without their content
+    :return: the path of the tarball
+    """
+    _tmp_tarball = f"{tarball}.{os.getpid()}.tmp"
+    with tarfile.open(_tmp_tarball, "w:gz") as tar:
+        for path, arcname in members:
+            tar.add(path, arcname=arcname, recursive=False)
+    os.rename(_tmp_tarball, tarball)
+    return tarball
 
 
 class CROWNBuildCombined(CROWNBuildBase):
@@ -12,6 +43,11 @@ class CROWNBuildCombined(CROWNBuildBase):
     Gather and compile CROWN with the given configuration
     """
 
+    shift_shard = luigi.Parameter(
+        default="",
+        description="Name of the shift shard built with the given shifts, empty for the standard build.",
+    )
+
     def requires(self):
         result = {"crownlib": BuildCROWNLib.req(self)}
         return result
@@ -29,9 +65,9 @@ class CROWNBuildCombined(CROWNBuildBase):
         output = self.output()
         _analysis = str(self.analysis)
         _config = str(self.config)
-        _threads = str(self.htcondor_request_cpus)
+        _threads = "1" if self.single_threaded else str(self.htcondor_request_cpus)
         # also use the tag for the local tarball creation
-        _tag = f"{self.production_tag}/CROWN_{_analysis}_{_config}"
+        _tag = f"{self.production_tag}/CROWN_{_analysis}_{_config}{shard_suffix(self.shift_shard)}"
         _install_dir = os.path.join(str(self.install_dir), _tag)
         _build_dir = os.path.join(str(self.build_dir), _tag)
         _crown_path = os.path.abspath("CROWN")
@@ -108,7 +144,20 @@ class CROWNBuildCombined(CROWNBuildBase):
                 output.basename,  # TARBALLNAME=$10
                 _threads,  # THREADS=$11
             ]
-            self.run_command_readable(command)
+            # configure the optional compiler cache via the environment of the compile script
+            compiler_cache = self.compiler_cache()
+            command = (
+                compiler_cache.environment(
+                    os.path.commonpath([_crown_path, _build_dir])
+                )
+                + command
+            )
+            # share the cores with all other builds running on this machine
+            with self.compile_slot_allocator().slots(log=console.log) as jobserver:
+                command = jobserver.environment() + command
+                command.append(str(jobserver.jobs))  # MAKE_JOBS=$12
+                self.run_command_readable(command, pass_fds=jobserver.pass_fds)
+            compiler_cache.report(_build_dir, log=console.log)
             console.rule("Finished CROWNBuild")
             # upload an small file to signal that the build is done
         with open(os.path.join(_install_dir, output.basename), "w") as f:
@@ -116,6 +165,128 @@ class CROWNBuildCombined(CROWNBuildBase):
         output.copy_from_local(os.path.join(_install_dir, output.basename))
 
 
+class CROWNPackTarballs(CROWNBuildBase):
+    """
+    Pack the tarballs of all sample types and eras from the combined CROWN build in one pass over the
+    install directory. The tarballs are compressed in parallel and uploaded concurrently as soon as
+    they are ready.
+    """
+
+    shift_shard = luigi.Parameter(
+        default="",
+        description="Name of the shift shard built with the given shifts, empty for the standard build.",
+    )
+    pack_workers = luigi.IntParameter(
+        default=0,
+        significant=False,
+        description="Number of processes compressing tarballs in parallel, 0 uses all cores.",
+    )
+    upload_workers = luigi.IntParameter(
+        default=4,
+        significant=False,
+        description="Number of concurrent tarball uploads.",
+    )
+
+    def requires(self):
+        result = {"combined_build": CROWNBuildCombined.req(self)}
+        return result
+
+    def output(self):
+        return {
+            f"{sample_type}_{era}": CROWNBuild.req(
+                self, era=era, sample_type=sample_type
+            ).output()
+            for sample_type in self.all_sample_types
+            for era in self.all_eras
+        }
+
+    def tarball_members(self, unpacked_dir, pairs):
+        """
+        The function `tarball_members` walks the install directory once and assigns the files to the
+        tarballs. Executables of the config are only packed into the tarball of their sample type and
+        era, all other files into all tarballs.
+
+        :param unpacked_dir: The install directory of the combined build
+        :param pairs: The names of the sample types and eras, given as `{sample_type}_{era}`
+        :return: a dictionary mapping each pair to a list of tuples of path and name in the archive
+        """
+        members = {pair: [(unpacked_dir, ".")] for pair in pairs}
+        # excluded directories of each tarball, their content is excluded as well
+        excluded = {pair: set() for pair in pairs}
+        for root, dirs, filenames in os.walk(unpacked_dir):
+            for name in sorted(dirs) + sorted(filenames):
+                path = os.path.join(root, name)
+                arcname = os.path.join(".", os.path.relpath(path, unpacked_dir))
+                executable = name.startswith(f"{self.config}")
+                for pair in pairs:
+                    if (
+                        root in excluded[pair]
+                        or name.endswith(".tar.gz")
+                        or (executable and not name.endswith(pair))
+                    ):
+                        excluded[pair].add(path)
+                        continue
+                    members[pair].append((path, arcname))
+        return members
+
+    def run(self):
+        outputs = self.output()
+        _analysis = str(self.analysis)
+        _config = str(self.config)
+        _shard = shard_suffix(self.shift_shard)
+        _unpacked_dir = os.path.join(
+            str(self.install_dir),
+            f"{self.production_tag}/CROWN_{_analysis}_{_config}{_shard}",
+        )
+        if not os.path.exists(_unpacked_dir):
+            raise FileNotFoundError(
+                f"No builds for {self.production_tag}/CROWN_{_analysis}_{_config}{_shard} found"
+            )
+        pairs = [pair for pair, output in outputs.items() if not output.exists()]
+        members = self.tarball_members(_unpacked_dir, pairs)
+        tarballs = {}
+        for pair in pairs:
+            _install_dir = os.path.join(
+                str(self.install_dir),
+                f"{self.production_tag}/CROWN_{_analysis}_{_config}_{pair}{_shard}",
+            )
+            os.makedirs(_install_dir, exist_ok=True)
+            tarballs[pair] = os.path.join(_install_dir, outputs[pair].basename)
+        console.log(f"Creating tarballs for {pairs}")
+        failed = []
+        with ProcessPoolExecutor(
+            max_workers=self.pack_workers or None
+        ) as pack_pool, ThreadPoolExecutor(
+            max_workers=self.upload_workers
+        ) as upload_pool:
+            packing = {
+                pack_pool.submit(write_tarball, tarballs[pair], members[pair]): pair
+                for pair in pairs
+            }
+            uploads = {}
+            # upload each tarball as soon as it is packed
+            for future in as_completed(packing):
+                pair = packing[future]
+                console.log(f"Packed tarball for {pair}")
+                uploads[
+                    upload_pool.submit(
+                        self.upload_tarball, outputs[pair], future.result(), 10
+                    )
+                ] = pair
+            for future in as_completed(uploads):
+                pair = uploads[future]
+                if not future.result():
+                    failed.append(pair)
+                    continue
+                # delete the local tarball
+                os.remove(tarballs[pair])
+        if failed:
+            raise Exception(f"Upload of the tarballs for {failed} failed")
+        console.rule(
+            f"Finished CROWNPackTarballs for {_analysis} {_config} ({len(pairs)} tarballs)"
+        )
+
+
 class CROWNBuild(CROWNBuildBase):
     """
     Gather and compile CROWN with the given configuration
@@ -123,61 +294,160 @@ class CROWNBuild(CROWNBuildBase):
 
     era = luigi.Parameter()
     sample_type = luigi.Parameter()
+    shift_shard = luigi.Parameter(
+        default="",
+        description="Name of the shift shard built with the given shifts, empty for the standard build.",
+    )
+
+    def requires(self):
+        if self.remote_build:
+            return {
+                "remote_build": remote_build_requirement(
+                    self, ntuple_build_groups(self)
+                )
+            }
+        # the tarballs of all sample types and eras are packed together
+        result = {"tarballs": CROWNPackTarballs.req(self)}
+        return result
+
+    def output(self):
+        return self.remote_target(
+            f"crown_{self.analysis}_{self.config}_{self.sample_type}_{self.era}{shard_suffix(self.shift_shard)}.tar.gz"
+        )
+
+    def run(self):
+        if self.remote_build:
+            self.check_remote_build()
+            return
+        output = self.output()
+        if not output.exists():
+            raise Exception(
+                f"CROWNPackTarballs did not upload the tarball {output.path}"
+            )
+        console.rule(
+            f"Finished CROWNBuild for {self.analysis} {self.config} {self.sample_type} {self.era}"
+        )
+
+
+class CROWNBuildLayered(CROWNBuildBase):
+    """
+    Pack the combined CROWN build into layers: a content-addressed base layer with everything
+    except the executables, that is shared by all sample types and eras, and a small layer
+    containing only the executable of the given sample type and era
+    """
+
+    era = luigi.Parameter()
+    sample_type = luigi.Parameter()
+    shift_shard = luigi.Parameter(
+        default="",
+        description="Name of the shift shard built with the given shifts, empty for the standard build.",
+    )
 
     def requires(self):
+        if self.remote_build:
+            return {
+                "remote_build": remote_build_requirement(
+                    self, ntuple_build_groups(self)
+                )
+            }
         result = {"combined_build": CROWNBuildCombined.req(self)}
         return result
 
     def output(self):
         return self.remote_target(
-            f"crown_{self.analysis}_{self.config}_{self.sample_type}_{self.era}.tar.gz"
+            f"crown_{self.analysis}_{self.config}_{self.sample_type}_{self.era}{shard_suffix(self.shift_shard)}_layers.json"
         )
 
+    def layer_target(self, name):
+        return self.remote_target(os.path.join("layers", name))
+
+    def base_layer_files(self, unpacked_dir):
+        """
+        The function `base_layer_files` lists all files of the base layer, which are all files of the
+        install directory except the executables, tarballs and build markers.
+
+        :param unpacked_dir: The install directory of the combined build
+        :return: a sorted list of file paths relative to the install directory
+        """
+        files = []
+        for root, dirs, filenames in os.walk(unpacked_dir):
+            for filename in filenames:
+                relpath = os.path.relpath(os.path.join(root, filename), unpacked_dir)
+                if filename.endswith(".tar.gz") or filename.endswith(".hash"):
+                    continue
+                if os.path.dirname(relpath) == "" and filename.startswith(
+                    f"{self.config}_"
+                ):
+                    continue
+                files.append(relpath)
+        return sorted(files)
+
     def run(self):
-        # get output file path
+        if self.remote_build:
+            self.check_remote_build()
+            return
         output = self.output()
         _analysis = str(self.analysis)
         _config = str(self.config)
         _era = str(self.era)
         _sample_type = str(self.sample_type)
-        # also use the tag for the local tarball creation
-        _tag = (
-            f"{self.production_tag}/CROWN_{_analysis}_{_config}_{_sample_type}_{_era}"
-        )
-        _install_dir = os.path.join(str(self.install_dir), _tag)
+        _shard = shard_suffix(self.shift_shard)
         _unpacked_dir = os.path.join(
-            str(self.install_dir), f"{self.production_tag}/CROWN_{_analysis}_{_config}"
+            str(self.install_dir),
+            f"{self.production_tag}/CROWN_{_analysis}_{_config}{_shard}",
         )
-        _tarball = os.path.join(_install_dir, output.basename)
-        os.makedirs(os.path.dirname(_tarball), exist_ok=True)
+        _layer_dir = os.path.join(
+            str(self.install_dir),
+            f"{self.production_tag}/CROWN_{_analysis}_{_config}{_shard}_layers",
+        )
+        os.makedirs(_layer_dir, exist_ok=True)
         if not os.path.exists(_unpacked_dir):
             raise FileNotFoundError(
-                f"No builds for {self.production_tag}/CROWN_{_analysis}_{_config} found"
+                f"No builds for {self.production_tag}/CROWN_{_analysis}_{_config}{_shard} found"
             )
-
-        # now pack the specific tarball, excluding unwanted executables
-        def exclude_files(tarinfo):
-            filename = os.path.basename(tarinfo.name)
-            if filename.endswith(".tar.gz"):
-                return None
-            if filename.startswith(f"{_config}") and not filename.endswith(
-                f"{_sample_type}_{_era}"
-            ):
-                return None
-            else:
-                return tarinfo
-
-        console.log(f"Creating tarball for {_sample_type} {_era}")
-        with tarfile.open(_tarball, "w:gz") as tar:
-            tar.add(
-                _unpacked_dir,
-                arcname=".",
-                filter=exclude_files,
-            )
-        # now upload the tarball
-        self.upload_tarball(output, os.path.join(_install_dir, output.basename), 10)
-        # delete the local tarball
-        os.remove(_tarball)
+        # the base layer is addressed by its content, so all executables of a build share it
+        base_files = self.base_layer_files(_unpacked_dir)
+        base_hash = hashlib.sha256()
+        for relpath in base_files:
+            base_hash.update(relpath.encode())
+            with open(os.path.join(_unpacked_dir, relpath), "rb") as f:
+                base_hash.update(hashlib.sha256(f.read()).digest())
+        base_hash = base_hash.hexdigest()
+        base_target = self.layer_target(f"crown_base_{base_hash}.tar.gz")
+        if base_target.exists():
+            console.log(f"Base layer {base_hash} already uploaded")
+        else:
+            _base_tarball = os.path.join(_layer_dir, base_target.basename)
+            if not os.path.exists(_base_tarball):
+                console.log(f"Creating base layer {base_hash}")
+                # pack to a temporary file first, other tasks may pack the same layer
+                _tmp_tarball = f"{_base_tarball}.{os.getpid()}.tmp"
+                with tarfile.open(_tmp_tarball, "w:gz") as tar:
+                    for relpath in base_files:
+                        tar.add(os.path.join(_unpacked_dir, relpath), arcname=relpath)
+                os.rename(_tmp_tarball, _base_tarball)
+            if not self.upload_tarball(base_target, _base_tarball, 10):
+                raise Exception(f"Upload of base layer {base_hash} failed")
+        # the executable layer only contains the executable itself
+        _executable = f"{_config}_{_sample_type}_{_era}"
+        executable_target = self.layer_target(
+            f"crown_{_analysis}_{_config}_{_sample_type}_{_era}{_shard}_executable.tar.gz"
+        )
+        _executable_tarball = os.path.join(_layer_dir, executable_target.basename)
+        console.log(f"Creating executable layer for {_sample_type} {_era}")
+        with tarfile.open(_executable_tarball, "w:gz") as tar:
+            tar.add(os.path.join(_unpacked_dir, _executable), arcname=_executable)
+        if not self.upload_tarball(executable_target, _executable_tarball, 10):
+            raise Exception(f"Upload of executable layer {_executable} failed")
+        os.remove(_executable_tarball)
+        output.parent.touch()
+        output.dump(
+            {
+                "base": {"path": base_target.path, "hash": base_hash},
+                "executable": {"path": executable_target.path, "name": _executable},
+            },
+            formatter="json",
+        )
         console.rule(
-            f"Finished CROWNBuild for {_analysis} {_config} {_sample_type} {_era}"
+            f"Finished CROWNBuildLayered for {_analysis} {_config} {_sample_type} {_era}"
         )
@@ -4,6 +4,7 @@ from framework import console
 from QuantitiesMap import QuantitiesMap
 from helpers.helpers import convert_to_comma_seperated
 from CROWNBase import CROWNBuildBase
+from CROWNBuildRemote import remote_build_requirement, friend_build_groups
 from BuildCROWNLib import BuildCROWNLib
 
 
@@ -20,6 +21,14 @@ class CROWNBuildFriend(CROWNBuildBase):
     nick = luigi.Parameter(significant=False)
 
     def requires(self):
+        if self.remote_build:
+            return {
+                "remote_build": remote_build_requirement(
+                    self, friend_build_groups(self)
+                )
+            }
+        if self.combined_build:
+            return {"combined_build": self.combined_friend_build()}
         results = {"quantities_map": QuantitiesMap.req(self)}
         results["crownlib"] = BuildCROWNLib.req(self)
         return results
@@ -37,6 +46,12 @@ class CROWNBuildFriend(CROWNBuildBase):
         return target
 
     def run(self):
+        if self.remote_build:
+            self.check_remote_build()
+            return
+        if self.combined_build:
+            self.pack_from_combined_build()
+            return
         crownlib = self.input()["crownlib"]
         # get output file path
         output = self.output()
@@ -113,6 +128,19 @@ class CROWNBuildFriend(CROWNBuildBase):
                 output.basename,  # TARBALLNAME=$10
                 _quantities_map_file,  # QUANTITIESMAP=$11
             ]
-            self.run_command_readable(command)
+            # configure the optional compiler cache via the environment of the compile script
+            compiler_cache = self.compiler_cache()
+            command = (
+                compiler_cache.environment(
+                    os.path.commonpath([_crown_path, _build_dir])
+                )
+                + command
+            )
+            # share the cores with all other builds running on this machine
+            with self.compile_slot_allocator().slots(log=console.log) as jobserver:
+                command = jobserver.environment() + command
+                command.append(str(jobserver.jobs))  # MAKE_JOBS=$12
+                self.run_command_readable(command, pass_fds=jobserver.pass_fds)
+            compiler_cache.report(_build_dir, log=console.log)
             self.upload_tarball(output, os.path.join(_install_dir, output.basename), 10)
         console.rule("Finished CROWNBuildFriend")
@@ -0,0 +1,175 @@
+import luigi
+import os
+from framework import console
+from QuantitiesMap import QuantitiesMap
+from helpers.helpers import convert_to_comma_seperated
+from helpers.CompactQuantitiesMap import CompactQuantitiesMap
+from CROWNBase import CROWNBuildBase
+from BuildCROWNLib import BuildCROWNLib
+
+
+class CROWNBuildFriendCombined(CROWNBuildBase):
+    """
+    Gather and compile CROWN for friend tree production once for all sample types and eras of a
+    production. The tarballs of the single sample types and eras are packed by CROWNBuildFriend and
+    CROWNBuildMultiFriend from the combined install directory.
+    """
+
+    # additional configuration variables
+    friend_config = luigi.Parameter()
+    friend_name = luigi.Parameter()
+    pair_nicks = luigi.DictParameter(
+        significant=False,
+        description="Mapping of sample types to a mapping of eras to one nick of the sample type and era, used to get the quantities maps.",
+    )
+    friend_dependencies = luigi.ListParameter(significant=False, default=[])
+    friend_mapping = luigi.DictParameter(significant=False, default={})
+
+    def requires(self):
+        results = {"crownlib": BuildCROWNLib.req(self)}
+        # friends depending on other friends need the quantities maps of these friends as well
+        if self.friend_dependencies:
+            # imported here, as FriendQuantitiesMap depends on CROWNFriends, which depends on this task
+            from FriendQuantitiesMap import FriendQuantitiesMap
+
+            quantities_map_task = FriendQuantitiesMap
+        else:
+            quantities_map_task = QuantitiesMap
+        for sample_type in self.pair_nicks:
+            for era, nick in self.pair_nicks[sample_type].items():
+                quantities_map = quantities_map_task.req(
+                    self, nick=nick, era=era, sample_type=sample_type
+                )
+                results[f"quantities_map_{sample_type}_{era}"] = quantities_map
+        return results
+
+    def output(self):
+        target = self.remote_target(
+            f"crown_friends_{self.analysis}_{self.friend_config}_{self.friend_name}_{self.get_tarball_hash()}.hash"
+        )
+        return target
+
+    def install_tag(self):
+        return f"{self.production_tag}/CROWNFriends_{self.analysis}_{self.friend_config}_{self.friend_name}"
+
+    def merge_quantities_maps(self, filename):
+        """
+        The function `merge_quantities_maps` merges the quantities maps of all sample types and eras into
+        a single file, that is passed to the combined build.
+
+        :param filename: The path of the merged quantities map
+        """
+        quantities_map = CompactQuantitiesMap()
+        for name, inputs in self.input().items():
+            if not name.startswith("quantities_map_"):
+                continue
+            quantity_target = []
+            for target in inputs["collection"]._iter_flat():
+                quantity_target = target[1]
+            if len(quantity_target) != 1:
+                raise Exception(
+                    f"There should be only one quantities map file, but found {len(quantity_target)} \n Full map: \n {quantity_target}"
+                )
+            with quantity_target[0].localize("r") as _file:
+                quantities_map.update(CompactQuantitiesMap.load(_file.path))
+        # expanded for CROWN by the compile script
+        quantities_map.dump(filename)
+
+    def run(self):
+        crownlib = self.input()["crownlib"]
+        output = self.output()
+        _shifts = convert_to_comma_seperated(self.shifts)
+        _scopes = convert_to_comma_seperated(self.scopes)
+        _analysis = str(self.analysis)
+        _friend_config = str(self.friend_config)
+        _friend_name = str(self.friend_name)
+        _install_dir = os.path.join(str(self.install_dir), self.install_tag())
+        _build_dir = os.path.join(str(self.build_dir), self.install_tag())
+        _crown_path = os.path.abspath("CROWN")
+        _compile_script = os.path.join(
+            str(os.path.abspath("processor")),
+            "tasks",
+            "scripts",
+            "compile_crown_friends.sh",
+        )
+        if os.path.exists(os.path.join(_install_dir, output.basename)):
+            console.log(f"build already existing in tarball directory {_install_dir}")
+            self.upload_tarball(
+                output, os.path.join(os.path.abspath(_install_dir), output.basename), 10
+            )
+            return
+        # CMake builds all combinations of the given sample types and eras, so eras are
+        # grouped by the sample types that are required for them
+        groups = {}
+        for sample_type in self.pair_nicks:
+            for era in self.pair_nicks[sample_type]:
+                groups.setdefault(era, set()).add(sample_type)
+        builds = {}
+        for era, sample_types in groups.items():
+            builds.setdefault(tuple(sorted(sample_types)), []).append(era)
+        console.rule(f"Building new combined CROWN Friend build for {self.friend_name}")
+        _build_dir, _install_dir = self.setup_build_environment(
+            _build_dir, _install_dir, crownlib
+        )
+        _quantities_map_file = os.path.join(_build_dir, "quantities_map.json")
+        self.merge_quantities_maps(_quantities_map_file)
+        for i, (sample_types, eras) in enumerate(builds.items()):
+            _sample_types = convert_to_comma_seperated(list(sample_types))
+            _eras = convert_to_comma_seperated(sorted(eras))
+            _group_build_dir = _build_dir
+            if len(builds) > 1:
+                _group_build_dir, _ = self.setup_build_environment(
+                    os.path.join(_build_dir, f"group_{i}"), _install_dir, crownlib
+                )
+            # actual payload:
+            console.rule(f"Starting cmake step for CROWN Friends {self.friend_name}")
+            console.log(f"Using CROWN {_crown_path}")
+            console.log(f"Using build_directory {_group_build_dir}")
+            console.log(f"Using install directory {_install_dir}")
+            console.log("Settings used: ")
+            console.log(f"Analysis: {_analysis}")
+            console.log(f"Friend Config: {_friend_config}")
+            console.log(f"Friend Name: {_friend_name}")
+            console.log(f"Sampletypes: {_sample_types}")
+            console.log(f"Eras: {_eras}")
+            console.log(f"Scopes: {_scopes}")
+            console.log(f"Shifts: {_shifts}")
+            console.log(f"Quantities map: {_quantities_map_file}")
+            console.rule("")
+
+            # run crown compilation script, the tarballs are packed per sample type and era later
+            command = [
+                "bash",
+                _compile_script,
+                _crown_path,  # CROWNFOLDER=$1
+                _analysis,  # ANALYSIS=$2
+                _friend_config,  # CONFIG=$3
+                _sample_types,  # SAMPLES=$4
+                _eras,  # ERAS=$5
+                _scopes,  # SCOPES=$6
+                _shifts,  # SHIFTS=$7
+                _install_dir,  # INSTALLDIR=$8
+                _group_build_dir,  # BUILDDIR=$9
+                "none",  # TARBALLNAME=$10
+                _quantities_map_file,  # QUANTITIESMAP=$11
+            ]
+            # configure the optional compiler cache via the environment of the compile script
+            compiler_cache = self.compiler_cache()
+            command = (
+                compiler_cache.environment(
+                    os.path.commonpath([_crown_path, _group_build_dir])
+                )
+                + command
+            )
+            # share the cores with all other builds running on this machine
+            with self.compile_slot_allocator().slots(log=console.log) as jobserver:
+                command = jobserver.environment() + command
+                command.append(str(jobserver.jobs))  # MAKE_JOBS=$12
+                self.run_command_readable(command, pass_fds=jobserver.pass_fds)
+            compiler_cache.report(_group_build_dir, log=console.log)
+        console.rule("Finished CROWNBuildFriendCombined")
+        # upload an small file to signal that the build is done
+        with open(os.path.join(_install_dir, output.basename), "w") as f:
+            f.write("CROWN friend build done")
+        output.parent.touch()
+        output.copy_from_local(os.path.join(_install_dir, output.basename))
@@ -0,0 +1,214 @@
+import law
+import luigi
+import os
+from law.util import flatten
+from luigi.task_register import Register
+from framework import console
+from framework import HTCondorWorkflow
+from BuildCROWNLib import BuildCROWNLib, set_crownlib_hash
+from CROWNBase import CROWNBuildBase
+
+
+def remote_build_requirement(task, groups):
+    """
+    The function `remote_build_requirement` returns the CROWNBuildRemote workflow compiling the given
+    builds in HTCondor jobs.
+
+    :param task: The build task requiring the remote build
+    :param groups: A list of groups of build tasks, each group is run in one job
+    :return: the CROWNBuildRemote workflow
+    """
+    groups = [
+        [
+            {
+                name: value
+                for name, value in build.to_str_params().items()
+                if name not in build.interactive_params
+            }
+            for build in group
+        ]
+        for group in groups
+    ]
+    builds = [params for group in groups for params in group]
+    # parameters shared by all builds are passed only once, to keep the job arguments short
+    common = {
+        name: value
+        for name, value in builds[0].items()
+        if all(params.get(name) == value for params in builds)
+    }
+    return CROWNBuildRemote.req(
+        task,
+        # the build jobs request their cores via their own configuration
+        _exclude=["htcondor_request_cpus"],
+        build_task_family=task.get_task_family(),
+        build_params=common,
+        build_groups=[
+            [
+                {name: value for name, value in params.items() if name not in common}
+                for params in group
+            ]
+            for group in groups
+        ],
+    )
+
+
+def ntuple_build_groups(task):
+    """
+    The function `ntuple_build_groups` groups the ntuple builds of all sample types and eras by era, so
+    that each job compiles CROWN for all sample types of one era.
+
+    :param task: The CROWNBuild or CROWNBuildLayered task
+    :return: a list of groups of build tasks
+    """
+    return [
+        [
+            type(task).req(
+                task,
+                era=era,
+                sample_type=sample_type,
+                all_eras=[era],
+                remote_build=False,
+            )
+            for sample_type in task.all_sample_types
+        ]
+        for era in task.all_eras
+    ]
+
+
+def friend_build_groups(task):
+    """
+    The function `friend_build_groups` returns the friend builds of all sample types and eras of the
+    production. Friend builds are compiled per sample type and era, so each is run in its own job,
+    unless they are packed from a combined build.
+
+    :param task: The CROWNBuildFriend or CROWNBuildMultiFriend task
+    :return: a list of groups of build tasks
+    """
+    pair_nicks = task.all_pair_nicks()
+    builds = [
+        type(task).req(
+            task,
+            era=era,
+            sample_type=sample_type,
+            nick=nick,
+            pair_nicks=pair_nicks,
+            remote_build=False,
+        )
+        for sample_type in sorted(pair_nicks)
+        for era, nick in sorted(pair_nicks[sample_type].items())
+    ]
+    if task.combined_build:
+        return [builds]
+    return [[build] for build in builds]
+
+
+class CROWNBuildRemote(HTCondorWorkflow, law.LocalWorkflow):
+    """
+    Compile CROWN in HTCondor jobs instead of on the submitting machine. Each branch runs a group of
+    build tasks, including the builds they depend on, in one job, and the tarballs are uploaded from
+    the job. All other requirements of the builds, like the CROWN library and the quantities maps,
+    are run before the jobs are submitted. With --workflow local, the branches are run locally.
+    """
+
+    build_task_family = luigi.Parameter(
+        description="Task family of the build tasks, e.g. CROWNBuild or CROWNBuildFriend."
+    )
+    build_params = luigi.DictParameter(
+        description="String parameters shared by all build tasks."
+    )
+    build_groups = luigi.ListParameter(
+        description="Groups of build tasks run in the same job, given by the string parameters specific to each build task."
+    )
+    crownlib_hash = luigi.Parameter(
+        default="",
+        significant=False,
+        description="Hash of the CROWN library, set for the jobs, as the CROWN git repository is not shipped with them.",
+    )
+
+    def build_tasks(self, group):
+        """
+        The function `build_tasks` creates the build tasks of a group.
+
+        :param group: The string parameters specific to each build task of the group
+        :return: a list of build tasks
+        """
+        task_cls = Register.get_task_cls(self.build_task_family)
+        tasks = []
+        for specific_params in group:
+            params = dict(self.build_params)
+            params.update(specific_params)
+            # the requested cores are the compile budget of the job
+            params["compile_slots"] = str(self.htcondor_request_cpus)
+            tasks.append(task_cls.from_str_params(params))
+        return tasks
+
+    def create_branch_map(self):
+        return {i: group for i, group in enumerate(self.build_groups)}
+
+    def workflow_requires(self):
+        requirements = super(CROWNBuildRemote, self).workflow_requires()
+        # requirements of the builds, that are not builds themselves, have to exist before the jobs start
+        external = {}
+
+        def collect(task):
+            for requirement in flatten(task.requires()):
+                if isinstance(requirement, CROWNBuildBase):
+                    collect(requirement)
+                else:
+                    external[requirement.task_id] = requirement
+
+        for group in self.build_groups:
+            for task in self.build_tasks(group):
+                collect(task)
+        requirements["external"] = list(external.values())
+        return requirements
+
+    def output(self):
+        return [task.output() for task in self.build_tasks(self.branch_data)]
+
+    def cli_args(self, exclude=None, replace=None):
+        # the CROWN git repository is not shipped with the jobs, so the hash of the CROWN library is
+        # determined on the submitting machine
+        replace = dict(replace or {})
+        if "crownlib_hash" not in replace:
+            replace["crownlib_hash"] = (
+                self.crownlib_hash or BuildCROWNLib.req(self).crownlib_hash()
+            )
+        return super(CROWNBuildRemote, self).cli_args(exclude=exclude, replace=replace)
+
+    def htcondor_output_directory(self):
+        # separate the htcondor files of the different remote builds of the same production
+        return (
+            super(CROWNBuildRemote, self)
+            .htcondor_output_directory()
+            .child(f"{self.build_task_family}_{self.task_id[-10:]}", type="d")
+        )
+
+    def run_build(self, task):
+        """
+        The function `run_build` runs a build task, after running all builds it depends on.
+
+        :param task: The build task
+        """
+        if task.complete():
+            console.log(f"{task.get_task_family()} {task.task_id} already done")
+            return
+        for requirement in flatten(task.requires()):
+            if isinstance(requirement, CROWNBuildBase):
+                self.run_build(requirement)
+            elif not requirement.complete():
+                raise Exception(
+                    f"Requirement {requirement.task_id} of {task.task_id} does not exist"
+                )
+        console.rule(f"Running {task.get_task_family()} {task.task_id}")
+        task.run()
+
+    def run(self):
+        # the compile scripts set up CROWN relative to the analysis path
+        if not os.getenv("ANALYSIS_PATH"):
+            os.environ["ANALYSIS_PATH"] = os.getcwd()
+        if self.crownlib_hash:
+            set_crownlib_hash(BuildCROWNLib.req(self).crown_path(), self.crownlib_hash)
+        for task in self.build_tasks(self.branch_data):
+            self.run_build(task)
+        console.rule(f"Finished CROWNBuildRemote branch {self.branch}")
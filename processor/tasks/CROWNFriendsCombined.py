@@ -0,0 +1,217 @@
+import law
+import luigi
+import os
+from CROWNBuildFriend import CROWNBuildFriend
+from CROWNFriends import CROWNFriends
+from CROWNRun import CROWNRun
+from framework import console
+from helpers.helpers import create_abspath
+from CROWNBase import CROWNExecuteBase
+
+law.contrib.load("wlcg")
+
+
+class CROWNFriendsCombined(CROWNExecuteBase):
+    """
+    Run several CROWN friend executables on the same ntuple file in one job. The ntuple is staged
+    once and read by all friend executables. The outputs are written to the same locations as the
+    ones of the corresponding CROWNFriends tasks.
+    """
+
+    friend_configs = luigi.ListParameter()
+    friend_names = luigi.ListParameter()
+    config = luigi.Parameter(significant=False)
+    nick = luigi.Parameter()
+    analysis = luigi.Parameter()
+    production_tag = luigi.Parameter()
+    pair_nicks = luigi.DictParameter(
+        significant=False,
+        default={},
+        description="Mapping of sample types to a mapping of eras to one nick of the sample type and era, used by the combined friend build.",
+    )
+    friend_chunks = luigi.IntParameter(
+        default=1,
+        significant=False,
+        description="Number of contiguous entry ranges of the ntuple, that are processed in parallel by each friend executable. The friend chunks are merged in order afterwards.",
+    )
+
+    @property
+    def friend_name(self):
+        # used to identify the job files and the batch name of the combined friends
+        return "_".join(self.friend_names)
+
+    @property
+    def friend_config(self):
+        # used in the polling status line
+        return ",".join(self.friend_configs)
+
+    def friend_tasks(self):
+        """
+        The function `friend_tasks` returns the CROWNFriends workflow of each friend config.
+        :return: a dictionary mapping the friend name to the CROWNFriends workflow
+        """
+        if len(self.friend_configs) != len(self.friend_names):
+            raise Exception(
+                f"Got {len(self.friend_configs)} friend configs, but {len(self.friend_names)} friend names"
+            )
+        return {
+            friend_name: CROWNFriends.req(
+                self, friend_config=friend_config, friend_name=friend_name
+            )
+            for friend_config, friend_name in zip(
+                self.friend_configs, self.friend_names
+            )
+        }
+
+    def friend_tarballs(self):
+        return {
+            f"friend_tarball_{friend_name}": CROWNBuildFriend.req(
+                self, friend_config=friend_config, friend_name=friend_name
+            )
+            for friend_config, friend_name in zip(
+                self.friend_configs, self.friend_names
+            )
+        }
+
+    def workflow_requires(self):
+        requirements = {}
+        requirements["ntuples"] = CROWNRun(
+            nick=self.nick,
+            analysis=self.analysis,
+            config=self.config,
+            production_tag=self.production_tag,
+            all_eras=self.all_eras,
+            shifts=self.shifts,
+            all_sample_types=self.all_sample_types,
+            era=self.era,
+            sample_type=self.sample_type,
+            scopes=self.scopes,
+        )
+        requirements.update(self.friend_tarballs())
+        return requirements
+
+    def requires(self):
+        return self.friend_tarballs()
+
+    def create_branch_map(self):
+        """
+        The function `create_branch_map` creates the same branch map as the CROWNFriends workflow, so
+        that the branches of this task and of the CROWNFriends tasks correspond to each other.
+        :return: a dictionary called `branch_map`.
+        """
+        branch_map = {}
+        counter = 0
+        inputs = self.input()["ntuples"]["collection"]
+        branches = inputs._flat_target_list
+        for inputfile in branches:
+            if not inputfile.path.endswith(".root"):
+                continue
+            # identify the scope from the inputfile
+            scope = inputfile.path.split("/")[-2]
+            if scope in self.scopes:
+                branch_map[counter] = {
+                    "scope": scope,
+                    "nick": self.nick,
+                    "era": self.era,
+                    "sample_type": self.sample_type,
+                    "inputfile": os.path.expandvars(self.wlcg_path) + inputfile.path,
+                    "inputpath": inputfile.path,
+                    "filecounter": int(counter / len(self.scopes)),
+                }
+                counter += 1
+        return branch_map
+
+    def output(self):
+        """
+        The function `output` returns the outputs of the corresponding CROWNFriends branches.
+        :return: a dictionary mapping the friend name to the list of output targets
+        """
+        return {
+            friend_name: task.as_branch(self.branch).output()
+            for friend_name, task in self.friend_tasks().items()
+        }
+
+    def run(self):
+        """
+        The function stages the input ntuple once and runs all friend executables on it, uploading
+        the friend trees and quantities maps of each friend config.
+        """
+        outputs = self.output()
+        branch_data = self.branch_data
+        scope = branch_data["scope"]
+        era = branch_data["era"]
+        sample_type = branch_data["sample_type"]
+        _base_workdir = os.path.abspath("workdir")
+        create_abspath(_base_workdir)
+        if self.is_local_output:
+            ntuple = law.LocalFileTarget(branch_data["inputpath"])
+        else:
+            ntuple = law.wlcg.WLCGFileTarget(branch_data["inputpath"])
+        environments = {}
+        console.rule("Starting CROWNFriendsCombined")
+        console.log("Staging inputfile {}".format(branch_data["inputfile"]))
+        with ntuple.localize("r") as _file:
+            _inputfile = os.path.abspath(_file.path)
+            for friend_config, friend_name in zip(
+                self.friend_configs, self.friend_names
+            ):
+                targets = outputs[friend_name]
+                if all(target.exists() for target in targets):
+                    console.log(f"Outputs of {friend_name} already exist, skipping")
+                    continue
+                output = targets[0]
+                _workdir = os.path.join(
+                    _base_workdir, f"{self.production_tag}_{friend_name}"
+                )
+                create_abspath(_workdir)
+                self.unpack_tarball(
+                    self.input()[f"friend_tarball_{friend_name}"],
+                    _workdir,
+                    "{}_{}_{}".format(friend_config, sample_type, era),
+                )
+                # friend tarballs built from the same CROWN setup share the environment
+                init_script = "{}/init.sh".format(_workdir)
+                with open(init_script, "r") as f:
+                    init_content = f.read()
+                if init_content not in environments:
+                    environments[init_content] = self.set_environment(init_script)
+                # set the outputfilename to the first name in the output list, removing the scope suffix
+                _outputfile = str(
+                    output.basename.replace("_{}.root".format(scope), ".root")
+                )
+                _executable = "./{}_{}_{}_{}".format(
+                    friend_config, sample_type, era, scope
+                )
+                console.log("Executable: {}".format(_executable))
+                console.log("outputfile {}".format(_outputfile))
+                console.log("workdir {}".format(_workdir))
+                if self.friend_chunks > 1:
+                    self.run_friend_chunked(
+                        executable=_executable,
+                        outputfile=_outputfile,
+                        inputfiles=[_inputfile],
+                        scope=scope,
+                        workdir=_workdir,
+                        env=environments[init_content],
+                        chunks=self.friend_chunks,
+                    )
+                else:
+                    self.run_executable(
+                        _executable,
+                        [_outputfile, _inputfile],
+                        _workdir,
+                        environments[init_content],
+                    )
+                local_filename = os.path.join(
+                    _workdir,
+                    _outputfile.replace(".root", "_{}.root".format(scope)),
+                )
+                output.parent.touch()
+                output.copy_from_local(local_filename)
+                console.log("Uploaded {}".format(output.uri()))
+                # quantities_map json for each scope only needs to be created once per sample
+                if branch_data["filecounter"] == 0:
+                    self.create_quantities_map(
+                        local_filename, _workdir, scope, targets[1]
+                    )
+        console.rule("Finished CROWNFriendsCombined")
@@ -4,9 +4,6 @@ import os
 from CROWNBuildMultiFriend import CROWNBuildMultiFriend
 from CROWNRun import CROWNRun
 from CROWNFriends import CROWNFriends
-import tarfile
-import subprocess
-import time
 from framework import console
 from framework import HTCondorWorkflow
 from law.config import Config
@@ -26,6 +23,16 @@ class CROWNMultiFriends(CROWNExecuteBase):
     nick = luigi.Parameter()
     analysis = luigi.Parameter()
     production_tag = luigi.Parameter()
+    pair_nicks = luigi.DictParameter(
+        significant=False,
+        default={},
+        description="Mapping of sample types to a mapping of eras to one nick of the sample type and era, used by the combined friend build.",
+    )
+    friend_chunks = luigi.IntParameter(
+        default=1,
+        significant=False,
+        description="Number of contiguous entry ranges of the ntuple and its friends, that are processed in parallel. The friend chunks are merged in order afterwards.",
+    )
 
     def workflow_requires(self):
         requirements = {}
@@ -180,32 +187,12 @@ class CROWNMultiFriends(CROWNExecuteBase):
         ]
         # set the outputfilename to the first name in the output list, removing the scope suffix
         _outputfile = str(output.basename.replace("_{}.root".format(scope), ".root"))
-        _abs_executable = "{}/{}_{}_{}".format(
-            _workdir, self.friend_config, sample_type, era
-        )
-        console.log(
-            "Getting CROWN friend_tarball from {}".format(
-                self.input()["friend_tarball"].uri()
-            )
-        )
-        with self.input()["friend_tarball"].localize("r") as _file:
-            _tarballpath = _file.path
         # first unpack the tarball if the exec is not there yet
-        tempfile = os.path.join(
+        self.unpack_tarball(
+            self.input()["friend_tarball"],
             _workdir,
-            "unpacking_{}_{}_{}".format(self.friend_config, sample_type, era),
+            "{}_{}_{}".format(self.friend_config, sample_type, era),
         )
-        while os.path.exists(tempfile):
-            time.sleep(1)
-        if not os.path.exists(_abs_executable):
-            # create a temp file to signal that we are unpacking
-            open(
-                tempfile,
-                "a",
-            ).close()
-            tar = tarfile.open(_tarballpath, "r:gz")
-            tar.extractall(_workdir)
-            os.remove(tempfile)
         # set environment using env script
         my_env = self.set_environment("{}/init.sh".format(_workdir))
         _crown_args = [_outputfile] + [_inputfile] + _friend_inputs
@@ -218,31 +205,18 @@ class CROWNMultiFriends(CROWNExecuteBase):
         console.log("inputfile(s) {} {}".format(_inputfile, _friend_inputs))
         console.log("outputfile {}".format(_outputfile))
         console.log("workdir {}".format(_workdir))  # run CROWN
-        with subprocess.Popen(
-            [_executable] + _crown_args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            bufsize=1,
-            universal_newlines=True,
-            env=my_env,
-            cwd=_workdir,
-        ) as p:
-            for line in p.stdout:
-                if line != "\n":
-                    console.log(line.replace("\n", ""))
-            for line in p.stderr:
-                if line != "\n":
-                    console.log("Error: {}".format(line.replace("\n", "")))
-        if p.returncode != 0:
-            console.log(
-                "Error when running crown {}".format(
-                    [_executable] + _crown_args,
-                )
+        if self.friend_chunks > 1:
+            self.run_friend_chunked(
+                executable=_executable,
+                outputfile=_outputfile,
+                inputfiles=[_inputfile] + _friend_inputs,
+                scope=scope,
+                workdir=_workdir,
+                env=my_env,
+                chunks=self.friend_chunks,
             )
-            console.log("crown returned non-zero exit status {}".format(p.returncode))
-            raise Exception("crown failed")
         else:
-            console.log("Successful")
+            self.run_executable(_executable, _crown_args, _workdir, my_env)
         console.log("Output files afterwards: {}".format(os.listdir(_workdir)))
         output.parent.touch()
         local_filename = os.path.join(
@@ -252,27 +226,7 @@ class CROWNMultiFriends(CROWNExecuteBase):
         # for each outputfile, add the scope suffix
         output.copy_from_local(local_filename)
         if create_quantities_map and quantities_map_output is not None:
-            quantities_map_output.parent.touch()
-            inputfile = os.path.join(
-                _workdir,
-                _outputfile.replace(".root", "_{}.root".format(scope)),
-            )
-            local_outputfile = os.path.join(_workdir, "quantities_map.json")
-            self.run_command(
-                command=[
-                    "python3",
-                    "processor/tasks/helpers/GetQuantitiesMap.py",
-                    "--input {}".format(inputfile),
-                    "--era {}".format(self.branch_data["era"]),
-                    "--scope {}".format(scope),
-                    "--sample_type {}".format(self.branch_data["sample_type"]),
-                    "--output {}".format(local_outputfile),
-                ],
-                sourcescript=[
-                    "{}/init.sh".format(_workdir),
-                ],
-                silent=True,
+            self.create_quantities_map(
+                local_filename, _workdir, scope, quantities_map_output
             )
-            # copy the generated quantities_map json to the output
-            quantities_map_output.copy_from_local(local_outputfile)
         console.rule("Finished CROWNMultiFriends")
@@ -0,0 +1,243 @@
+import law
+import luigi
+import os
+import socket
+from CROWNRun import CROWNRun
+from ConfigureDatasets import ConfigureDatasets
+from framework import console
+from framework import Task
+from CROWNBase import CROWNProductionWorkflow
+from helpers.WorkQueue import FileWorkQueue, run_worker
+
+
+class CROWNPilotBase(Task):
+    scopes = luigi.ListParameter()
+    shifts = luigi.Parameter()
+    analysis = luigi.Parameter()
+    config = luigi.Parameter()
+    production_tag = luigi.Parameter()
+    all_sample_types = luigi.ListParameter(significant=False)
+    all_eras = luigi.ListParameter(significant=False)
+    pilot_queue_dir = luigi.Parameter(
+        significant=False,
+        description="Directory on a shared file system, that is accessible from the submission node and all worker nodes, used for the pilot work queue.",
+    )
+    pilot_max_attempts = luigi.IntParameter(
+        default=3,
+        significant=False,
+        description="Number of attempts per CROWNRun branch, before it is marked as failed.",
+    )
+
+    def queue(self):
+        """
+        The function `queue` returns the work queue of this production.
+        :return: a FileWorkQueue located in the pilot_queue_dir
+        """
+        return FileWorkQueue(
+            os.path.join(
+                str(self.pilot_queue_dir),
+                str(self.production_tag),
+                f"{self.analysis}_{self.config}",
+            ),
+            max_attempts=self.pilot_max_attempts,
+        )
+
+    def queue_finished(self):
+        """
+        The function `queue_finished` checks if all branches of the work queue were processed
+        successfully.
+        :return: True if no branch is pending, claimed or failed
+        """
+        counts = self.queue().counts()
+        return counts["pending"] == counts["claimed"] == counts["failed"] == 0
+
+    def sample_task(self, nick, era, sample_type):
+        return CROWNRun(
+            nick=nick,
+            analysis=self.analysis,
+            config=self.config,
+            scopes=self.scopes,
+            shifts=self.shifts,
+            production_tag=self.production_tag,
+            all_eras=self.all_eras,
+            all_sample_types=self.all_sample_types,
+            era=era,
+            sample_type=sample_type,
+        )
+
+
+class CROWNPilotQueue(CROWNPilotBase):
+    """
+    Fill the pilot work queue with all CROWNRun branches of the given samples, that are not
+    produced yet
+    """
+
+    sample_details = luigi.DictParameter(
+        description="Mapping of sample nicks to their era and sample_type."
+    )
+
+    def requires(self):
+        requirements = {}
+        for nick in self.sample_details:
+            requirements[f"dataset_{nick}"] = ConfigureDatasets(
+                nick=nick,
+                production_tag=self.production_tag,
+                era=self.sample_details[nick]["era"],
+                sample_type=self.sample_details[nick]["sample_type"],
+            )
+        # the tarballs of all sample types and eras are the same for all samples
+        for nick, details in list(self.sample_details.items())[:1]:
+            sample_task = self.sample_task(nick, details["era"], details["sample_type"])
+            requirements.update(sample_task.tarball_requirements())
+        return requirements
+
+    def output(self):
+        # the queue is shared by all productions with the same tag, analysis and config, so the
+        # marker is keyed by the task, a rerun with other samples or shifts fills the queue again
+        return law.LocalFileTarget(
+            os.path.join(self.queue().path, f"filled_{self.task_id}.json")
+        )
+
+    def complete(self):
+        # failed branches are queued again, when the production is started again
+        return super().complete() and self.queue().counts()["failed"] == 0
+
+    def run(self):
+        queue = self.queue()
+        retried = queue.retry_failed()
+        if retried:
+            console.log(f"Queued {len(retried)} failed CROWNRun branches again")
+        added = 0
+        skipped = 0
+        for nick in self.sample_details:
+            era = self.sample_details[nick]["era"]
+            sample_type = self.sample_details[nick]["sample_type"]
+            task = self.sample_task(nick, era, sample_type)
+            for branch in task.get_branch_map():
+                if task.as_branch(branch).complete():
+                    skipped += 1
+                    continue
+                payload = {
+                    "nick": nick,
+                    "era": era,
+                    "sample_type": sample_type,
+                    "branch": branch,
+                }
+                if queue.put(f"{nick}__{branch}", payload):
+                    added += 1
+        console.log(
+            f"Added {added} CROWNRun branches to the queue {queue.path}, {skipped} branches are already done"
+        )
+        self.output().dump({"added": added, "skipped": skipped})
+
+
+class CROWNPilot(CROWNPilotBase, CROWNProductionWorkflow):
+    """
+    Pilot jobs, that set up the job environment once and then run CROWNRun branches claimed from
+    the work queue, until the queue is empty or the walltime budget is used up
+    """
+
+    batch_name_prefix = "pilot"
+
+    sample_details = luigi.DictParameter(
+        description="Mapping of sample nicks to their era and sample_type."
+    )
+    pilot_jobs = luigi.IntParameter(
+        default=10,
+        description="Number of pilot jobs to submit.",
+    )
+    pilot_walltime_margin = luigi.IntParameter(
+        default=900,
+        significant=False,
+        description="Seconds of the requested walltime that are kept free for the stage out and the job teardown.",
+    )
+    pilot_claim_timeout = luigi.IntParameter(
+        default=1800,
+        significant=False,
+        description="Seconds after which the claim of a branch without heartbeat is released again.",
+    )
+
+    def workflow_requires(self):
+        requirements = {}
+        requirements["queue"] = CROWNPilotQueue.req(self)
+        return requirements
+
+    def walltime_budget(self):
+        """
+        The function `walltime_budget` returns the seconds of the requested walltime, in which a
+        pilot claims new branches.
+
+        :return: the walltime budget in seconds
+        """
+        budget = int(self.htcondor_walltime) - self.pilot_walltime_margin
+        if budget <= 0:
+            raise Exception(
+                f"pilot_walltime_margin ({self.pilot_walltime_margin} s) leaves no time of the htcondor_walltime ({self.htcondor_walltime} s) to process branches"
+            )
+        return budget
+
+    def create_branch_map(self):
+        # fail before the pilots are submitted, if they could not process any branch
+        self.walltime_budget()
+        return {i: {"pilot": i} for i in range(self.pilot_jobs)}
+
+    def output(self):
+        return self.remote_target(f"pilot_{self.branch}.json")
+
+    def workflow_complete(self):
+        # the outputs of the pilots do not guarantee, that all branches of the queue were
+        # processed, e.g. if a claim was released after the last pilot stopped claiming
+        if not self.queue_finished():
+            return False
+        return NotImplemented
+
+    def complete(self):
+        if self.is_branch() and not self.queue_finished():
+            return False
+        return super().complete()
+
+    def run_item(self, payload):
+        task = self.sample_task(
+            payload["nick"], payload["era"], payload["sample_type"]
+        ).as_branch(payload["branch"])
+        if task.complete():
+            console.log(f"{payload['nick']} branch {payload['branch']} already done")
+            return
+        task.run()
+
+    def run(self):
+        queue = self.queue()
+        worker = f"{socket.gethostname()}_{os.getpid()}_pilot{self.branch}"
+        # release branches of pilots, that were killed while processing them
+        requeued = queue.requeue_stale(self.pilot_claim_timeout)
+        if requeued:
+            console.log(f"Released {len(requeued)} stale claims: {requeued}")
+        walltime = self.walltime_budget()
+        console.rule(f"Starting pilot {worker} with a walltime budget of {walltime} s")
+        summary = run_worker(
+            queue,
+            self.run_item,
+            walltime,
+            worker=worker,
+            heartbeat_interval=min(60, self.pilot_claim_timeout / 3),
+            log=console.log,
+        )
+        console.log(f"Queue status: {summary['counts']}")
+        console.rule("Finished pilot")
+        counts = summary["counts"]
+        if counts["failed"] > 0:
+            raise Exception(
+                f"{counts['failed']} branches failed {self.pilot_max_attempts} times, they are queued again when the production is restarted"
+            )
+        if counts["pending"] > 0:
+            # fail the job, so that law resubmits it and the remaining branches are processed
+            raise Exception(
+                f"Pilot stopped with {counts['pending']} branches left in the queue"
+            )
+        output = self.output()
+        output.parent.touch()
+        output.dump(summary)
+
+    def modify_polling_status_line(self, status_line):
+        status_line_pattern = f"pilots (Analysis: {self.analysis} Config: {self.config} Tag: {self.production_tag})"
+        return f"{status_line} - {law.util.colored(status_line_pattern, color='light_cyan')}"
@@ -1,11 +1,8 @@
 import law
 import luigi
 import os
-from CROWNBuild import CROWNBuild
-import tarfile
+from CROWNBuild import CROWNBuild, CROWNBuildLayered
 from ConfigureDatasets import ConfigureDatasets
-import subprocess
-import time
 from framework import console
 from law.config import Config
 from framework import Task, HTCondorWorkflow
@@ -20,6 +17,21 @@ class CROWNRun(CROWNExecuteBase):
 
     output_collection_cls = law.NestedSiblingFileCollection
     problematic_eras = luigi.ListParameter()
+    layered_artifacts = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="Use a shared base layer and small executable layers instead of one full tarball per sample type and era, see CROWNBuildLayered.",
+    )
+    single_threaded = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="Use single threaded executables, so that the entries are written in the order of the input files. Set for the nominal ntuples of shift sharded productions, whose entries have to align with the shards.",
+    )
+    layer_cache_dir = luigi.Parameter(
+        default="",
+        significant=False,
+        description="Directory the layers are cached in, shared by all jobs on a node. Defaults to a directory in the job workdir.",
+    )
 
     def workflow_requires(self):
         requirements = {}
@@ -31,22 +43,67 @@ class CROWNRun(CROWNExecuteBase):
             era=self.era,
             sample_type=self.sample_type,
         )
-        for sample_type in self.all_sample_types:
-            for era in self.all_eras:
-                requirements[f"tarball_{sample_type}_{era}"] = CROWNBuild.req(
-                    self, era=era, sample_type=sample_type
-                )
+        requirements.update(self.tarball_requirements())
         return requirements
 
     def requires(self):
+        requirements = {}
+        requirements.update(self.tarball_requirements())
+        return requirements
+
+    def tarball_requirements(self):
+        """
+        The function `tarball_requirements` returns the CROWN tarballs of all sample types and eras.
+        :return: a dictionary mapping the tarball name to the CROWNBuild task
+        """
         requirements = {}
         for sample_type in self.all_sample_types:
             for era in self.all_eras:
-                requirements[f"tarball_{sample_type}_{era}"] = CROWNBuild.req(
+                build = self.build_task_cls().req(
                     self, era=era, sample_type=sample_type
                 )
+                requirements[f"tarball_{sample_type}_{era}"] = build
         return requirements
 
+    def build_task_cls(self):
+        """
+        The function `build_task_cls` returns the task providing the CROWN executables.
+        """
+        return CROWNBuildLayered if self.layered_artifacts else CROWNBuild
+
+    def output_prefix(self):
+        """
+        The function `output_prefix` returns the directory prefix of all outputs, empty for the
+        standard ntuple production.
+        """
+        return ""
+
+    def workdir_name(self):
+        """
+        The function `workdir_name` returns the name of the directory the tarball is unpacked to.
+        """
+        return f"{self.production_tag}_{self.analysis}_{self.config}"
+
+    def quantities_map_path(self, scope):
+        """
+        The function `quantities_map_path` returns the path of the quantities map of a scope, that is
+        written by the first branch.
+        """
+        return "{prefix}{era}/{nick}/{scope}/{era}_{nick}_{scope}_quantities_map.json".format(
+            prefix=self.output_prefix(), era=self.era, nick=self.nick, scope=scope
+        )
+
+    def quantities_map_targets(self):
+        """
+        The function `quantities_map_targets` returns the quantities maps of all scopes, without
+        creating the branch outputs.
+        :return: a dictionary mapping the scope to the quantities map target
+        """
+        return {
+            scope: self.remote_target(self.quantities_map_path(scope))
+            for scope in self.scopes
+        }
+
     def create_branch_map(self):
         branch_map = {}
         branchcounter = 0
@@ -85,7 +142,8 @@ class CROWNRun(CROWNExecuteBase):
     def output(self):
         targets = []
         nicks = [
-            "{era}/{nick}/{scope}/{nick}_{branch}.root".format(
+            "{prefix}{era}/{nick}/{scope}/{nick}_{branch}.root".format(
+                prefix=self.output_prefix(),
                 era=self.branch_data["era"],
                 nick=self.branch_data["nick"],
                 branch=self.branch,
@@ -95,14 +153,7 @@ class CROWNRun(CROWNExecuteBase):
         ]
         # quantities_map json for each scope only needs to be created once per sample
         if self.branch == 0:
-            nicks += [
-                "{era}/{nick}/{scope}/{era}_{nick}_{scope}_quantities_map.json".format(
-                    era=self.branch_data["era"],
-                    nick=self.branch_data["nick"],
-                    scope=scope,
-                )
-                for scope in self.scopes
-            ]
+            nicks += [self.quantities_map_path(scope) for scope in self.scopes]
         targets = self.remote_target(nicks)
         for target in targets:
             target.parent.touch()
@@ -117,9 +168,7 @@ class CROWNRun(CROWNExecuteBase):
         branch_data = self.branch_data
         _base_workdir = os.path.abspath("workdir")
         create_abspath(_base_workdir)
-        _workdir = os.path.join(
-            _base_workdir, f"{self.production_tag}_{self.analysis}_{self.config}"
-        )
+        _workdir = os.path.join(_base_workdir, self.workdir_name())
         create_abspath(_workdir)
         _inputfiles = branch_data["files"]
         _sample_type = branch_data["sample_type"]
@@ -130,28 +179,24 @@ class CROWNRun(CROWNExecuteBase):
                 "_{}.root".format(self.scopes[0]), ".root"
             )
         )
-        _abs_executable = "{}/{}_{}_{}".format(
-            _workdir, self.config, branch_data["sample_type"], branch_data["era"]
-        )
         _tarball = self.input()["tarball_{}_{}".format(_sample_type, _era)]
-        console.log(f"Getting CROWN tarball from {_tarball.uri()}")
-        with _tarball.localize("r") as _file:
-            _tarballpath = _file.path
-        # first unpack the tarball if the exec is not there yet
-        _tempfile = os.path.join(
-            _workdir,
-            "unpacking_{}_{}_{}".format(
-                self.config, branch_data["sample_type"], branch_data["era"]
-            ),
-        )
-        while os.path.exists(_tempfile):
-            time.sleep(1)
-        if not os.path.exists(_abs_executable) and not os.path.exists(_tempfile):
-            # create a temp file to signal that we are unpacking
-            open(_tempfile, "a").close()
-            tar = tarfile.open(_tarballpath, "r:gz")
-            tar.extractall(_workdir)
-            os.remove(_tempfile)
+        if self.layered_artifacts:
+            self.unpack_layers(
+                _tarball,
+                _workdir,
+                os.path.abspath(
+                    os.path.expandvars(self.layer_cache_dir or "workdir/layers")
+                ),
+            )
+        else:
+            # first unpack the tarball if the exec is not there yet
+            self.unpack_tarball(
+                _tarball,
+                _workdir,
+                "{}_{}_{}".format(
+                    self.config, branch_data["sample_type"], branch_data["era"]
+                ),
+            )
         # test running the source command
         console.rule("Testing Source command for CROWN")
         self.run_command(
@@ -173,31 +218,7 @@ class CROWNRun(CROWNExecuteBase):
         console.log("workdir {}".format(_workdir))  # run CROWN
         command = [_executable] + _crown_args
         console.log(f"Running command: {command}")
-        with subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            bufsize=1,
-            universal_newlines=True,
-            env=my_env,
-            cwd=_workdir,
-        ) as p:
-            for line in p.stdout:
-                if line != "\n":
-                    console.log(line.replace("\n", ""))
-            for line in p.stderr:
-                if line != "\n":
-                    console.log("Error: {}".format(line.replace("\n", "")))
-        if p.returncode != 0:
-            console.log(
-                "Error when running crown {}".format(
-                    [_executable] + _crown_args,
-                )
-            )
-            console.log("crown returned non-zero exit status {}".format(p.returncode))
-            raise Exception("crown failed")
-        else:
-            console.log("Successful")
+        self.run_executable(_executable, _crown_args, _workdir, my_env)
         console.log("Output files afterwards: {}".format(os.listdir(_workdir)))
         for i, outputfile in enumerate(rootfile_outputs):
             outputfile.parent.touch()
@@ -206,48 +227,20 @@ class CROWNRun(CROWNExecuteBase):
                 _outputfile.replace(".root", "_{}.root".format(self.scopes[i])),
             )
             # if the output files were produced in multithreaded mode,
-            # we have to open the files once again, setting the
-            # kEntriesReshuffled bit to false, otherwise,
+            # the kEntriesReshuffled bit has to be reset, otherwise,
             # we cannot add any friends to the trees
-            self.run_command(
-                command=[
-                    "python3",
-                    "processor/tasks/helpers/ResetROOTStatusBit.py",
-                    "--input {}".format(local_filename),
-                ],
-                sourcescript=[
-                    "{}/init.sh".format(_workdir),
-                ],
-                silent=True,
-            )
+            self.reset_status_bit(local_filename, _workdir)
             # for each outputfile, add the scope suffix
             outputfile.copy_from_local(local_filename)
         # write the quantities_map json, per scope This is only required once per sample,
         # only do it if the branch number is 0
         if self.branch == 0:
             for i, outputfile in enumerate(quantities_map_outputs):
-                outputfile.parent.touch()
                 inputfile = os.path.join(
                     _workdir,
                     _outputfile.replace(".root", "_{}.root".format(self.scopes[i])),
                 )
-                local_outputfile = os.path.join(_workdir, "quantities_map.json")
-
-                self.run_command(
-                    command=[
-                        "python3",
-                        "processor/tasks/helpers/GetQuantitiesMap.py",
-                        "--input {}".format(inputfile),
-                        "--era {}".format(self.branch_data["era"]),
-                        "--scope {}".format(self.scopes[i]),
-                        "--sample_type {}".format(self.branch_data["sample_type"]),
-                        "--output {}".format(local_outputfile),
-                    ],
-                    sourcescript=[
-                        "{}/init.sh".format(_workdir),
-                    ],
-                    silent=True,
+                self.create_quantities_map(
+                    inputfile, _workdir, self.scopes[i], outputfile
                 )
-                # copy the generated quantities_map json to the output
-                outputfile.copy_from_local(local_outputfile)
         console.rule("Finished CROWNRun")
@@ -0,0 +1,144 @@
+import law
+import luigi
+from CROWNRun import CROWNRun
+from ConfigureDatasets import ConfigureDatasets
+from framework import console
+from CROWNBase import CROWNProductionWorkflow
+
+
+class CROWNRunPacked(CROWNProductionWorkflow):
+    """
+    Run the CROWN ntuple production for many samples in shared jobs. The CROWNRun branches of
+    all samples are packed into jobs up to a target cost, given as the number of input files
+    per job. The outputs are written by the CROWNRun branch tasks themselves, so the output
+    layout is identical to the one of a standard production.
+    """
+
+    output_collection_cls = law.NestedSiblingFileCollection
+    batch_name_prefix = "packed"
+    scopes = luigi.ListParameter()
+    shifts = luigi.Parameter()
+    analysis = luigi.Parameter()
+    config = luigi.Parameter()
+    production_tag = luigi.Parameter()
+    all_sample_types = luigi.ListParameter(significant=False)
+    all_eras = luigi.ListParameter(significant=False)
+    sample_details = luigi.DictParameter(
+        description="Mapping of sample nicks to their era and sample_type."
+    )
+    files_per_job = luigi.IntParameter(
+        default=20,
+        description="Target number of input files processed by a single packed job.",
+    )
+
+    def sample_task(self, nick):
+        """
+        The function `sample_task` returns the CROWNRun workflow of a single sample, as it would be
+        created by a standard production.
+
+        :param nick: The sample nick
+        :return: The CROWNRun workflow task of the sample
+        """
+        return CROWNRun(
+            nick=nick,
+            analysis=self.analysis,
+            config=self.config,
+            scopes=self.scopes,
+            shifts=self.shifts,
+            production_tag=self.production_tag,
+            all_eras=self.all_eras,
+            all_sample_types=self.all_sample_types,
+            era=self.sample_details[nick]["era"],
+            sample_type=self.sample_details[nick]["sample_type"],
+        )
+
+    def workflow_requires(self):
+        requirements = {}
+        for nick in self.sample_details:
+            requirements[f"dataset_{nick}"] = ConfigureDatasets(
+                nick=nick,
+                production_tag=self.production_tag,
+                era=self.sample_details[nick]["era"],
+                sample_type=self.sample_details[nick]["sample_type"],
+            )
+        # the tarballs of all sample types and eras are the same for all samples
+        for nick in list(self.sample_details)[:1]:
+            requirements.update(self.sample_task(nick).tarball_requirements())
+        return requirements
+
+    def requires(self):
+        requirements = {}
+        for nick, _ in self.branch_data["branches"]:
+            sample_type = self.sample_details[nick]["sample_type"]
+            era = self.sample_details[nick]["era"]
+            tarball = f"tarball_{sample_type}_{era}"
+            tarballs = self.sample_task(nick).tarball_requirements()
+            requirements[tarball] = tarballs[tarball]
+        return requirements
+
+    def create_branch_map(self):
+        """
+        The function `create_branch_map` packs the branches of the CROWNRun workflows of all
+        samples into jobs. The branches are consumed in sample order, sorted by sample type and
+        era, so that consecutive branches of one job share the same CROWN executable. A job is
+        closed as soon as the next branch would exceed `files_per_job`.
+        :return: a dictionary mapping the job number to the list of (nick, branch) pairs and the
+        number of input files of the job.
+        """
+        nicks = sorted(
+            self.sample_details,
+            key=lambda nick: (
+                self.sample_details[nick]["sample_type"],
+                self.sample_details[nick]["era"],
+                nick,
+            ),
+        )
+        branch_map = {}
+        current = {"branches": [], "cost": 0}
+        for nick in nicks:
+            sample_branch_map = self.sample_task(nick).get_branch_map()
+            for branch, data in sample_branch_map.items():
+                cost = len(data["files"])
+                if current["branches"] and current["cost"] + cost > self.files_per_job:
+                    branch_map[len(branch_map)] = current
+                    current = {"branches": [], "cost": 0}
+                current["branches"].append((nick, branch))
+                current["cost"] += cost
+        if current["branches"]:
+            branch_map[len(branch_map)] = current
+        return branch_map
+
+    def branch_tasks(self):
+        """
+        The function `branch_tasks` returns the CROWNRun branch tasks that are packed into this job.
+        :return: a list of CROWNRun branch tasks
+        """
+        return [
+            self.sample_task(nick).as_branch(branch)
+            for nick, branch in self.branch_data["branches"]
+        ]
+
+    def output(self):
+        targets = []
+        for task in self.branch_tasks():
+            targets += task.output()
+        return targets
+
+    def run(self):
+        tasks = self.branch_tasks()
+        console.rule(f"Starting packed CROWNRun with {len(tasks)} branches")
+        for i, task in enumerate(tasks):
+            if task.complete():
+                console.log(
+                    f"Skipping {task.nick} branch {task.branch} ({i+1}/{len(tasks)}), outputs already exist"
+                )
+                continue
+            console.log(
+                f"Running {task.nick} branch {task.branch} ({i+1}/{len(tasks)})"
+            )
+            task.run()
+        console.rule("Finished packed CROWNRun")
+
+    def modify_polling_status_line(self, status_line):
+        status_line_pattern = f"{len(self.sample_details)} samples (Analysis: {self.analysis} Config: {self.config} Tag: {self.production_tag})"
+        return f"{status_line} - {law.util.colored(status_line_pattern, color='light_cyan')}"
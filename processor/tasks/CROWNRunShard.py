@@ -0,0 +1,146 @@
+import luigi
+from CROWNRun import CROWNRun
+from framework import console
+from framework import Task
+
+
+def split_shifts(shifts, shifts_per_shard):
+    """
+    The function `split_shifts` splits a comma separated list of shifts into shards.
+
+    :param shifts: The comma separated list of shifts
+    :param shifts_per_shard: The maximum number of shifts per shard
+    :return: a dictionary mapping the shard name to the comma separated shifts of the shard
+    """
+    shifts = [shift.strip() for shift in shifts.split(",") if shift.strip()]
+    shards = {}
+    for i in range(0, len(shifts), shifts_per_shard):
+        shards[f"shifts_shard{len(shards)}"] = ",".join(
+            shifts[i : i + shifts_per_shard]
+        )
+    return shards
+
+
+class CROWNRunShard(CROWNRun):
+    """
+    Run the CROWN ntuple production for a subset of the shifts. Every shard is built into its own
+    executable, the outputs are stored in the same layout as friend trees, with the shard name
+    as friend name.
+    """
+
+    shift_shard = luigi.Parameter(
+        description="Name of the shift shard, the shifts of the shard are given by the shifts parameter."
+    )
+
+    def tarball_requirements(self):
+        requirements = {}
+        for sample_type in self.all_sample_types:
+            for era in self.all_eras:
+                # the shards are read as friends of the nominal ntuple, so their entries have to
+                # be written in the same order, which is only guaranteed by a single thread
+                build = self.build_task_cls().req(
+                    self,
+                    era=era,
+                    sample_type=sample_type,
+                    shift_shard=self.shift_shard,
+                    single_threaded=True,
+                )
+                requirements[f"tarball_{sample_type}_{era}"] = build
+        return requirements
+
+    def output_prefix(self):
+        return f"{self.shift_shard}/"
+
+    def workdir_name(self):
+        return f"{self.production_tag}_{self.analysis}_{self.config}_{self.shift_shard}"
+
+    def htcondor_output_directory(self):
+        # separate the htcondor files of the shards of the same sample
+        return super().htcondor_output_directory().child(self.shift_shard, type="d")
+
+
+class CROWNShardQuantitiesMap(Task):
+    """
+    Combine the quantities maps of all shift shards of a sample into one quantities map
+    """
+
+    scopes = luigi.ListParameter()
+    all_sample_types = luigi.ListParameter(significant=False)
+    all_eras = luigi.ListParameter(significant=False)
+    nick = luigi.Parameter()
+    sample_type = luigi.Parameter()
+    era = luigi.Parameter()
+    analysis = luigi.Parameter()
+    config = luigi.Parameter()
+    production_tag = luigi.Parameter()
+    shift_shards = luigi.DictParameter(
+        description="Mapping of the shard names to the comma separated shifts of the shard."
+    )
+
+    def requires(self):
+        requirements = {}
+        for shift_shard, shifts in self.shift_shards.items():
+            requirements[shift_shard] = CROWNRunShard(
+                nick=self.nick,
+                analysis=self.analysis,
+                config=self.config,
+                scopes=self.scopes,
+                shifts=shifts,
+                shift_shard=shift_shard,
+                production_tag=self.production_tag,
+                all_eras=self.all_eras,
+                all_sample_types=self.all_sample_types,
+                era=self.era,
+                sample_type=self.sample_type,
+            )
+        return requirements
+
+    def output(self):
+        targets = {}
+        for scope in self.scopes:
+            targets[scope] = self.remote_target(
+                [
+                    "{era}/{nick}/{scope}/{era}_{nick}_{scope}_{name}.json".format(
+                        era=self.era, nick=self.nick, scope=scope, name=name
+                    )
+                    for name in ["quantities_map", "shard_map"]
+                ]
+            )
+        return targets
+
+    def run(self):
+        outputs = self.output()
+        for scope in self.scopes:
+            combined = {}
+            shards = {}
+            for shift_shard, task in self.requires().items():
+                # the quantities maps are written by the first branch of each shard
+                quantities_map = task.quantities_map_targets()[scope]
+                with quantities_map.localize("r") as _file:
+                    data = _file.load()
+                for shift, quantities in data[self.era][self.sample_type][
+                    scope
+                ].items():
+                    combined.setdefault(shift, set()).update(quantities)
+                    shards.setdefault(shift, []).append(shift_shard)
+            quantities_map_output, shard_map_output = outputs[scope]
+            quantities_map_output.parent.touch()
+            # same format as the quantities map of a single ntuple
+            quantities_map_output.dump(
+                {
+                    self.era: {
+                        self.sample_type: {
+                            scope: {
+                                shift: sorted(quantities)
+                                for shift, quantities in combined.items()
+                            }
+                        }
+                    }
+                },
+                formatter="json",
+            )
+            # the shards each shift is stored in, the nominal quantities are part of every shard
+            shard_map_output.dump(shards, formatter="json")
+            console.log(
+                f"Combined the quantities maps of {len(self.shift_shards)} shards for {self.nick} {scope}"
+            )
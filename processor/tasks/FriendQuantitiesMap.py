@@ -4,7 +4,7 @@ import os
 from framework import Task, console
 from CROWNRun import CROWNRun
 from CROWNFriends import CROWNFriends
-import json
+from QuantitiesMap import fetch_quantities_maps
 
 
 class FriendQuantitiesMap(law.LocalWorkflow, Task):
@@ -19,6 +19,16 @@ class FriendQuantitiesMap(law.LocalWorkflow, Task):
     nick = luigi.Parameter(significant=False)
     friend_dependencies = luigi.ListParameter(significant=False)
     friend_mapping = luigi.DictParameter(significant=False, default={})
+    compact_quantities_map = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="Store the quantities map in the compact format, it is expanded for CROWN by the friend builds.",
+    )
+    fetch_workers = luigi.IntParameter(
+        default=8,
+        significant=False,
+        description="Number of quantities maps fetched concurrently.",
+    )
 
     def workflow_requires(self):
         requirements = {}
@@ -104,45 +114,17 @@ class FriendQuantitiesMap(law.LocalWorkflow, Task):
         _workdir = os.path.abspath(f"quantities_map/{self.production_tag}")
         if not os.path.exists(_workdir):
             os.makedirs(_workdir)
-        quantities_map = {}
-        quantities_map[era] = {}
-        quantities_map[era][sample_type] = {}
-        # go through all input files and get all quantities maps
-        samples = self.input()["ntuples"]
-        for sample in samples:
-            if isinstance(
-                self.input()["ntuples"][sample], law.NestedSiblingFileCollection
-            ):
-                inputfiles = self.input()["ntuples"][sample]._flat_target_list
-                # add all friend files to the inputfiles list
-                for friend in self.friend_dependencies:
-                    inputfiles.extend(
-                        self.input()[f"CROWNFriends_{friend}"][sample]._flat_target_list
-                    )
-                for inputfile in inputfiles:
-                    if inputfile.path.endswith("quantities_map.json"):
-                        with inputfile.localize("r") as _file:
-                            # open file and update quantities map
-                            update = json.load(open(_file.path, "r"))
-                            scope = list(update[era][sample_type].keys())[0]
-                            if scope not in quantities_map[era][sample_type].keys():
-                                quantities_map[era][sample_type][scope] = {}
-                            for shift in update[era][sample_type][scope].keys():
-                                if (
-                                    shift
-                                    not in quantities_map[era][sample_type][
-                                        scope
-                                    ].keys()
-                                ):
-                                    quantities_map[era][sample_type][scope][shift] = []
-                                quantities_map[era][sample_type][scope][shift].extend(
-                                    update[era][sample_type][scope][shift]
-                                )
+        # the quantities maps of all scopes and friends are fetched directly from their known paths
+        requirements = self.requires()
+        targets = list(requirements["ntuples"].quantities_map_targets().values())
+        for friend in self.friend_dependencies:
+            targets.extend(
+                requirements[f"CROWNFriends_{friend}"].quantities_map_targets().values()
+            )
+        quantities_map = fetch_quantities_maps(targets, self.fetch_workers)
         # write the quantities map to a file
         local_filename = os.path.join(
             _workdir, "{}_{}_quantities_map.json".format(era, sample_type)
         )
-
-        with open(local_filename, "w") as f:
-            json.dump(quantities_map, f, indent=4)
+        quantities_map.dump(local_filename, compact=self.compact_quantities_map)
         output.copy_from_local(local_filename)
@@ -4,21 +4,30 @@
 Collection of tasks used to create training datasets and config files
 for the NN trainings of the NMSSM analysis 
 """
-import yaml
 import os
 import luigi
 import law
-from framework import HTCondorWorkflow, Console, startup_dir
+from framework import HTCondorWorkflow, console, startup_dir
 from law.target.collection import flatten_collections
 from law.task.base import WrapperTask
 from law.config import Config
-from ml_util.config_merger import get_merged_config
 
-try:
-    current_width = os.get_terminal_size().columns
-except OSError:
-    current_width = 140
-console = Console(width=current_width)
+
+def load_training_config(config_file, training):
+    """
+    The function `load_training_config` reads a training config file and merges the config of a
+    training. yaml and ml_util are only imported here, so that they are not loaded with the module.
+
+    :param config_file: The training config file
+    :param training: The name of the training
+    :return: the merged config of the training
+    """
+    import yaml
+    from ml_util.config_merger import get_merged_config
+
+    with open(config_file, "r") as stream:
+        training_config = yaml.safe_load(stream)
+    return get_merged_config(training_config, training)
 
 
 # Base task of ML train tasks
@@ -207,9 +216,7 @@ class RunTraining(MLBase):
         training, config_file = self.branch_data["training_information"]
 
         # Collect process identification, process, training class and config directory
-        with open(config_file, "r") as stream:
-            training_config = yaml.safe_load(stream)
-        conf = get_merged_config(training_config, training)
+        conf = load_training_config(config_file, training)
         ids = list(conf["parts"].keys())
         p_d = list(conf["parts"].values())
         processes = conf["processes"]
@@ -245,9 +252,7 @@ class RunTraining(MLBase):
         # For each requested training
         for training, config_file in self.training_information:
             # Collect process identification, process, training class and config directory
-            with open(config_file, "r") as stream:
-                training_config = yaml.safe_load(stream)
-            conf = get_merged_config(training_config, training)
+            conf = load_training_config(config_file, training)
             ids = list(conf["parts"].keys())
             p_d = list(conf["parts"].values())
             processes = conf["processes"]
@@ -439,9 +444,7 @@ class RunTesting(MLBase):
         training, config_file = self.branch_data["training_information"]
 
         # Collect process identification, process, training class and config directory
-        with open(config_file, "r") as stream:
-            training_config = yaml.safe_load(stream)
-        conf = get_merged_config(training_config, training)
+        conf = load_training_config(config_file, training)
         ids = list(conf["parts"].keys())
         p_d = list(conf["parts"].values())
         processes = conf["processes"]
@@ -481,9 +484,7 @@ class RunTesting(MLBase):
         # For each requested training
         for training, config_file in self.training_information:
             # Collect process identification, process, training class and config directory
-            with open(config_file, "r") as stream:
-                training_config = yaml.safe_load(stream)
-            conf = get_merged_config(training_config, training)
+            conf = load_training_config(config_file, training)
             ids = list(conf["parts"].keys())
             p_d = list(conf["parts"].values())
             processes = conf["processes"]
@@ -652,6 +653,8 @@ class RunAllAnalysisTrainings(WrapperTask):
 
     def requires(self):
         # Load dict from analysis yaml file
+        import yaml
+
         with open(self.analysis_config, "r") as stream:
             analysis_config = yaml.safe_load(stream)
         # Collect all training names and the files in which their configs are found
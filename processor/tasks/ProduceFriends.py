@@ -1,6 +1,7 @@
 import luigi
 from CROWNFriends import CROWNFriends
 from CROWNMultiFriends import CROWNMultiFriends
+from CROWNFriendsCombined import CROWNFriendsCombined
 from framework import console
 from CROWNBase import ProduceBase
 
@@ -11,8 +12,12 @@ class ProduceFriends(ProduceBase):
     if the samples are not already present, trigger ntuple production first
     """
 
-    friend_config = luigi.Parameter()
-    friend_name = luigi.Parameter()
+    friend_config = luigi.Parameter(
+        description="Friend config, or a comma separated list of friend configs, that are produced together in one job per ntuple file."
+    )
+    friend_name = luigi.Parameter(
+        description="Friend name, or a comma separated list of friend names matching the friend configs."
+    )
 
     def requires(self):
         self.sanitize_scopes()
@@ -31,8 +36,34 @@ class ProduceFriends(ProduceBase):
         data = self.set_sample_data(self.parse_samplelist(self.sample_list))
         self.silent = True
 
+        friend_configs = [x.strip() for x in self.friend_config.split(",")]
+        friend_names = [x.strip() for x in self.friend_name.split(",")]
+        if len(friend_configs) != len(friend_names):
+            raise Exception(
+                f"Got {len(friend_configs)} friend configs, but {len(friend_names)} friend names"
+            )
+
         requirements = {}
         for samplenick in data["details"]:
+            if len(friend_configs) > 1:
+                requirements[
+                    f"CROWNFriendsCombined_{samplenick}_{'_'.join(friend_names)}"
+                ] = CROWNFriendsCombined(
+                    nick=samplenick,
+                    analysis=self.analysis,
+                    config=self.config,
+                    production_tag=self.production_tag,
+                    all_eras=data["eras"],
+                    shifts=self.shifts,
+                    all_sample_types=data["sample_types"],
+                    scopes=self.scopes,
+                    era=data["details"][samplenick]["era"],
+                    sample_type=data["details"][samplenick]["sample_type"],
+                    pair_nicks=data["pair_nicks"],
+                    friend_configs=friend_configs,
+                    friend_names=friend_names,
+                )
+                continue
             requirements[
                 f"CROWNFriends_{samplenick}_{self.friend_name}"
             ] = CROWNFriends(
@@ -46,6 +77,7 @@ class ProduceFriends(ProduceBase):
                 scopes=self.scopes,
                 era=data["details"][samplenick]["era"],
                 sample_type=data["details"][samplenick]["sample_type"],
+                pair_nicks=data["pair_nicks"],
                 friend_config=self.friend_config,
                 friend_name=self.friend_name,
             )
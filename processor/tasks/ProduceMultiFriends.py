@@ -51,6 +51,7 @@ class ProduceMultiFriends(ProduceBase):
                 scopes=self.scopes,
                 era=data["details"][samplenick]["era"],
                 sample_type=data["details"][samplenick]["sample_type"],
+                pair_nicks=data["pair_nicks"],
                 friend_config=self.friend_config,
                 friend_name=self.friend_name,
                 friend_dependencies=self.friend_dependencies,
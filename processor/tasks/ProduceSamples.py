@@ -1,4 +1,8 @@
+import luigi
 from CROWNRun import CROWNRun
+from CROWNRunPacked import CROWNRunPacked
+from CROWNPilot import CROWNPilot
+from CROWNRunShard import CROWNShardQuantitiesMap, split_shifts
 from framework import console
 from CROWNBase import ProduceBase
 
@@ -8,6 +12,19 @@ class ProduceSamples(ProduceBase):
     collective task to trigger ntuple production for a list of samples
     """
 
+    # standard: one CROWNRun workflow per sample
+    # packed: branches of all samples are packed into shared jobs, see CROWNRunPacked
+    # pilot: long-running pilot jobs claim the branches from a work queue, see CROWNPilot
+    execution_mode = luigi.ChoiceParameter(
+        choices=["standard", "packed", "pilot"],
+        default="standard",
+        description="How the CROWNRun branches are distributed to jobs.",
+    )
+    shifts_per_shard = luigi.IntParameter(
+        default=0,
+        description="If set, the shifts are split into shards of this size, that are built and run separately from the nominal ntuple, see CROWNRunShard.",
+    )
+
     def requires(self):
         self.sanitize_scopes()
         self.sanitize_shifts()
@@ -18,25 +35,77 @@ class ProduceSamples(ProduceBase):
             console.log(f"Config: {self.config}")
             console.log(f"Shifts: {self.shifts}")
             console.log(f"Scopes: {self.scopes}")
+            console.log(f"Execution mode: {self.execution_mode}")
             console.rule("")
 
         data = self.set_sample_data(self.parse_samplelist(self.sample_list))
         self.silent = True
 
         requirements = {}
+        shifts = self.shifts
+        shift_shards = {}
+        if self.shifts_per_shard > 0 and self.shifts not in ["None", "All"]:
+            if self.execution_mode != "standard":
+                raise Exception(
+                    "Shift sharding is only supported in the standard execution mode"
+                )
+            shift_shards = split_shifts(self.shifts, self.shifts_per_shard)
+            console.log(f"Splitting the shifts into {len(shift_shards)} shards")
+            # the nominal ntuple is produced without any shifts
+            shifts = "None"
+        if self.execution_mode == "packed":
+            requirements["CROWNRunPacked"] = CROWNRunPacked(
+                analysis=self.analysis,
+                config=self.config,
+                scopes=self.scopes,
+                shifts=self.shifts,
+                production_tag=self.production_tag,
+                all_eras=data["eras"],
+                all_sample_types=data["sample_types"],
+                sample_details=data["details"],
+            )
+            return requirements
+        if self.execution_mode == "pilot":
+            requirements["CROWNPilot"] = CROWNPilot(
+                analysis=self.analysis,
+                config=self.config,
+                scopes=self.scopes,
+                shifts=self.shifts,
+                production_tag=self.production_tag,
+                all_eras=data["eras"],
+                all_sample_types=data["sample_types"],
+                sample_details=data["details"],
+            )
+            return requirements
         for samplenick in data["details"]:
             requirements[f"CROWNRun_{samplenick}"] = CROWNRun(
                 nick=samplenick,
                 analysis=self.analysis,
                 config=self.config,
                 scopes=self.scopes,
-                shifts=self.shifts,
+                shifts=shifts,
                 production_tag=self.production_tag,
                 all_eras=data["eras"],
                 all_sample_types=data["sample_types"],
                 era=data["details"][samplenick]["era"],
                 sample_type=data["details"][samplenick]["sample_type"],
+                # the entries of the nominal ntuple have to align with the shift shards
+                single_threaded=bool(shift_shards),
             )
+            if shift_shards:
+                shard_map = CROWNShardQuantitiesMap(
+                    nick=samplenick,
+                    analysis=self.analysis,
+                    config=self.config,
+                    scopes=self.scopes,
+                    production_tag=self.production_tag,
+                    all_eras=data["eras"],
+                    all_sample_types=data["sample_types"],
+                    era=data["details"][samplenick]["era"],
+                    sample_type=data["details"][samplenick]["sample_type"],
+                    shift_shards=shift_shards,
+                )
+                requirements[f"CROWNShardQuantitiesMap_{samplenick}"] = shard_map
 
         return requirements
 
@@ -0,0 +1,228 @@
+import json
+import luigi
+import os
+from collections import Counter
+from framework import Task, console, production_log_dir, startup_time
+from helpers.HTCondorEventLog import HTCondorEventLogReader, FINISHED, FAILED
+from helpers.JobAccounting import read_accounting
+from helpers.StatusIndex import ProductionStatusIndex
+
+
+class ProductionEfficiencyReport(Task):
+    """
+    Report of the resources used by the HTCondor jobs of a production. The cpu time, wall time,
+    memory and requested cpus of each job are read from the HTCondor event logs, the cpu time and
+    the bytes read and written by the CROWN payload from the accounting lines in the job output,
+    which are only written with --payload-accounting.
+    The cpu efficiency and the core hours per million events are computed per task, config, sample
+    type and era. The events are estimated from the number of events of each sample in the dataset
+    database and the share of its branches, that finished successfully.
+    """
+
+    dataset_database = luigi.Parameter(
+        description="Dataset database with the number of events of each sample."
+    )
+
+    def output(self):
+        return self.local_target(f"efficiency_report_{startup_time}.json")
+
+    def collect_jobs(self, logdir):
+        """
+        The function `collect_jobs` reads the terminated jobs from the event logs of the production,
+        that are stored per task in a directory per sample.
+
+        :param logdir: The log directory of the production
+        :return: a dictionary mapping (task, sample) to the list of job states
+        """
+        jobs = {}
+        event_log_dir = os.path.join(logdir, "Log")
+        for root, _, files in os.walk(event_log_dir):
+            sample = os.path.relpath(root, event_log_dir)
+            # the logs of the build workflows are not stored per sample
+            if sample == os.curdir:
+                continue
+            # the current event log of each task and its rotated, compressed predecessors
+            logs = {}
+            for filename in sorted(files):
+                if filename.endswith((".txt", ".txt.gz")):
+                    task = filename.split(".")[0]
+                    logs.setdefault(task, []).append(os.path.join(root, filename))
+            for task, paths in logs.items():
+                # the current log is read last, after the older rotated ones
+                paths.sort(key=lambda path: (path.endswith(".txt"), path))
+                states = HTCondorEventLogReader(paths).update()
+                jobs[(task, sample)] = [
+                    state
+                    for state in states.values()
+                    if state["status"] in (FINISHED, FAILED)
+                    and "wall_s" in state["extra"]
+                ]
+        return jobs
+
+    def collect_accounting(self, logdir):
+        """
+        The function `collect_accounting` reads the accounting lines of the payloads from the job
+        outputs of the production, compressed or not.
+
+        :param logdir: The log directory of the production
+        :return: a dictionary mapping (task, sample) to the list of accounting records
+        """
+        records = {}
+        for root, _, files in os.walk(os.path.join(logdir, "Output")):
+            for filename in files:
+                if not (filename.endswith(".txt") or filename.endswith(".txt.gz")):
+                    continue
+                for record in read_accounting(os.path.join(root, filename)):
+                    key = (record["task"], record["nick"])
+                    records.setdefault(key, []).append(record)
+        return records
+
+    def sample_rows(self, jobs, accounting, totals, sample_db):
+        rows = []
+        for task, sample in sorted(set(jobs) | set(accounting)):
+            _jobs = jobs.get((task, sample), [])
+            _records = accounting.get((task, sample), [])
+            sample_data = sample_db.get(sample, {})
+            configs = Counter(record["config"] for record in _records)
+            row = {
+                "task": task,
+                "sample": sample,
+                "config": configs.most_common(1)[0][0] if configs else "unknown",
+                "era": str(
+                    sample_data.get(
+                        "era", _records[0]["era"] if _records else "unknown"
+                    )
+                ),
+                "sample_type": sample_data.get(
+                    "sample_type",
+                    _records[0]["sample_type"] if _records else "unknown",
+                ),
+                "jobs": len(_jobs),
+                "failed_jobs": sum(1 for job in _jobs if job["status"] == FAILED),
+                "wall_h": sum(job["extra"]["wall_s"] for job in _jobs) / 3600,
+                "cpu_h": sum(job["extra"].get("cpu_s", 0) for job in _jobs) / 3600,
+                "core_h": sum(
+                    job["extra"]["wall_s"] * job["extra"].get("cpus_requested", 1)
+                    for job in _jobs
+                )
+                / 3600,
+                "peak_memory_mb": max(
+                    (job["extra"].get("mem_peak_mb", 0) for job in _jobs), default=0
+                ),
+                "payload_cpu_h": sum(record["cpu_s"] for record in _records) / 3600,
+                "payload_wall_h": sum(record["wall_s"] for record in _records) / 3600,
+                "read_gb": sum(record.get("rchar", 0) for record in _records) / 1e9,
+                "written_gb": sum(record.get("wchar", 0) for record in _records) / 1e9,
+            }
+            done = len(
+                {record["branch"] for record in _records if record["returncode"] == 0}
+            )
+            total = totals.get((task, sample))
+            row["events"] = None
+            if total and "nevents" in sample_data:
+                row["events"] = sample_data["nevents"] * min(done, total) / total
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def add_ratios(row):
+        row["cpu_efficiency"] = row["cpu_h"] / row["core_h"] if row["core_h"] else None
+        row["core_h_per_million_events"] = (
+            row["core_h"] / row["events"] * 1e6 if row["events"] else None
+        )
+        return row
+
+    def group_rows(self, rows):
+        """
+        The function `group_rows` sums the rows of the samples per task, config, sample type and
+        era.
+        """
+        groups = {}
+        for row in rows:
+            key = (row["task"], row["config"], row["sample_type"], row["era"])
+            if key not in groups:
+                groups[key] = dict(row, sample=None, samples=0, events=0)
+                for column in ["jobs", "failed_jobs"] + [
+                    column for column in row if column.endswith(("_h", "_gb"))
+                ]:
+                    groups[key][column] = 0
+                groups[key]["peak_memory_mb"] = 0
+            group = groups[key]
+            group["samples"] += 1
+            for column in group:
+                if column in ["jobs", "failed_jobs"] or column.endswith(("_h", "_gb")):
+                    group[column] += row[column]
+            group["peak_memory_mb"] = max(
+                group["peak_memory_mb"], row["peak_memory_mb"]
+            )
+            # the cost per event is only known for samples with known events
+            if row["events"] is not None and group["events"] is not None:
+                group["events"] += row["events"]
+            else:
+                group["events"] = None
+        rows = []
+        for group in groups.values():
+            del group["sample"]
+            rows.append(self.add_ratios(group))
+        return rows
+
+    def print_table(self, groups):
+        from rich.table import Table
+
+        table = Table(
+            title=f"Production efficiency of {self.production_tag}", highlight=True
+        )
+        columns = [
+            ("Task", "task", None),
+            ("Config", "config", None),
+            ("Sample type", "sample_type", None),
+            ("Era", "era", None),
+            ("Jobs", "jobs", "{:d}"),
+            ("Failed", "failed_jobs", "{:d}"),
+            ("Core h", "core_h", "{:.1f}"),
+            ("CPU h", "cpu_h", "{:.1f}"),
+            ("CPU eff.", "cpu_efficiency", "{:.0%}"),
+            ("Peak mem (MB)", "peak_memory_mb", "{:.0f}"),
+            ("Read (GB)", "read_gb", "{:.1f}"),
+            ("Written (GB)", "written_gb", "{:.1f}"),
+            ("Core h / M events", "core_h_per_million_events", "{:.2f}"),
+        ]
+        for title, _, _ in columns:
+            table.add_column(title, justify="right")
+        for group in groups:
+            table.add_row(
+                *[
+                    (
+                        "-"
+                        if group[key] is None
+                        else (fmt.format(group[key]) if fmt else str(group[key]))
+                    )
+                    for _, key, fmt in columns
+                ]
+            )
+        console.log(table)
+
+    def run(self):
+        logdir = production_log_dir(self.production_tag)
+        if not os.path.exists(logdir):
+            raise Exception(f"No job logs of {self.production_tag} found in {logdir}")
+        with open(str(self.dataset_database), "r") as stream:
+            sample_db = json.load(stream)
+        # the number of branches of each workflow is known from the status index
+        totals = Counter()
+        status_index = os.path.join(logdir, "status_index.json")
+        if os.path.exists(status_index):
+            for entry in ProductionStatusIndex(status_index).load().values():
+                totals[(entry["task"], entry["sample"])] += entry["total"]
+        jobs = self.collect_jobs(logdir)
+        accounting = self.collect_accounting(logdir)
+        samples = [
+            self.add_ratios(row)
+            for row in self.sample_rows(jobs, accounting, totals, sample_db)
+        ]
+        groups = self.group_rows(samples)
+        self.print_table(groups)
+        output = self.output()
+        output.parent.touch()
+        output.dump({"groups": groups, "samples": samples}, indent=4)
+        console.log(f"Efficiency report written to {output.path}")
@@ -1,9 +1,31 @@
 import luigi
 import law
 import os
+from concurrent.futures import ThreadPoolExecutor
 from framework import Task
-import json
 from CROWNRun import CROWNRun
+from helpers.CompactQuantitiesMap import CompactQuantitiesMap
+
+
+def fetch_quantities_maps(targets, workers):
+    """
+    The function `fetch_quantities_maps` fetches quantities maps concurrently and merges them.
+
+    :param targets: The targets of the quantities maps
+    :param workers: The number of concurrent fetches
+    :return: the merged CompactQuantitiesMap
+    """
+
+    def fetch(target):
+        with target.localize("r") as _file:
+            return CompactQuantitiesMap.load(_file.path)
+
+    quantities_map = CompactQuantitiesMap()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # merged in the order of the targets
+        for update in pool.map(fetch, targets):
+            quantities_map.update(update)
+    return quantities_map
 
 
 class QuantitiesMap(law.LocalWorkflow, Task):
@@ -16,6 +38,16 @@ class QuantitiesMap(law.LocalWorkflow, Task):
     analysis = luigi.Parameter(significant=False)
     config = luigi.Parameter(significant=False)
     nick = luigi.Parameter(significant=False)
+    compact_quantities_map = luigi.BoolParameter(
+        default=False,
+        significant=False,
+        description="Store the quantities map in the compact format, it is expanded for CROWN by the friend builds.",
+    )
+    fetch_workers = luigi.IntParameter(
+        default=8,
+        significant=False,
+        description="Number of quantities maps fetched concurrently.",
+    )
 
     def workflow_requires(self):
         requirements = {}
@@ -69,30 +101,12 @@ class QuantitiesMap(law.LocalWorkflow, Task):
         _workdir = os.path.abspath(f"quantities_map/{self.production_tag}")
         if not os.path.exists(_workdir):
             os.makedirs(_workdir)
-        quantities_map = {}
-        quantities_map[era] = {}
-        quantities_map[era][sample_type] = {}
-        # go through all input files and get all quantities maps
-        inputs = self.input()["ntuples"]
-        for sample in inputs:
-            if isinstance(
-                self.input()["ntuples"][sample], law.NestedSiblingFileCollection
-            ):
-                inputfiles = self.input()["ntuples"][sample]._flat_target_list
-                for inputfile in inputfiles:
-                    if inputfile.path.endswith("quantities_map.json"):
-                        with inputfile.localize("r") as _file:
-                            # open file and update quantities map
-                            update = json.load(open(_file.path, "r"))
-                            scope = list(update[era][sample_type].keys())[0]
-                            quantities_map[era][sample_type][scope] = update[era][
-                                sample_type
-                            ][scope]
+        # the quantities maps of all scopes are fetched directly from their known paths
+        targets = list(self.requires()["ntuples"].quantities_map_targets().values())
+        quantities_map = fetch_quantities_maps(targets, self.fetch_workers)
         # write the quantities map to a file
         local_filename = os.path.join(
             _workdir, "{}_{}_quantities_map.json".format(era, sample_type)
         )
-
-        with open(local_filename, "w") as f:
-            json.dump(quantities_map, f, indent=4)
+        quantities_map.dump(local_filename, compact=self.compact_quantities_map)
         output.copy_from_local(local_filename)
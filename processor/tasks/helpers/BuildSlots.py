@@ -0,0 +1,212 @@
+import contextlib
+import fcntl
+import json
+import os
+import select
+import shlex
+import threading
+import time
+
+
+class MakeJobServer(object):
+    """
+    Jobserver of GNU make, a pipe holding a token for each compile job beyond the first one, which
+    make always runs. make takes a token before starting another job and puts it back, once the job
+    is done, so tokens can be added and taken back while make runs.
+    """
+
+    def __init__(self, jobs):
+        self.read_fd, self.write_fd = os.pipe()
+        self.jobs = 1
+        self.grow(jobs)
+
+    @property
+    def pass_fds(self):
+        return (self.read_fd, self.write_fd)
+
+    def environment(self):
+        """
+        The function `environment` returns the MAKEFLAGS, that let make use the jobserver instead of
+        its -j option. The file descriptors of the pipe have to be passed to the command.
+
+        :return: a list of variable assignments, to be put in front of the compile command
+        """
+        flags = f" -j --jobserver-fds={self.read_fd},{self.write_fd}"
+        return [f"MAKEFLAGS={shlex.quote(flags)}"]
+
+    def grow(self, jobs):
+        if jobs > self.jobs:
+            os.write(self.write_fd, b"+" * (jobs - self.jobs))
+            self.jobs = jobs
+
+    def shrink(self, jobs, timeout=1):
+        """
+        The function `shrink` takes tokens back, as far as make returns them within the timeout.
+
+        :param jobs: The number of jobs to shrink to, at least one
+        :param timeout: The time (s) to wait for each token
+        """
+        while self.jobs > max(1, jobs):
+            readable, _, _ = select.select([self.read_fd], [], [], timeout)
+            if not readable:
+                break
+            os.read(self.read_fd, 1)
+            self.jobs -= 1
+
+    def close(self):
+        for fd in self.pass_fds:
+            os.close(fd)
+
+
+class BuildSlotAllocator(object):
+    """
+    Machine-wide budget of compile jobs, shared by all builds running at the same time. The state is
+    a small json file mapping the pid of each registered build to the number of slots it holds,
+    guarded by a file lock. The slots are split evenly between the registered builds: a single
+    build uses all slots, and the shares are rebalanced while the builds run, as builds start and
+    finish. Each build passes its slots to make via a jobserver, so that the number of compile jobs
+    of a running make can be changed. Entries of processes that no longer exist are removed, so a
+    killed build does not block its slots.
+    """
+
+    def __init__(self, state_file, total_slots, poll_interval=5):
+        self.state_file = os.path.abspath(os.path.expandvars(str(state_file)))
+        self.total_slots = total_slots if total_slots > 0 else os.cpu_count()
+        self.poll_interval = poll_interval
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        with open(f"{self.state_file}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.state_file, "r") as f:
+                        state = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    state = {}
+                # remove builds, that were killed without releasing their slots
+                for pid in list(state):
+                    try:
+                        os.kill(int(pid), 0)
+                    except ProcessLookupError:
+                        del state[pid]
+                    except PermissionError:
+                        pass
+                yield state
+                with open(self.state_file, "w") as f:
+                    json.dump(state, f)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def allowance(self, state, pid):
+        """
+        The function `allowance` returns the number of slots a build may hold: its fair share of the
+        budget, limited by the slots held by the other builds.
+
+        :param state: The state of the registered builds
+        :param pid: The pid of the build
+        :return: the number of slots
+        """
+        # the remainder of the budget is given to the first builds
+        rank = sorted(state).index(pid)
+        share = self.total_slots // len(state) + (
+            1 if rank < self.total_slots % len(state) else 0
+        )
+        others = sum(slots for other, slots in state.items() if other != pid)
+        return max(0, min(max(1, share), self.total_slots - others))
+
+    def acquire(self, pid=None, log=print):
+        """
+        The function `acquire` registers a build and waits until a slot is free.
+
+        :param pid: The pid of the build process, defaults to the current process
+        :param log: function used for logging
+        :return: the number of compile jobs the build may start with
+        """
+        pid = str(pid or os.getpid())
+        waiting_logged = False
+        while True:
+            with self._locked_state() as state:
+                # waiting builds hold no slots, but count for the fair share
+                state.setdefault(pid, 0)
+                slots = self.allowance(state, pid)
+                builds = len(state)
+                if slots > 0:
+                    state[pid] = slots
+                    break
+            if not waiting_logged:
+                log(
+                    f"Waiting for free compile slots ({self.total_slots} slots shared by {builds} builds)"
+                )
+                waiting_logged = True
+            time.sleep(self.poll_interval)
+        log(
+            f"Using {slots} of {self.total_slots} compile slots ({builds} concurrent builds)"
+        )
+        return slots
+
+    def rebalance(self, jobserver, pid=None, log=print):
+        """
+        The function `rebalance` adapts the jobserver of a running build to its current allowance.
+        Slots are taken before the tokens are added, so that no other build takes them meanwhile,
+        and released once make gave the tokens back.
+
+        :param jobserver: The MakeJobServer of the build
+        :param pid: The pid of the build process, defaults to the current process
+        :param log: function used for logging
+        """
+        pid = str(pid or os.getpid())
+        jobs = jobserver.jobs
+        with self._locked_state() as state:
+            state.setdefault(pid, jobs)
+            allowance = max(1, self.allowance(state, pid))
+            builds = len(state)
+            if allowance > jobs:
+                state[pid] = allowance
+        if allowance > jobs:
+            jobserver.grow(allowance)
+        elif allowance < jobs:
+            jobserver.shrink(allowance)
+            with self._locked_state() as state:
+                state[pid] = jobserver.jobs
+        if jobserver.jobs != jobs:
+            log(
+                f"Using {jobserver.jobs} of {self.total_slots} compile slots ({builds} concurrent builds)"
+            )
+
+    def release(self, pid=None):
+        pid = str(pid or os.getpid())
+        with self._locked_state() as state:
+            state.pop(pid, None)
+
+    def _rebalance_loop(self, jobserver, stop, log):
+        while not stop.wait(self.poll_interval):
+            try:
+                self.rebalance(jobserver, log=log)
+            except OSError:
+                # the jobserver was closed at the end of the build
+                return
+
+    @contextlib.contextmanager
+    def slots(self, log=print):
+        """
+        The function `slots` acquires compile slots for the duration of a build and rebalances them
+        in the background while the build runs.
+
+        :param log: function used for logging
+        :return: a context manager yielding the MakeJobServer of the build
+        """
+        jobserver = MakeJobServer(self.acquire(log=log))
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._rebalance_loop, args=(jobserver, stop, log), daemon=True
+        )
+        thread.start()
+        try:
+            yield jobserver
+        finally:
+            stop.set()
+            thread.join(self.poll_interval)
+            jobserver.close()
+            self.release()
@@ -0,0 +1,204 @@
+import argparse
+import json
+
+# identifies quantities maps stored in the compact format
+COMPACT_FORMAT = "compact_quantities_map"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Expand a quantities map to the format read by CROWN"
+    )
+    parser.add_argument(
+        "--input", help="quantities map in the compact or standard format"
+    )
+    parser.add_argument("--output", help="quantities map in the standard format")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only check the format, exit with 0 if the input is in the compact format, 1 otherwise",
+    )
+    args = parser.parse_args()
+    return args
+
+
+class CompactQuantitiesMap(object):
+    """
+    Quantities map of eras, sample types, scopes and shifts, with every quantity name stored only once.
+    The quantities of a shift are kept as a set of indices into the table of quantity names, so that
+    merging maps only needs set unions. The standard format, `{era: {sample_type: {scope: {shift:
+    [quantities]}}}}`, is used by CROWN and can be exported and imported.
+    """
+
+    def __init__(self):
+        self.quantities = []
+        self.indices = {}
+        self.maps = {}
+
+    def index(self, quantity):
+        """
+        The function `index` returns the index of a quantity in the table, adding it if it is new.
+
+        :param quantity: The name of the quantity
+        :return: the index of the quantity
+        """
+        index = self.indices.get(quantity)
+        if index is None:
+            index = len(self.quantities)
+            self.indices[quantity] = index
+            self.quantities.append(quantity)
+        return index
+
+    def shift_indices(self, era, sample_type, scope, shift):
+        return (
+            self.maps.setdefault(era, {})
+            .setdefault(sample_type, {})
+            .setdefault(scope, {})
+            .setdefault(shift, set())
+        )
+
+    def add(self, era, sample_type, scope, shift, quantities):
+        """
+        The function `add` adds quantities to a shift, quantities already present are ignored.
+
+        :param era: The era
+        :param sample_type: The sample type
+        :param scope: The scope
+        :param shift: The shift
+        :param quantities: The names of the quantities
+        """
+        self.shift_indices(era, sample_type, scope, shift).update(
+            self.index(quantity) for quantity in quantities
+        )
+
+    def update(self, other):
+        """
+        The function `update` merges another quantities map into this one.
+
+        :param other: A CompactQuantitiesMap or a quantities map in the standard format
+        """
+        if not isinstance(other, CompactQuantitiesMap):
+            other = CompactQuantitiesMap.from_dict(other)
+        # translate the indices of the other table only once
+        translation = [self.index(quantity) for quantity in other.quantities]
+        for era, sample_types in other.maps.items():
+            for sample_type, scopes in sample_types.items():
+                for scope, shifts in scopes.items():
+                    for shift, indices in shifts.items():
+                        self.shift_indices(era, sample_type, scope, shift).update(
+                            translation[index] for index in indices
+                        )
+
+    def to_dict(self):
+        """
+        The function `to_dict` exports the map in the standard format, with sorted quantities.
+        """
+        return {
+            era: {
+                sample_type: {
+                    scope: {
+                        shift: sorted(self.quantities[index] for index in indices)
+                        for shift, indices in shifts.items()
+                    }
+                    for scope, shifts in scopes.items()
+                }
+                for sample_type, scopes in sample_types.items()
+            }
+            for era, sample_types in self.maps.items()
+        }
+
+    def to_compact_dict(self):
+        """
+        The function `to_compact_dict` exports the map in the compact format, with the quantities of
+        each shift given as sorted indices into the quantity table.
+        """
+        return {
+            "format": COMPACT_FORMAT,
+            "quantities": self.quantities,
+            "maps": {
+                era: {
+                    sample_type: {
+                        scope: {
+                            shift: sorted(indices) for shift, indices in shifts.items()
+                        }
+                        for scope, shifts in scopes.items()
+                    }
+                    for sample_type, scopes in sample_types.items()
+                }
+                for era, sample_types in self.maps.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        The function `from_dict` creates a map from a dictionary in the compact or standard format.
+
+        :param data: The quantities map
+        :return: a CompactQuantitiesMap
+        """
+        quantities_map = cls()
+        if data.get("format") == COMPACT_FORMAT:
+            quantities_map.quantities = list(data["quantities"])
+            quantities_map.indices = {
+                quantity: index
+                for index, quantity in enumerate(quantities_map.quantities)
+            }
+            for era, sample_types in data["maps"].items():
+                for sample_type, scopes in sample_types.items():
+                    for scope, shifts in scopes.items():
+                        for shift, indices in shifts.items():
+                            quantities_map.shift_indices(
+                                era, sample_type, scope, shift
+                            ).update(indices)
+            return quantities_map
+        for era, sample_types in data.items():
+            for sample_type, scopes in sample_types.items():
+                for scope, shifts in scopes.items():
+                    for shift, quantities in shifts.items():
+                        quantities_map.add(era, sample_type, scope, shift, quantities)
+        return quantities_map
+
+    @staticmethod
+    def is_compact(filename):
+        """
+        The function `is_compact` checks if a quantities map file is stored in the compact format.
+
+        :param filename: The path of the json file
+        :return: True for the compact format, False for the standard one
+        """
+        with open(filename, "r") as f:
+            data = json.load(f)
+        return isinstance(data, dict) and data.get("format") == COMPACT_FORMAT
+
+    @classmethod
+    def load(cls, filename):
+        """
+        The function `load` reads a quantities map in the compact or standard format.
+
+        :param filename: The path of the json file
+        :return: a CompactQuantitiesMap
+        """
+        with open(filename, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def dump(self, filename, compact=True):
+        """
+        The function `dump` writes the map to a json file without indentation.
+
+        :param filename: The path of the json file
+        :param compact: Whether to use the compact format instead of the standard one
+        """
+        data = self.to_compact_dict() if compact else self.to_dict()
+        with open(filename, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+
+# call the function with the input file
+if __name__ == "__main__":
+    args = parse_args()
+    if args.check:
+        exit(0 if CompactQuantitiesMap.is_compact(args.input) else 1)
+    CompactQuantitiesMap.load(args.input).dump(args.output, compact=False)
+    print(f"Expanded quantities map {args.input} to {args.output}")
+    exit(0)
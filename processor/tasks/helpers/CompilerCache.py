@@ -0,0 +1,119 @@
+import json
+import os
+
+# environment variables configuring the cache directory and its size limit for each launcher
+CACHE_VARIABLES = {
+    "ccache": {"dir": "CCACHE_DIR", "size": "CCACHE_MAXSIZE"},
+    "sccache": {"dir": "SCCACHE_DIR", "size": "SCCACHE_CACHE_SIZE"},
+}
+
+
+class CompilerCache(object):
+    """
+    Optional compiler cache (ccache or sccache) for the CROWN builds. Builds of different production
+    tags and configs compile mostly the same translation units in different build directories, the
+    paths are therefore rewritten relative to a common base directory, so that the cache is shared.
+    The statistics of the cache are written by the compile scripts before and after the build.
+    """
+
+    def __init__(self, launcher, cache_dir, max_size):
+        self.launcher = str(launcher or "")
+        if self.launcher and self.launcher not in CACHE_VARIABLES:
+            raise Exception(
+                f"Unknown compiler launcher {self.launcher}, supported are {list(CACHE_VARIABLES)}"
+            )
+        self.cache_dir = os.path.abspath(os.path.expandvars(str(cache_dir)))
+        self.max_size = str(max_size)
+
+    def enabled(self):
+        return bool(self.launcher)
+
+    def environment(self, base_dir):
+        """
+        The function `environment` returns the environment variables configuring the compiler cache
+        in the compile scripts.
+
+        :param base_dir: Directory containing the CROWN source and the build directory, paths below it
+        are rewritten to relative paths
+        :return: a list of variable assignments, to be put in front of the compile command
+        """
+        if not self.enabled():
+            return []
+        os.makedirs(self.cache_dir, exist_ok=True)
+        variables = {
+            "COMPILER_LAUNCHER": self.launcher,
+            CACHE_VARIABLES[self.launcher]["dir"]: self.cache_dir,
+            CACHE_VARIABLES[self.launcher]["size"]: self.max_size,
+        }
+        if self.launcher == "ccache":
+            variables["CCACHE_BASEDIR"] = base_dir
+            # the build directory is part of the debug information, ignore it for the cache
+            variables["CCACHE_NOHASHDIR"] = "true"
+        else:
+            variables["SCCACHE_BASEDIRS"] = base_dir
+        return [f"{key}={value}" for key, value in variables.items()]
+
+    def read_stats(self, filename):
+        """
+        The function `read_stats` reads the number of cache hits and misses from a statistics file
+        written by the compile scripts.
+
+        :param filename: The statistics file
+        :return: a tuple of hits and misses
+        """
+        with open(filename, "r") as f:
+            content = f.read()
+        if self.launcher == "sccache":
+            stats = json.loads(content)["stats"]
+            hits = sum(stats["cache_hits"]["counts"].values())
+            misses = sum(stats["cache_misses"]["counts"].values())
+            return hits, misses
+        stats = {}
+        for line in content.splitlines():
+            if "\t" in line:
+                key, value = line.split("\t", 1)
+                stats[key.strip()] = (
+                    int(value.strip()) if value.strip().isdigit() else 0
+                )
+        # names of ccache >= 4.0, and the ones of older versions
+        hits = sum(
+            stats.get(key, 0)
+            for key in [
+                "direct_cache_hit",
+                "preprocessed_cache_hit",
+                "cache_hit_direct",
+                "cache_hit_preprocessed",
+            ]
+        )
+        misses = stats.get("cache_miss", 0)
+        return hits, misses
+
+    def report(self, build_dir, log=print):
+        """
+        The function `report` logs the hit rate of the compiler cache during a build.
+
+        :param build_dir: The build directory, containing the statistics written by the compile script
+        :param log: function used for logging
+        """
+        if not self.enabled():
+            return
+        before = os.path.join(build_dir, "compiler_cache_stats_before.txt")
+        after = os.path.join(build_dir, "compiler_cache_stats_after.txt")
+        if not (os.path.exists(before) and os.path.exists(after)):
+            log(f"No {self.launcher} statistics found in {build_dir}")
+            return
+        try:
+            hits_before, misses_before = self.read_stats(before)
+            hits_after, misses_after = self.read_stats(after)
+        except (ValueError, KeyError) as e:
+            log(f"Could not read the {self.launcher} statistics: {e}")
+            return
+        hits = hits_after - hits_before
+        misses = misses_after - misses_before
+        if hits + misses <= 0:
+            log(f"{self.launcher}: no cacheable compilations")
+            return
+        # the cache is shared, so compilations of concurrent builds are counted as well
+        log(
+            f"{self.launcher}: {hits} hits, {misses} misses, hit rate {100.0 * hits / (hits + misses):.1f}% (cache {self.cache_dir}, max size {self.max_size})"
+        )
@@ -1,7 +1,7 @@
-import ROOT
 import argparse
 import json
 import os
+from LightROOTFile import read_string_vector_map, UnsupportedROOTFile
 
 
 def parse_args():
@@ -15,23 +15,54 @@ def parse_args():
     return args
 
 
-def read_quantities_map(input_file, era, sample_type, scope, outputfile):
-    print(f"Reading quantities Map from {input_file}")
+def read_shift_quantities_map(input_file):
+    """
+    The function `read_shift_quantities_map` reads the shift_quantities_map of a CROWN output file. The
+    lightweight reader is tried first, then uproot, if it is installed, and ROOT as the last resort.
+
+    :param input_file: The CROWN output file
+    :return: a dictionary of the sorted quantities of each shift
+    """
+    name = "shift_quantities_map"
+    try:
+        m = read_string_vector_map(input_file, name)
+    except UnsupportedROOTFile as e:
+        print(f"Cannot read {name} without ROOT ({e})")
+    else:
+        return {shift: sorted(quantities) for shift, quantities in m.items()}
+    try:
+        import uproot
+    except ImportError:
+        pass
+    else:
+        with uproot.open(input_file) as f:
+            m = f[name]
+        return {
+            str(shift): sorted(str(quantity) for quantity in quantities)
+            for shift, quantities in zip(m.keys(), m.values())
+        }
+    import ROOT
+
     data = {}
     ROOT.gSystem.Load(os.path.abspath(__file__), "/maplib.so")
     f = ROOT.TFile.Open(input_file)
-    name = "shift_quantities_map"
     m = f.Get(name)
     for shift, quantities in m:
         data[str(shift)] = sorted([str(quantity) for quantity in quantities])
     f.Close()
+    return data
+
+
+def read_quantities_map(input_file, era, sample_type, scope, outputfile):
+    print(f"Reading quantities Map from {input_file}")
+    data = read_shift_quantities_map(input_file)
     print(f"Successfully read quantities map from {input_file}")
     output = {}
     output[era] = {}
     output[era][sample_type] = {}
     output[era][sample_type][scope] = data
     with open(outputfile, "w") as f:
-        json.dump(output, f, indent=4)
+        json.dump(output, f)
 
 
 # call the function with the input file
@@ -0,0 +1,254 @@
+import gzip
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+# header line of each event, e.g. "005 (1234.000.000) 2024-01-31 12:00:00 Job terminated."
+EVENT_HEADER = re.compile(r"^(\d{3}) \((\d+)\.(\d+)\.\d+\) ")
+# line terminating each event
+EVENT_END = "..."
+NORMAL_TERMINATION = re.compile(r"\(1\) Normal termination \(return value (-?\d+)\)")
+ABNORMAL_TERMINATION = re.compile(r"\(0\) Abnormal termination \(signal (\d+)\)")
+MEMORY_USAGE = re.compile(r"^\s*Memory \(MB\)\s*:\s*(\d+)")
+EXECUTE_HOST = re.compile(r"Job executing on host: (\S+)")
+# time of the event, in the ISO format of recent HTCondor versions or the legacy one without the year
+EVENT_TIME = re.compile(r"\) (\d{4}-\d{2}-\d{2}|\d{2}/\d{2}) (\d{2}:\d{2}:\d{2}) ")
+REMOTE_USAGE = re.compile(
+    r"Usr (\d+) (\d+):(\d+):(\d+), Sys (\d+) (\d+):(\d+):(\d+)\s+-\s+Run Remote Usage"
+)
+# usage (not always given), request and allocation of the cpus
+CPU_USAGE = re.compile(r"^\s*Cpus\s*:\s*(?:([\d.]+)\s+)?(\d+)\s+(\d+)\s*$")
+
+# job states, same values as used by the law job managers
+PENDING = "pending"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+# states of the event codes, the code of terminated jobs (005) decides between finished and failed
+EVENT_STATES = {
+    "000": PENDING,  # submitted
+    "001": RUNNING,  # executing
+    "004": PENDING,  # evicted, back in the queue
+    "009": FAILED,  # aborted
+    "010": RUNNING,  # suspended
+    "011": RUNNING,  # unsuspended
+    "012": FAILED,  # held
+    "013": PENDING,  # released
+    "022": RUNNING,  # disconnected
+    "023": RUNNING,  # reconnected
+    "024": PENDING,  # reconnection failed, back in the queue
+}
+
+
+def event_time(header):
+    """
+    The function `event_time` returns the time of an event as unix timestamp, or None if the header
+    has an unknown format.
+    """
+    match = EVENT_TIME.search(header)
+    if not match:
+        return None
+    day, clock = match.groups()
+    if "/" in day:
+        day = f"{datetime.now().year}-{day.replace('/', '-')}"
+    return datetime.strptime(f"{day} {clock}", "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+def usage_seconds(days, hours, minutes, seconds):
+    return ((int(days) * 24 + int(hours)) * 60 + int(minutes)) * 60 + int(seconds)
+
+
+class HTCondorEventLogReader(object):
+    """
+    Reads the states of HTCondor jobs from their user event logs instead of querying the schedd. The
+    logs are read incrementally: the byte offset after the last complete event is remembered per log,
+    together with the inode and the first line of the log to notice rotations, so each update only
+    parses events written since the previous one. Incomplete events at the end of a log are read
+    again with the next update.
+    """
+
+    def __init__(self, logs):
+        self.logs = list(logs)
+        self.offsets = {}
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def update(self):
+        """
+        The function `update` reads the new events of all logs.
+
+        :return: a dictionary mapping job ids to their state
+        """
+        with self.lock:
+            for log in self.logs:
+                self.read_log(log)
+            return self.states
+
+    def read_log(self, log):
+        if log.endswith(".gz"):
+            # rotated logs are complete, they are read once
+            if log in self.offsets:
+                return
+            head, offset = None, 0
+            with gzip.open(log, "rb") as f:
+                data = f.read()
+        else:
+            try:
+                with open(log, "rb") as f:
+                    # the first line identifies the log, the inode alone does not, as it is reused
+                    # once the rotated log is compressed
+                    head = (os.fstat(f.fileno()).st_ino, f.readline(256))
+                    previous_head, offset = self.offsets.get(log, (head, 0))
+                    size = os.fstat(f.fileno()).st_size
+                    # the log was rotated, recreated or truncated, read it again from the start
+                    if previous_head != head or size < offset:
+                        offset = 0
+                    if size == offset:
+                        return
+                    f.seek(offset)
+                    data = f.read(size - offset)
+            except OSError:
+                return
+        event = []
+        consumed = 0
+        position = 0
+        for line in data.splitlines(keepends=True):
+            position += len(line)
+            # the last line might still be incomplete
+            if not line.endswith(b"\n"):
+                break
+            text = line.decode("utf-8", errors="replace").rstrip("\n")
+            if text == EVENT_END:
+                self.apply_event(event)
+                event = []
+                consumed = position
+            else:
+                event.append(text)
+        self.offsets[log] = (head, offset + consumed)
+
+    def apply_event(self, lines):
+        """
+        The function `apply_event` updates the state of a job from one event.
+
+        :param lines: The lines of the event, starting with its header
+        """
+        if not lines:
+            return
+        match = EVENT_HEADER.match(lines[0])
+        if not match:
+            return
+        code, cluster, process = match.groups()
+        job_id = f"{int(cluster)}.{int(process)}"
+        previous = self.states.get(job_id)
+        extra = dict(previous["extra"]) if previous else {}
+        body = "\n".join(lines[1:])
+        exit_code = None
+        error = None
+        if code == "005":
+            normal = NORMAL_TERMINATION.search(body)
+            abnormal = ABNORMAL_TERMINATION.search(body)
+            if normal:
+                exit_code = int(normal.group(1))
+                error = None if exit_code == 0 else f"non-zero exit code {exit_code}"
+            elif abnormal:
+                exit_code = int(abnormal.group(1))
+                error = f"abnormal termination by signal {exit_code}"
+            else:
+                exit_code = 1
+                error = "unknown termination"
+            state = FINISHED if exit_code == 0 else FAILED
+            for line in lines[1:]:
+                memory = MEMORY_USAGE.match(line)
+                if memory:
+                    extra["mem_peak_mb"] = float(memory.group(1))
+                cpus = CPU_USAGE.match(line)
+                if cpus:
+                    if cpus.group(1) is not None:
+                        extra["cpus_usage"] = float(cpus.group(1))
+                    extra["cpus_requested"] = int(cpus.group(2))
+            usage = REMOTE_USAGE.search(body)
+            if usage:
+                groups = usage.groups()
+                extra["cpu_s"] = usage_seconds(*groups[:4]) + usage_seconds(*groups[4:])
+            terminated = event_time(lines[0])
+            if terminated is not None and extra.get("execute_time") is not None:
+                extra["wall_s"] = terminated - extra["execute_time"]
+        elif code in EVENT_STATES:
+            state = EVENT_STATES[code]
+            if code == "001":
+                host = EXECUTE_HOST.search(lines[0])
+                if host:
+                    extra["remote_host"] = host.group(1)
+                extra["execute_time"] = event_time(lines[0])
+            elif code in ("009", "012"):
+                # the reason is given in the first line of the body
+                reason = lines[1].strip() if len(lines) > 1 else ""
+                action = "aborted" if code == "009" else "held"
+                error = f"job {action}: {reason}" if reason else f"job {action}"
+        else:
+            # e.g. image size updates, that do not change the state
+            return
+        self.states[job_id] = {
+            "job_id": job_id,
+            "status": state,
+            "code": exit_code,
+            "error": error,
+            "extra": extra,
+        }
+
+
+class HTCondorEventLogWriter(object):
+    """
+    Writes HTCondor user event logs in the same format as the schedd, to test the event log status
+    tracking locally without HTCondor.
+    """
+
+    def __init__(self, log, cluster):
+        self.log = log
+        self.cluster = cluster
+        os.makedirs(os.path.dirname(os.path.abspath(log)), exist_ok=True)
+
+    def write(self, code, process, message, body=()):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        lines = [f"{code} ({self.cluster:03d}.{process:03d}.000) {timestamp} {message}"]
+        lines += [f"\t{line}" for line in body]
+        lines.append(EVENT_END)
+        with open(self.log, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def submit(self, process):
+        self.write("000", process, "Job submitted from host: <127.0.0.1:9618>")
+
+    def execute(self, process, host="127.0.0.1"):
+        self.write("001", process, f"Job executing on host: <{host}:9618>")
+
+    def evict(self, process):
+        self.write("004", process, "Job was evicted.")
+
+    def terminate(self, process, return_value=0, memory=0, cpu_s=0, cpus=1):
+        usage = time.strftime("%H:%M:%S", time.gmtime(cpu_s))
+        self.write(
+            "005",
+            process,
+            "Job terminated.",
+            [
+                f"(1) Normal termination (return value {return_value})",
+                f"\tUsr 0 {usage}, Sys 0 00:00:00  -  Run Remote Usage",
+                "\tUsr 0 00:00:00, Sys 0 00:00:00  -  Run Local Usage",
+                "Partitionable Resources :    Usage  Request Allocated",
+                f"   Cpus                 :  {cpus}  {cpus}  {cpus}",
+                f"   Memory (MB)          :  {memory}  {memory}  {memory}",
+            ],
+        )
+
+    def abort(self, process, reason="via condor_rm"):
+        self.write("009", process, "Job was aborted.", [reason])
+
+    def hold(self, process, reason="via condor_hold"):
+        self.write("012", process, "Job was held.", [reason])
+
+    def release(self, process):
+        self.write("013", process, "Job was released.")
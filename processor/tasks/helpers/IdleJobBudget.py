@@ -0,0 +1,77 @@
+import contextlib
+import fcntl
+import json
+import os
+import time
+
+
+class IdleJobBudget(object):
+    """
+    Cap on the number of idle HTCondor jobs of all workflows of a production. The state is a small
+    json file mapping the id of each submitting workflow to its number of idle jobs, guarded by a file
+    lock. Each workflow reports its idle jobs when polling and may only submit as many new jobs as
+    the cap leaves free. New jobs are counted as idle right away, so that workflows polling at the
+    same time do not exceed the cap. Entries of processes that no longer exist, or that were not
+    updated for a long time, are removed.
+    """
+
+    def __init__(self, state_file, max_idle, stale_time=3600):
+        self.state_file = os.path.abspath(os.path.expandvars(str(state_file)))
+        self.max_idle = max_idle
+        self.stale_time = stale_time
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        with open(f"{self.state_file}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.state_file, "r") as f:
+                        state = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    state = {}
+                # remove workflows, that were killed without releasing their entry
+                now = time.time()
+                for workflow_id, entry in list(state.items()):
+                    if now - entry["time"] > self.stale_time:
+                        del state[workflow_id]
+                        continue
+                    try:
+                        os.kill(entry["pid"], 0)
+                    except ProcessLookupError:
+                        del state[workflow_id]
+                    except PermissionError:
+                        pass
+                yield state
+                with open(self.state_file, "w") as f:
+                    json.dump(state, f)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def allowance(self, workflow_id, idle):
+        """
+        The function `allowance` reports the idle jobs of a workflow and reserves the number of new
+        jobs it may submit.
+
+        :param workflow_id: The task id of the workflow
+        :param idle: The number of idle jobs of the workflow
+        :return: the number of jobs the workflow may submit
+        """
+        with self._locked_state() as state:
+            others = sum(
+                entry["idle"]
+                for other_id, entry in state.items()
+                if other_id != workflow_id
+            )
+            allowed = max(0, self.max_idle - others - idle)
+            state[workflow_id] = {
+                "idle": idle + allowed,
+                "pid": os.getpid(),
+                "time": time.time(),
+            }
+        return allowed
+
+    def release(self, workflow_id):
+        with self._locked_state() as state:
+            state.pop(workflow_id, None)
@@ -0,0 +1,81 @@
+import gzip
+import json
+import resource
+import time
+
+# prefix of the accounting line written to the job output for each payload run
+ACCOUNTING_PREFIX = "KINGMAKER_ACCOUNTING "
+
+
+def read_io():
+    """
+    The function `read_io` reads the I/O counters of the current process, which include the
+    counters of all waited for child processes. rchar and wchar count all bytes passed through read
+    and write calls, including the network reads of XRootD, read_bytes and write_bytes only the ones
+    from or to the local storage.
+
+    :return: a dictionary of the counters, empty if they are not available
+    """
+    counters = {}
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+class PayloadAccounting(object):
+    """
+    Measures the resources used by the child processes run between `start` and `stop`.
+    """
+
+    def start(self):
+        self.start_time = time.time()
+        self.usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.io = read_io()
+
+    def stop(self, **info):
+        """
+        The function `stop` returns the accounting line of the payload run.
+
+        :param info: Additional information added to the line, e.g. the sample and branch
+        :return: the accounting line
+        """
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io = read_io()
+        record = dict(info)
+        record["wall_s"] = round(time.time() - self.start_time, 1)
+        record["cpu_s"] = round(
+            usage.ru_utime - self.usage.ru_utime + usage.ru_stime - self.usage.ru_stime,
+            1,
+        )
+        # ru_maxrss is given in kB, it is the maximum of all children so far
+        record["max_rss_mb"] = round(usage.ru_maxrss / 1024, 1)
+        for key in ["rchar", "wchar", "read_bytes", "write_bytes"]:
+            if key in io and key in self.io:
+                record[key] = io[key] - self.io[key]
+        return ACCOUNTING_PREFIX + json.dumps(record)
+
+
+def read_accounting(filename):
+    """
+    The function `read_accounting` reads the accounting lines of a job output file.
+
+    :param filename: The job output file, optionally gzip compressed
+    :return: a list of dictionaries
+    """
+    opener = gzip.open if filename.endswith(".gz") else open
+    records = []
+    with opener(filename, "rt", errors="replace") as f:
+        for line in f:
+            position = line.find(ACCOUNTING_PREFIX)
+            if position < 0:
+                continue
+            try:
+                records.append(json.loads(line[position + len(ACCOUNTING_PREFIX) :]))
+            except json.JSONDecodeError:
+                continue
+    return records
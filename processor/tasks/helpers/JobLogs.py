@@ -0,0 +1,221 @@
+import argparse
+import contextlib
+import fcntl
+import gzip
+import json
+import os
+import shutil
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find the HTCondor logs of a branch")
+    parser.add_argument("--index", help="log index of the production")
+    parser.add_argument("--task", help="task family, e.g. CROWNRun")
+    parser.add_argument("--branch", type=int, help="branch number")
+    parser.add_argument(
+        "--subdir", default=None, help="log subdirectory of the workflow, e.g. the nick"
+    )
+    args = parser.parse_args()
+    return args
+
+
+def existing_log(path):
+    """
+    The function `existing_log` returns the path of a log file, or of its compressed version.
+
+    :param path: The path of the uncompressed log file
+    :return: the existing path, or None if the log does not exist (anymore)
+    """
+    for candidate in [path, f"{path}.gz"]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def compress_log(path):
+    """
+    The function `compress_log` replaces a log file by its gzip compressed version.
+
+    :param path: The path of the log file
+    :return: whether the file was compressed
+    """
+    if not os.path.exists(path):
+        return False
+    tmp_path = f"{path}.gz.tmp"
+    with open(path, "rb") as f_in, gzip.open(tmp_path, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.replace(tmp_path, f"{path}.gz")
+    os.remove(path)
+    return True
+
+
+def rotate_log(path, max_bytes):
+    """
+    The function `rotate_log` moves a log file, that exceeds the size limit, to a compressed file
+    with the time of the rotation in its name. A new log is started at the original path.
+
+    :param path: The path of the log file
+    :param max_bytes: The size limit in bytes
+    :return: the path of the compressed log, or None if the log was not rotated
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return None
+    if size <= max_bytes:
+        return None
+    root, ext = os.path.splitext(path)
+    rotated = f"{root}.{time.strftime('%Y%m%d_%H%M%S')}{ext}"
+    os.replace(path, rotated)
+    compress_log(rotated)
+    return f"{rotated}.gz"
+
+
+@contextlib.contextmanager
+def periodic_run(stamp_file, interval):
+    """
+    The function `periodic_run` lets only one of all processes sharing the stamp file run a periodic
+    action, at most once per interval. The time of the last run is stored in the stamp file, which
+    is locked while the action runs.
+
+    :param stamp_file: The path of the stamp file
+    :param interval: The minimal time between two runs in seconds
+    :return: a context manager yielding whether the action is due in this process
+    """
+    with open(stamp_file, "a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # another process is running the action right now
+            yield False
+            return
+        try:
+            f.seek(0)
+            try:
+                last = float(f.read().strip() or 0)
+            except ValueError:
+                last = 0
+            now = time.time()
+            if now - last < interval:
+                yield False
+                return
+            f.truncate(0)
+            f.write(str(now))
+            f.flush()
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def enforce_retention(directories, max_bytes):
+    """
+    The function `enforce_retention` removes the oldest compressed logs until the logs in the given
+    directories fit into the size limit. Uncompressed logs, e.g. of running jobs, are never removed.
+
+    :param directories: The log directories
+    :param max_bytes: The size limit in bytes
+    :return: the number of removed logs
+    """
+    total = 0
+    compressed = []
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                total += stat.st_size
+                if name.endswith(".gz"):
+                    compressed.append((stat.st_mtime, stat.st_size, path))
+    removed = 0
+    for _, size, path in sorted(compressed):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+class JobLogIndex(object):
+    """
+    Index of the stdout and stderr files of all HTCondor jobs of a production, a json line per job and
+    submission, appended by all workflows under a file lock. It is used to find the logs of a branch
+    without searching the log directories.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = os.path.abspath(os.path.expandvars(str(index_file)))
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self, mode):
+        with open(self.index_file, mode) as f:
+            fcntl.flock(f, fcntl.LOCK_EX if "a" in mode else fcntl.LOCK_SH)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, entries):
+        """
+        The function `append` adds the jobs of a submission to the index.
+
+        :param entries: A list of dictionaries with the task, subdir, job_num, branches, stdout and
+        stderr of each job
+        """
+        if not entries:
+            return
+        submitted = time.time()
+        lines = "".join(
+            json.dumps(dict(entry, submitted=submitted)) + "\n" for entry in entries
+        )
+        with self._locked("a") as f:
+            f.write(lines)
+
+    def find(self, task, branch, subdir=None):
+        """
+        The function `find` returns the logs of all submissions of a branch, the latest last.
+
+        :param task: The task family
+        :param branch: The branch number
+        :param subdir: The log subdirectory of the workflow, all are searched if not given
+        :return: a list of index entries, with the paths of existing (compressed) logs
+        """
+        if not os.path.exists(self.index_file):
+            return []
+        found = []
+        with self._locked("r") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["task"] != task or branch not in entry["branches"]:
+                    continue
+                if subdir is not None and entry["subdir"] != subdir:
+                    continue
+                for stream in ["stdout", "stderr"]:
+                    entry[stream] = existing_log(entry[stream])
+                found.append(entry)
+        return found
+
+
+# call the function with the input file
+if __name__ == "__main__":
+    args = parse_args()
+    entries = JobLogIndex(args.index).find(args.task, args.branch, args.subdir)
+    if not entries:
+        print(f"No logs of branch {args.branch} of {args.task} found")
+        exit(1)
+    for entry in entries:
+        submitted = time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(entry["submitted"])
+        )
+        print(f"{entry['subdir']} job {entry['job_num']} submitted {submitted}")
+        print(f"  stdout: {entry['stdout']}")
+        print(f"  stderr: {entry['stderr']}")
+    exit(0)
@@ -0,0 +1,364 @@
+import argparse
+import lzma
+import os
+import struct
+import zlib
+
+# TTree::EStatusBits::kEntriesReshuffled
+ENTRIES_RESHUFFLED = 1 << 19
+# flag of the byte counts written in front of streamed objects
+BYTECOUNT_MASK = 0x40000000
+# flag of the class version of collections streamed memberwise
+MEMBERWISE_MASK = 0x4000
+# header of each compressed block: algorithm (2), method (1), compressed size (3), uncompressed size (3)
+BLOCK_HEADER_SIZE = 9
+# offset of TObject::fBits in a streamed TTree: byte count and version of TTree and TNamed, the
+# version and fUniqueID of TObject
+TREE_FBITS_OFFSET = 18
+
+
+class UnsupportedROOTFile(Exception):
+    """
+    Raised if a file uses a feature the lightweight reader does not support, the caller has to fall
+    back to ROOT.
+    """
+
+
+def zstd_module():
+    try:
+        import zstandard
+    except ImportError:
+        raise UnsupportedROOTFile("ZSTD compression requires the zstandard module")
+    return zstandard
+
+
+def decompress_block(algorithm, data, size):
+    if algorithm == b"ZL":
+        return zlib.decompress(data)
+    if algorithm == b"XZ":
+        return lzma.decompress(data)
+    if algorithm == b"ZS":
+        return zstd_module().ZstdDecompressor().decompress(data, max_output_size=size)
+    raise UnsupportedROOTFile(f"Compression algorithm {algorithm} is not supported")
+
+
+def compress_block(algorithm, data, level, size):
+    """
+    The function `compress_block` compresses a block to exactly the given size, so that it can replace
+    the original block in place. Different compression levels are tried, ZLIB and ZSTD blocks are
+    padded, as the data following the compressed stream is ignored when reading.
+
+    :param algorithm: The compression algorithm of the block
+    :param data: The uncompressed data
+    :param level: The compression level of the file, tried first
+    :param size: The size of the original compressed block, without the header
+    :return: the compressed data, or None if no compression level fits
+    """
+    levels = [level] + [other for other in range(9, 0, -1) if other != level]
+    for attempt in levels:
+        if algorithm == b"ZL":
+            compressed = zlib.compress(data, attempt)
+            padding = size - len(compressed)
+            if padding >= 0:
+                return compressed + b"\0" * padding
+        elif algorithm == b"XZ":
+            compressed = lzma.compress(
+                data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC32, preset=attempt
+            )
+            if len(compressed) == size:
+                return compressed
+        elif algorithm == b"ZS":
+            compressed = zstd_module().ZstdCompressor(level=attempt).compress(data)
+            padding = size - len(compressed)
+            if padding == 0:
+                return compressed
+            # a skippable frame needs at least its magic number and size
+            if padding >= 8:
+                return (
+                    compressed
+                    + struct.pack("<II", 0x184D2A50, padding - 8)
+                    + b"\0" * (padding - 8)
+                )
+        else:
+            raise UnsupportedROOTFile(
+                f"Compression algorithm {algorithm} is not supported"
+            )
+    return None
+
+
+class Key(object):
+    def __init__(self, nbytes, objlen, keylen, cycle, seek_key, class_name, name):
+        self.nbytes = nbytes
+        self.objlen = objlen
+        self.keylen = keylen
+        self.cycle = cycle
+        self.seek_key = seek_key
+        self.class_name = class_name
+        self.name = name
+
+    def compressed(self):
+        return self.nbytes - self.keylen != self.objlen
+
+
+class LightROOTFile(object):
+    """
+    Minimal reader of the top directory of ROOT files, that does not need ROOT. It reads the keys and
+    the streamed data of objects, and patches the status bits of trees in place, without rewriting
+    the file. Only the ZLIB, LZMA and, if the zstandard module is available, ZSTD compression
+    algorithms are supported, other files raise UnsupportedROOTFile.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            header = f.read(64)
+            if header[:4] != b"root":
+                raise UnsupportedROOTFile(f"{filename} is not a ROOT file")
+            version, self.begin = struct.unpack(">ii", header[4:12])
+            if version < 1000000:
+                fields = struct.unpack(">iiiiiBiii", header[12:45])
+            else:
+                fields = struct.unpack(">qqiiiBiqi", header[12:57])
+            self.compression = fields[6]
+            nbytes_name = fields[4]
+            # the TDirectory record of the top directory follows the key and name of the file
+            f.seek(self.begin + nbytes_name)
+            directory = f.read(42)
+            (directory_version,) = struct.unpack(">h", directory[:2])
+            if directory_version > 1000:
+                seek_keys = struct.unpack(">q", directory[34:42])[0]
+            else:
+                seek_keys = struct.unpack(">i", directory[26:30])[0]
+            self.keys = self.read_keys(f, seek_keys)
+
+    @staticmethod
+    def read_string(data, pos):
+        length = data[pos]
+        pos += 1
+        if length == 255:
+            (length,) = struct.unpack(">i", data[pos : pos + 4])
+            pos += 4
+        return data[pos : pos + length].decode("utf-8"), pos + length
+
+    def read_key(self, data, pos):
+        nbytes, version, objlen, _, keylen, cycle = struct.unpack(
+            ">ihiIhh", data[pos : pos + 18]
+        )
+        if version > 1000:
+            seek_key = struct.unpack(">q", data[pos + 18 : pos + 26])[0]
+            pos += 34
+        else:
+            seek_key = struct.unpack(">i", data[pos + 18 : pos + 22])[0]
+            pos += 26
+        class_name, pos = self.read_string(data, pos)
+        name, pos = self.read_string(data, pos)
+        _, pos = self.read_string(data, pos)
+        return Key(nbytes, objlen, keylen, cycle, seek_key, class_name, name), pos
+
+    def read_keys(self, f, seek_keys):
+        f.seek(seek_keys)
+        (nbytes,) = struct.unpack(">i", f.read(4))
+        f.seek(seek_keys)
+        data = f.read(nbytes)
+        # the list of keys is stored behind a key of its own
+        header, _ = self.read_key(data, 0)
+        (nkeys,) = struct.unpack(">i", data[header.keylen : header.keylen + 4])
+        pos = header.keylen + 4
+        keys = []
+        for _ in range(nkeys):
+            key, pos = self.read_key(data, pos)
+            keys.append(key)
+        return keys
+
+    def get_keys(self, name):
+        """
+        The function `get_keys` returns all cycles of an object in the top directory.
+
+        :param name: The name of the object
+        :return: a list of keys, the highest cycle first
+        """
+        return sorted(
+            [key for key in self.keys if key.name == name],
+            key=lambda key: key.cycle,
+            reverse=True,
+        )
+
+    def blocks(self, f, key):
+        """
+        The function `blocks` yields the compressed blocks of an object, with the position and size of
+        their compressed data.
+        """
+        pos = key.seek_key + key.keylen
+        end = key.seek_key + key.nbytes
+        while pos < end:
+            f.seek(pos)
+            header = f.read(BLOCK_HEADER_SIZE)
+            algorithm = header[:2]
+            compressed_size = int.from_bytes(header[3:6], "little")
+            size = int.from_bytes(header[6:9], "little")
+            yield algorithm, pos + BLOCK_HEADER_SIZE, compressed_size, size
+            pos += BLOCK_HEADER_SIZE + compressed_size
+
+    def read_object(self, key):
+        """
+        The function `read_object` reads the uncompressed streamed data of an object.
+
+        :param key: The key of the object
+        :return: the streamed data
+        """
+        with open(self.filename, "rb") as f:
+            if not key.compressed():
+                f.seek(key.seek_key + key.keylen)
+                return f.read(key.objlen)
+            data = []
+            for algorithm, pos, compressed_size, size in self.blocks(f, key):
+                f.seek(pos)
+                data.append(decompress_block(algorithm, f.read(compressed_size), size))
+        data = b"".join(data)
+        if len(data) != key.objlen:
+            raise UnsupportedROOTFile(
+                f"Read {len(data)} bytes of {key.name}, expected {key.objlen}"
+            )
+        return data
+
+    def reset_tree_bit(self, name, bit):
+        """
+        The function `reset_tree_bit` resets a status bit of all cycles of a tree in place. Only the
+        first compressed block of each tree is rewritten, with the same size as before.
+
+        :param name: The name of the tree
+        :param bit: The status bit
+        :return: the number of cycles, that had the bit set
+        """
+        reset = 0
+        with open(self.filename, "r+b") as f:
+            for key in self.get_keys(name):
+                if key.class_name != "TTree":
+                    raise UnsupportedROOTFile(
+                        f"{name} is a {key.class_name}, not a TTree"
+                    )
+                if not key.compressed():
+                    pos = key.seek_key + key.keylen
+                    f.seek(pos)
+                    data = f.read(TREE_FBITS_OFFSET + 4)
+                else:
+                    algorithm, pos, compressed_size, size = next(self.blocks(f, key))
+                    f.seek(pos)
+                    data = decompress_block(algorithm, f.read(compressed_size), size)
+                # byte counts of TTree and TNamed, followed by TObject version 1
+                tree_count, _, named_count, _, object_version = struct.unpack(
+                    ">IhIhh", data[:14]
+                )
+                if not (
+                    tree_count & BYTECOUNT_MASK
+                    and named_count & BYTECOUNT_MASK
+                    and object_version == 1
+                ):
+                    raise UnsupportedROOTFile(f"Unexpected streamer layout of {name}")
+                (bits,) = struct.unpack(
+                    ">I", data[TREE_FBITS_OFFSET : TREE_FBITS_OFFSET + 4]
+                )
+                if not bits & bit:
+                    continue
+                patched = (
+                    data[:TREE_FBITS_OFFSET]
+                    + struct.pack(">I", bits & ~bit)
+                    + data[TREE_FBITS_OFFSET + 4 :]
+                )
+                if key.compressed():
+                    patched = compress_block(
+                        algorithm, patched, self.compression % 100, compressed_size
+                    )
+                    if patched is None:
+                        raise UnsupportedROOTFile(
+                            f"Could not recompress {name} to its original size"
+                        )
+                f.seek(pos)
+                f.write(patched)
+                reset += 1
+            f.flush()
+            os.fsync(f.fileno())
+        return reset
+
+
+class StreamReader(object):
+    """
+    Reader of the streamed data of an object, checking that the data is consumed completely.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def int32(self):
+        (value,) = struct.unpack(">i", self.data[self.pos : self.pos + 4])
+        self.pos += 4
+        return value
+
+    def string(self):
+        value, self.pos = LightROOTFile.read_string(self.data, self.pos)
+        return value
+
+    def collection_size(self):
+        # nested collections may be written with a byte count and a version in front of their size
+        (count,) = struct.unpack(">I", self.data[self.pos : self.pos + 4])
+        if count & BYTECOUNT_MASK:
+            (version,) = struct.unpack(">h", self.data[self.pos + 4 : self.pos + 6])
+            if version & MEMBERWISE_MASK:
+                raise UnsupportedROOTFile(
+                    "Memberwise streamed collections are not supported"
+                )
+            self.pos += 6
+        size = self.int32()
+        if size < 0 or size > len(self.data) - self.pos:
+            raise UnsupportedROOTFile(f"Invalid collection size {size}")
+        return size
+
+    def done(self):
+        if self.pos != len(self.data):
+            raise UnsupportedROOTFile(
+                f"Streamed data not consumed completely ({self.pos} of {len(self.data)} bytes)"
+            )
+
+
+def read_string_vector_map(filename, name):
+    """
+    The function `read_string_vector_map` reads a std::map<std::string, std::vector<std::string>> from
+    the top directory of a ROOT file, e.g. the shift_quantities_map written by CROWN.
+
+    :param filename: The ROOT file
+    :param name: The name of the map
+    :return: a dictionary of lists of strings
+    """
+    rfile = LightROOTFile(filename)
+    keys = rfile.get_keys(name)
+    if not keys:
+        raise Exception(f"{name} not found in {filename}")
+    stream = StreamReader(rfile.read_object(keys[0]))
+    try:
+        result = {}
+        for _ in range(stream.collection_size()):
+            key = stream.string()
+            result[key] = [stream.string() for _ in range(stream.collection_size())]
+        stream.done()
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise UnsupportedROOTFile(f"Could not read {name}: {e}")
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Reset the kEntriesReshuffled bit of a tree in place, without ROOT"
+    )
+    parser.add_argument("--input", help="input file")
+    parser.add_argument("--tree", default="ntuple", help="name of the tree")
+    args = parser.parse_args()
+    return args
+
+
+# call the function with the input file
+if __name__ == "__main__":
+    args = parse_args()
+    reset = LightROOTFile(args.input).reset_tree_bit(args.tree, ENTRIES_RESHUFFLED)
+    print(f"Reset status bit of {reset} cycles of {args.tree} in {args.input}")
+    exit(0)
@@ -0,0 +1,81 @@
+import ROOT
+import argparse
+import numpy as np
+from ROOTObjects import copy_objects
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Merge friend chunks in order and verify the alignment"
+    )
+    parser.add_argument("--inputs", nargs="+", help="friend chunks in entry order")
+    parser.add_argument("--output", help="merged output file")
+    parser.add_argument(
+        "--references",
+        nargs="+",
+        help="input ntuple files in entry order, the merged friend has to align with",
+    )
+    parser.add_argument("--tree", default="ntuple", help="name of the tree")
+    args = parser.parse_args()
+    return args
+
+
+# branches used to check the entry-by-entry alignment, if present in both trees
+ALIGNMENT_COLUMNS = ["run", "lumi", "event"]
+
+
+def merge_chunks(inputs, output, tree="ntuple"):
+    print(f"Merging {len(inputs)} chunks into {output}")
+    chain = ROOT.TChain(tree)
+    for inputfile in inputs:
+        chain.Add(inputfile)
+    out = ROOT.TFile(output, "RECREATE")
+    out.cd()
+    merged = chain.CloneTree(-1, "fast")
+    merged.Write()
+    # all other objects are identical in all chunks, take them from the first one
+    first = ROOT.TFile.Open(inputs[0])
+    copy_objects(first, out, tree)
+    first.Close()
+    out.Close()
+
+
+def verify_alignment(output, references, tree="ntuple"):
+    reference = ROOT.TChain(tree)
+    for inputfile in references:
+        reference.Add(inputfile)
+    friend_file = ROOT.TFile.Open(output)
+    friend = friend_file.Get(tree)
+    if friend.GetEntries() != reference.GetEntries():
+        raise Exception(
+            f"Friend has {friend.GetEntries()} entries, but the ntuple has {reference.GetEntries()}"
+        )
+    columns = [
+        column
+        for column in ALIGNMENT_COLUMNS
+        if friend.GetBranch(column) and reference.GetBranch(column)
+    ]
+    friend_file.Close()
+    if not columns:
+        print(
+            f"Entry counts match, no common columns of {ALIGNMENT_COLUMNS} to compare"
+        )
+        return
+    friend_values = ROOT.RDataFrame(tree, output).AsNumpy(columns)
+    reference_values = ROOT.RDataFrame(reference).AsNumpy(columns)
+    for column in columns:
+        mismatches = np.flatnonzero(friend_values[column] != reference_values[column])
+        if len(mismatches) > 0:
+            raise Exception(
+                f"Friend is not aligned with the ntuple, column {column} differs first at entry {mismatches[0]}"
+            )
+    print(f"Friend is aligned entry-by-entry with the ntuple (checked {columns})")
+
+
+# call the function with the input file
+if __name__ == "__main__":
+    args = parse_args()
+    merge_chunks(args.inputs, args.output, args.tree)
+    verify_alignment(args.output, args.references, args.tree)
+    print("Done")
+    exit(0)
@@ -0,0 +1,270 @@
+import gzip
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+# sampling frequency of perf record (Hz), a prime to avoid aliasing with periodic work
+PERF_FREQUENCY = 99
+# interval of the /proc samples (s)
+SAMPLE_INTERVAL = 5
+# lines of perf report with the share of the samples in a symbol, e.g. "  12.34%  crown  [.] func"
+PERF_SYMBOL = re.compile(r"^\s*(\d+\.\d+)%\s+(\S+)\s+\[.\]\s+(.+)$")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def perf_available():
+    """
+    The function `perf_available` checks if perf can record samples, which is often forbidden by
+    the kernel.perf_event_paranoid setting of the worker nodes.
+    """
+    if shutil.which("perf") is None:
+        return False
+    try:
+        result = subprocess.run(
+            ["perf", "record", "-q", "-o", os.devnull, "--", "true"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=30,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return result.returncode == 0
+
+
+def process_tree(pid):
+    """
+    The function `process_tree` returns the pid and the pids of all descendants of a process.
+    """
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # the command name in parentheses might contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids = [pid]
+    for current in pids:
+        pids.extend(children.get(current, []))
+    return pids
+
+
+def read_process(pid):
+    """
+    The function `read_process` reads the cpu time (s), the resident memory (bytes), the number of
+    threads and the bytes read and written of a process.
+    """
+    with open(f"/proc/{pid}/stat", "r") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of the stat file, the first two are cut off above
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    threads = int(fields[17])
+    rss = int(fields[21]) * PAGE_SIZE
+    read_bytes = write_bytes = 0
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            for line in f:
+                key, value = line.split(":")
+                if key == "read_bytes":
+                    read_bytes = int(value)
+                elif key == "write_bytes":
+                    write_bytes = int(value)
+    except OSError:
+        pass
+    return cpu, rss, threads, read_bytes, write_bytes
+
+
+class ProcSampler(threading.Thread):
+    """
+    Samples the cpu usage, resident memory and I/O of a process and its descendants from /proc in
+    regular intervals, until it is stopped.
+    """
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        super(ProcSampler, self).__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        # totals of processes, that already exited
+        self.totals = {}
+
+    def sample(self):
+        for pid in process_tree(self.pid):
+            try:
+                self.totals[pid] = read_process(pid)
+            except (OSError, IndexError, ValueError):
+                continue
+        running = set(process_tree(self.pid))
+        now = time.time()
+        cpu = sum(values[0] for values in self.totals.values())
+        read_bytes = sum(values[3] for values in self.totals.values())
+        write_bytes = sum(values[4] for values in self.totals.values())
+        rss = sum(values[1] for pid, values in self.totals.items() if pid in running)
+        threads = sum(
+            values[2] for pid, values in self.totals.items() if pid in running
+        )
+        previous = self.samples[-1] if self.samples else None
+        cores = 0.0
+        if previous is not None and now > previous["time"]:
+            cores = (cpu - previous["cpu_s"]) / (now - previous["time"])
+        self.samples.append(
+            {
+                "time": now,
+                "cpu_s": cpu,
+                "cpu_cores": round(cores, 3),
+                "rss_mb": round(rss / 1024**2, 1),
+                "threads": threads,
+                "read_mb": round(read_bytes / 1024**2, 1),
+                "write_mb": round(write_bytes / 1024**2, 1),
+            }
+        )
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, filename):
+        with open(filename, "w") as f:
+            keys = [
+                "time",
+                "cpu_s",
+                "cpu_cores",
+                "rss_mb",
+                "threads",
+                "read_mb",
+                "write_mb",
+            ]
+            f.write(",".join(keys) + "\n")
+            for sample in self.samples:
+                f.write(",".join(str(sample[key]) for key in keys) + "\n")
+
+
+class PayloadProfiler(object):
+    """
+    Profiles a payload with perf record if perf is usable, the resource usage is sampled from /proc
+    in any case. The profile and a summary of it are written to the output directory.
+    """
+
+    def __init__(self, outdir, name, use_perf=True):
+        self.outdir = outdir
+        self.name = name
+        self.use_perf = use_perf and perf_available()
+        self.perf_data = os.path.join(outdir, f"{name}_perf.data")
+        self.sampler = None
+        self.start_time = None
+        os.makedirs(outdir, exist_ok=True)
+
+    def wrap(self, command):
+        """
+        The function `wrap` returns the command running the payload under perf, if it is used.
+        """
+        if not self.use_perf:
+            return command
+        return [
+            "perf",
+            "record",
+            "-q",
+            "-F",
+            str(PERF_FREQUENCY),
+            "-g",
+            "-o",
+            self.perf_data,
+            "--",
+        ] + command
+
+    def start(self, pid):
+        self.start_time = time.time()
+        self.sampler = ProcSampler(pid)
+        self.sampler.start()
+
+    def top_symbols(self, n_symbols=30):
+        """
+        The function `top_symbols` returns the symbols with the most perf samples.
+        """
+        result = subprocess.run(
+            [
+                "perf",
+                "report",
+                "--stdio",
+                "--no-children",
+                "--sort",
+                "dso,symbol",
+                "-i",
+                self.perf_data,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+        symbols = []
+        for line in result.stdout.splitlines():
+            match = PERF_SYMBOL.match(line)
+            if match:
+                symbols.append(
+                    {
+                        "percent": float(match.group(1)),
+                        "dso": match.group(2),
+                        "symbol": match.group(3).strip(),
+                    }
+                )
+            if len(symbols) == n_symbols:
+                break
+        return symbols
+
+    def stop(self, returncode):
+        """
+        The function `stop` stops the sampling and writes the profile and its summary.
+
+        :param returncode: The exit code of the payload
+        :return: the list of files written to the output directory
+        """
+        self.sampler.stop()
+        files = []
+        samples_file = os.path.join(self.outdir, f"{self.name}_samples.csv")
+        self.sampler.write(samples_file)
+        files.append(samples_file)
+        samples = self.sampler.samples
+        wall_time = time.time() - self.start_time
+        summary = {
+            "returncode": returncode,
+            "profiler": "perf" if self.use_perf else "proc",
+            "wall_time_s": round(wall_time, 1),
+            "cpu_time_s": round(samples[-1]["cpu_s"], 1) if samples else None,
+            "mean_cpu_cores": (
+                round(samples[-1]["cpu_s"] / wall_time, 2)
+                if samples and wall_time > 0
+                else None
+            ),
+            "peak_cpu_cores": max((s["cpu_cores"] for s in samples), default=None),
+            "peak_rss_mb": max((s["rss_mb"] for s in samples), default=None),
+            "peak_threads": max((s["threads"] for s in samples), default=None),
+            "read_mb": samples[-1]["read_mb"] if samples else None,
+            "write_mb": samples[-1]["write_mb"] if samples else None,
+        }
+        if self.use_perf and os.path.exists(self.perf_data):
+            summary["top_symbols"] = self.top_symbols()
+            with open(self.perf_data, "rb") as f_in, gzip.open(
+                f"{self.perf_data}.gz", "wb"
+            ) as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(self.perf_data)
+            files.append(f"{self.perf_data}.gz")
+        summary_file = os.path.join(self.outdir, f"{self.name}_summary.json")
+        with open(summary_file, "w") as f:
+            json.dump(summary, f, indent=4)
+        files.append(summary_file)
+        return files
@@ -0,0 +1,24 @@
+import ROOT
+
+
+def copy_objects(infile, outfile, tree):
+    """
+    The function `copy_objects` copies all objects of a ROOT file except the tree, e.g. the
+    shift_quantities_map, to another file.
+
+    :param infile: The opened TFile to copy from
+    :param outfile: The opened TFile to copy to
+    :param tree: The name of the tree, that is not copied
+    """
+    for key in infile.GetListOfKeys():
+        name = key.GetName()
+        if name == tree:
+            continue
+        outfile.cd()
+        try:
+            if ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom("TObject"):
+                key.ReadObj().Write(name)
+            else:
+                outfile.WriteObject(infile.Get(name), name)
+        except Exception as e:
+            print(f"Could not copy {name} ({key.GetClassName()}): {e}")
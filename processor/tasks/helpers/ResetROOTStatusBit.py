@@ -1,15 +1,28 @@
-import ROOT
 import argparse
+from LightROOTFile import LightROOTFile, UnsupportedROOTFile, ENTRIES_RESHUFFLED
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Reset ROOT status bit")
     parser.add_argument("--input", help="input file")
+    parser.add_argument(
+        "--use-root",
+        action="store_true",
+        help="open and rewrite the file with ROOT instead of patching it in place",
+    )
     args = parser.parse_args()
     return args
 
 
+def reset_status_bit_in_place(input_file):
+    print(f"Trying to reset status bit for {input_file} in place")
+    reset = LightROOTFile(input_file).reset_tree_bit("ntuple", ENTRIES_RESHUFFLED)
+    print(f"Successfully reset status bit of {reset} ntuple cycles in {input_file}")
+
+
 def reset_status_bit(input_file):
+    import ROOT
+
     print(f"Trying to reset status bit for {input_file}")
     rfile = ROOT.TFile(input_file, "UPDATE")
     if "ntuple" not in [x.GetTitle() for x in rfile.GetListOfKeys()]:
@@ -28,6 +41,13 @@ def reset_status_bit(input_file):
 # call the function with the input file
 if __name__ == "__main__":
     args = parse_args()
-    reset_status_bit(args.input)
+    if args.use_root:
+        reset_status_bit(args.input)
+    else:
+        try:
+            reset_status_bit_in_place(args.input)
+        except UnsupportedROOTFile as e:
+            print(f"Cannot patch {args.input} in place ({e}), using ROOT")
+            reset_status_bit(args.input)
     print("Done")
     exit(0)
@@ -0,0 +1,52 @@
+import ROOT
+import argparse
+import json
+from ROOTObjects import copy_objects
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Split a ntuple into contiguous entry ranges"
+    )
+    parser.add_argument("--input", help="input file")
+    parser.add_argument("--output", help="output file pattern, containing {chunk}")
+    parser.add_argument("--chunks", type=int, help="number of chunks")
+    parser.add_argument("--manifest", help="json file listing the created chunks")
+    parser.add_argument("--tree", default="ntuple", help="name of the tree")
+    args = parser.parse_args()
+    return args
+
+
+def split_ntuple(input_file, output_pattern, chunks, manifest, tree="ntuple"):
+    print(f"Splitting {input_file} into {chunks} chunks")
+    f = ROOT.TFile.Open(input_file)
+    t = f.Get(tree)
+    entries = t.GetEntries()
+    # never create empty chunks
+    chunks = max(1, min(chunks, entries))
+    boundaries = [int(i * entries / chunks) for i in range(chunks + 1)]
+    result = {"entries": entries, "chunks": []}
+    for i in range(chunks):
+        first, last = boundaries[i], boundaries[i + 1]
+        output = output_pattern.format(chunk=i)
+        out = ROOT.TFile(output, "RECREATE")
+        chunk = t.CopyTree("", "", last - first, first)
+        chunk.Write()
+        # copy all other objects, e.g. the shift_quantities_map, to the chunk
+        copy_objects(f, out, tree)
+        out.Close()
+        result["chunks"].append(
+            {"file": output, "first_entry": first, "entries": last - first}
+        )
+        print(f"Wrote entries {first} to {last} to {output}")
+    f.Close()
+    with open(manifest, "w") as m:
+        json.dump(result, m)
+
+
+# call the function with the input file
+if __name__ == "__main__":
+    args = parse_args()
+    split_ntuple(args.input, args.output, args.chunks, args.manifest, args.tree)
+    print("Done")
+    exit(0)
@@ -0,0 +1,175 @@
+import contextlib
+import fcntl
+import json
+import os
+import time
+
+from helpers.HTCondorEventLog import (
+    HTCondorEventLogReader,
+    PENDING,
+    RUNNING,
+    FINISHED,
+    FAILED,
+)
+
+
+class ProductionStatusIndex(object):
+    """
+    Persistent index of the branch outputs of all workflows of a production, used to monitor it
+    without building the task graph and checking every output. Each workflow registers the outputs
+    of its branches when it starts. The index only keeps the outputs of branches, that are not done
+    yet, and their directories are listed once per refresh, instead of checking each output file.
+    A workflow is only listed again if new jobs finished according to its event log, or if it was not
+    listed for a while. The workflows store the branches, whose latest job failed, while they poll
+    their jobs. The state is a json file guarded by a file lock.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = os.path.abspath(os.path.expandvars(str(index_file)))
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked_state(self, write=True):
+        with open(f"{self.index_file}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                try:
+                    with open(self.index_file, "r") as f:
+                        state = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    state = {}
+                yield state
+                if write:
+                    tmp_file = f"{self.index_file}.tmp"
+                    with open(tmp_file, "w") as f:
+                        json.dump(state, f)
+                    os.replace(tmp_file, self.index_file)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def register(self, workflow_id, task, sample, remote, outputs, event_log=None):
+        """
+        The function `register` adds a workflow to the index, or resets it, if it is started again.
+        All branches are pending until the next refresh finds their outputs.
+
+        :param workflow_id: The task id of the workflow
+        :param task: The task family of the branches
+        :param sample: The sample of the workflow, shown by the monitor
+        :param remote: Whether the outputs are remote targets
+        :param outputs: A dictionary mapping each branch to the paths of its outputs
+        :param event_log: The HTCondor event log of the jobs of the workflow
+        """
+        with self._locked_state() as state:
+            state[workflow_id] = {
+                "task": task,
+                "sample": sample,
+                "remote": remote,
+                "event_log": event_log,
+                "total": len(outputs),
+                "pending": {str(branch): paths for branch, paths in outputs.items()},
+                "registered": time.time(),
+                "listed": 0,
+                "finished_jobs": -1,
+                "failing": [],
+            }
+
+    def set_failing(self, workflow_id, branches):
+        """
+        The function `set_failing` stores the branches of a workflow, whose latest job failed.
+
+        :param workflow_id: The task id of the workflow
+        :param branches: The branch numbers
+        """
+        with self._locked_state() as state:
+            if workflow_id in state:
+                state[workflow_id]["failing"] = [str(branch) for branch in branches]
+
+    def load(self):
+        with self._locked_state(write=False) as state:
+            return state
+
+    @staticmethod
+    def job_counts(reader):
+        counts = {PENDING: 0, RUNNING: 0, FINISHED: 0, FAILED: 0}
+        if reader is None:
+            return counts
+        for job in reader.update().values():
+            if job["status"] in counts:
+                counts[job["status"]] += 1
+        return counts
+
+    def refresh(self, listdir, readers, task=None, full_refresh=600):
+        """
+        The function `refresh` lists the directories of the pending outputs of the workflows, whose
+        jobs finished since the last refresh, and returns the status of all samples.
+
+        :param listdir: A function returning the file names in a directory, called with the remote
+        flag of the workflow and the directory
+        :param readers: A dictionary of HTCondorEventLogReader objects by event log, kept by the caller
+        to read the event logs incrementally, new readers are added
+        :param task: Only workflows of this task family are refreshed and returned
+        :param full_refresh: Time (s) after which workflows are listed again in any case
+        :return: a dictionary mapping the samples to the number of done and total branches, of
+        running and idle jobs and of the branches, that are not done and whose latest job failed
+        """
+        now = time.time()
+        state = self.load()
+        results = {}
+        status = {}
+        for workflow_id, entry in state.items():
+            if task is not None and entry["task"] != task:
+                continue
+            reader = None
+            if entry["event_log"]:
+                if entry["event_log"] not in readers:
+                    readers[entry["event_log"]] = HTCondorEventLogReader(
+                        [entry["event_log"]]
+                    )
+                reader = readers[entry["event_log"]]
+            counts = self.job_counts(reader)
+            pending = entry["pending"]
+            if pending and (
+                counts[FINISHED] != entry["finished_jobs"]
+                or now - entry["listed"] > full_refresh
+            ):
+                # each directory is listed once for all pending branches
+                listings = {}
+                done = []
+                for branch, paths in pending.items():
+                    for path in paths:
+                        directory, name = os.path.split(path)
+                        if directory not in listings:
+                            listings[directory] = set(
+                                listdir(entry["remote"], directory)
+                            )
+                        if name not in listings[directory]:
+                            break
+                    else:
+                        done.append(branch)
+                results[workflow_id] = (done, counts[FINISHED])
+                pending = {b: p for b, p in pending.items() if b not in done}
+            sample = status.setdefault(
+                entry["sample"],
+                {"done": 0, "total": 0, "running": 0, "idle": 0, "failing": 0},
+            )
+            sample["done"] += entry["total"] - len(pending)
+            sample["total"] += entry["total"]
+            sample["running"] += counts[RUNNING]
+            sample["idle"] += counts[PENDING]
+            sample["failing"] += sum(
+                1 for branch in entry.get("failing", []) if branch in pending
+            )
+        if results:
+            with self._locked_state() as state:
+                for workflow_id, (done, finished_jobs) in results.items():
+                    # the workflow might have been registered again in the meantime
+                    if (
+                        workflow_id not in state
+                        or state[workflow_id]["registered"] > now
+                    ):
+                        continue
+                    for branch in done:
+                        state[workflow_id]["pending"].pop(branch, None)
+                    state[workflow_id]["listed"] = now
+                    state[workflow_id]["finished_jobs"] = finished_jobs
+        return status
@@ -0,0 +1,352 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+
+class FileWorkQueue(object):
+    """
+    Simple work queue on a (shared) POSIX file system. Every item is a small json file, that is
+    moved between the state directories pending, claimed, done and failed. Claiming an item is
+    done by an atomic rename, so several workers on different machines can use the same queue,
+    as long as the file system provides atomic renames (e.g. NFS or CephFS).
+    """
+
+    states = ("pending", "claimed", "done", "failed")
+
+    def __init__(self, path, max_attempts=3):
+        self.path = os.path.abspath(os.path.expandvars(str(path)))
+        self.max_attempts = max_attempts
+        for state in self.states:
+            os.makedirs(os.path.join(self.path, state), exist_ok=True)
+
+    def _item_path(self, state, item_id):
+        return os.path.join(self.path, state, f"{item_id}.json")
+
+    def _write(self, path, item):
+        # write to a temporary file first, so that no worker can see a partial item
+        tmpfile = os.path.join(self.path, f".{uuid.uuid4().hex}.tmp")
+        with open(tmpfile, "w") as f:
+            json.dump(item, f)
+        os.rename(tmpfile, path)
+
+    def put(self, item_id, payload):
+        """
+        The function `put` adds a new item to the queue, if it is not already known in any state.
+
+        :param item_id: unique identifier of the item, used as filename
+        :param payload: json serializable payload of the item
+        :return: True if the item was added, False if it already exists
+        """
+        if any(
+            os.path.exists(self._item_path(state, item_id)) for state in self.states
+        ):
+            return False
+        item = {"id": item_id, "payload": payload, "attempts": 0, "errors": []}
+        self._write(self._item_path("pending", item_id), item)
+        return True
+
+    def claim(self, worker=None):
+        """
+        The function `claim` moves the first pending item to the claimed state and returns it.
+        If another worker claims the same item at the same time, only one rename succeeds and the
+        other worker continues with the next item.
+
+        :param worker: optional identifier of the claiming worker, stored in the item
+        :return: the claimed item or None if the queue has no pending items
+        """
+        pending_dir = os.path.join(self.path, "pending")
+        for filename in sorted(os.listdir(pending_dir)):
+            if not filename.endswith(".json"):
+                continue
+            item_id = filename[: -len(".json")]
+            claimed_path = self._item_path("claimed", item_id)
+            try:
+                os.rename(os.path.join(pending_dir, filename), claimed_path)
+            except FileNotFoundError:
+                # claimed by another worker in the meantime
+                continue
+            with open(claimed_path, "r") as f:
+                item = json.load(f)
+            item["worker"] = worker
+            item["claimed_at"] = time.time()
+            self._write(claimed_path, item)
+            return item
+        return None
+
+    def heartbeat(self, item):
+        """
+        The function `heartbeat` refreshes the modification time of a claimed item, so that it is
+        not considered stale by `requeue_stale`.
+        """
+        try:
+            os.utime(self._item_path("claimed", item["id"]))
+        except FileNotFoundError:
+            pass
+
+    def _take_claim(self, item):
+        # move the claim out of the claimed state first, so that only one of a worker finishing the
+        # item and requeue_stale releasing it at the same time changes the state of the item
+        tmpfile = os.path.join(self.path, f".{uuid.uuid4().hex}.tmp")
+        try:
+            os.rename(self._item_path("claimed", item["id"]), tmpfile)
+        except FileNotFoundError:
+            return None
+        return tmpfile
+
+    def complete(self, item):
+        """
+        The function `complete` moves a claimed item to the done state. If the claim was already
+        released by `requeue_stale`, the released item is moved to the done state instead, unless
+        it was claimed again in the meantime.
+
+        :param item: the claimed item
+        :return: True if the item is now done, False if it is claimed by another worker
+        """
+        claim = self._take_claim(item)
+        if claim is not None:
+            os.rename(claim, self._item_path("done", item["id"]))
+            return True
+        for state in ("pending", "failed"):
+            try:
+                os.rename(
+                    self._item_path(state, item["id"]),
+                    self._item_path("done", item["id"]),
+                )
+                return True
+            except FileNotFoundError:
+                continue
+        return os.path.exists(self._item_path("done", item["id"]))
+
+    def release(self, item, error=None):
+        """
+        The function `release` returns a claimed item to the pending state after a failure. Items
+        that failed `max_attempts` times are moved to the failed state instead.
+
+        :param item: the claimed item
+        :param error: optional error message that is stored with the item
+        :return: the new state of the item, or None if the claim was already released
+        """
+        claim = self._take_claim(item)
+        if claim is None:
+            return None
+        os.remove(claim)
+        item["attempts"] += 1
+        if error is not None:
+            item["errors"].append(str(error))
+        state = "pending" if item["attempts"] < self.max_attempts else "failed"
+        self._write(self._item_path(state, item["id"]), item)
+        return state
+
+    def retry_failed(self):
+        """
+        The function `retry_failed` returns all failed items to the pending state with a new budget
+        of attempts, e.g. when a production is started again.
+
+        :return: list of the returned item ids
+        """
+        retried = []
+        failed_dir = os.path.join(self.path, "failed")
+        for filename in sorted(os.listdir(failed_dir)):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(failed_dir, filename)
+            try:
+                with open(path, "r") as f:
+                    item = json.load(f)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            item["attempts"] = 0
+            self._write(self._item_path("pending", item["id"]), item)
+            retried.append(item["id"])
+        return retried
+
+    def requeue_stale(self, max_age):
+        """
+        The function `requeue_stale` releases all claimed items, that did not receive a heartbeat
+        within the last `max_age` seconds, e.g. because the worker was killed.
+
+        :param max_age: maximum age of a claim in seconds
+        :return: list of the released item ids
+        """
+        requeued = []
+        claimed_dir = os.path.join(self.path, "claimed")
+        for filename in os.listdir(claimed_dir):
+            path = os.path.join(claimed_dir, filename)
+            try:
+                if time.time() - os.path.getmtime(path) < max_age:
+                    continue
+                with open(path, "r") as f:
+                    item = json.load(f)
+            except FileNotFoundError:
+                continue
+            if self.release(item, error=f"claim expired after {max_age} s"):
+                requeued.append(item["id"])
+        return requeued
+
+    def counts(self):
+        return {
+            state: len(
+                [
+                    name
+                    for name in os.listdir(os.path.join(self.path, state))
+                    if name.endswith(".json")
+                ]
+            )
+            for state in self.states
+        }
+
+
+class LocalWorkQueue(object):
+    """
+    In-memory stand-in for the FileWorkQueue with the same interface, to test workers locally
+    without a shared file system.
+    """
+
+    states = FileWorkQueue.states
+
+    def __init__(self, max_attempts=3):
+        self.max_attempts = max_attempts
+        self.items = {state: {} for state in self.states}
+        self.lock = threading.Lock()
+
+    def put(self, item_id, payload):
+        with self.lock:
+            if any(item_id in self.items[state] for state in self.states):
+                return False
+            self.items["pending"][item_id] = {
+                "id": item_id,
+                "payload": payload,
+                "attempts": 0,
+                "errors": [],
+            }
+            return True
+
+    def claim(self, worker=None):
+        with self.lock:
+            if not self.items["pending"]:
+                return None
+            item_id = sorted(self.items["pending"])[0]
+            item = self.items["pending"].pop(item_id)
+            item["worker"] = worker
+            item["claimed_at"] = time.time()
+            self.items["claimed"][item_id] = item
+            return item
+
+    def heartbeat(self, item):
+        with self.lock:
+            if item["id"] in self.items["claimed"]:
+                self.items["claimed"][item["id"]]["claimed_at"] = time.time()
+
+    def complete(self, item):
+        with self.lock:
+            for state in ("claimed", "pending", "failed"):
+                if item["id"] in self.items[state]:
+                    self.items["done"][item["id"]] = self.items[state].pop(item["id"])
+                    return True
+            return item["id"] in self.items["done"]
+
+    def release(self, item, error=None):
+        with self.lock:
+            if item["id"] not in self.items["claimed"]:
+                return None
+            item = self.items["claimed"].pop(item["id"])
+            item["attempts"] += 1
+            if error is not None:
+                item["errors"].append(str(error))
+            state = "pending" if item["attempts"] < self.max_attempts else "failed"
+            self.items[state][item["id"]] = item
+            return state
+
+    def requeue_stale(self, max_age):
+        with self.lock:
+            stale = [
+                item
+                for item in self.items["claimed"].values()
+                if time.time() - item["claimed_at"] >= max_age
+            ]
+        return [
+            item["id"]
+            for item in stale
+            if self.release(item, error=f"claim expired after {max_age} s")
+        ]
+
+    def retry_failed(self):
+        with self.lock:
+            retried = sorted(self.items["failed"])
+            for item_id in retried:
+                item = self.items["failed"].pop(item_id)
+                item["attempts"] = 0
+                self.items["pending"][item_id] = item
+            return retried
+
+    def counts(self):
+        with self.lock:
+            return {state: len(self.items[state]) for state in self.states}
+
+
+def run_worker(
+    queue, run_item, walltime, worker=None, heartbeat_interval=60, log=print
+):
+    """
+    The function `run_worker` repeatedly claims items from the queue and processes them with
+    `run_item`, until the queue is empty or the walltime budget is exhausted. A new item is only
+    claimed if the longest item processed so far still fits into the remaining budget.
+
+    :param queue: a FileWorkQueue or LocalWorkQueue
+    :param run_item: function processing the payload of an item, raising an exception on failure
+    :param walltime: walltime budget of the worker in seconds
+    :param worker: identifier of the worker
+    :param heartbeat_interval: interval in seconds in which the claim of the running item is renewed
+    :param log: function used for logging
+    :return: a summary dictionary with the processed, failed and remaining items
+    """
+    start = time.time()
+    longest = 0.0
+    summary = {"done": [], "failed": [], "exhausted": False}
+    while True:
+        remaining = walltime - (time.time() - start)
+        if remaining < longest:
+            log(
+                f"Remaining walltime {remaining:.0f} s is shorter than the longest item ({longest:.0f} s), stopping"
+            )
+            summary["exhausted"] = True
+            break
+        item = queue.claim(worker)
+        if item is None:
+            log("Queue is empty, stopping")
+            break
+        log(f"Claimed {item['id']} (attempt {item['attempts'] + 1})")
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            while not stop_heartbeat.wait(heartbeat_interval):
+                queue.heartbeat(item)
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        item_start = time.time()
+        try:
+            run_item(item["payload"])
+        except Exception as e:
+            stop_heartbeat.set()
+            state = queue.release(item, error=e)
+            if state is None:
+                log(
+                    f"Processing {item['id']} failed, its claim was already released: {e}"
+                )
+            else:
+                log(f"Processing {item['id']} failed, item is now {state}: {e}")
+            summary["failed"].append(item["id"])
+        else:
+            stop_heartbeat.set()
+            if not queue.complete(item):
+                log(f"Claim of {item['id']} was released and claimed again meanwhile")
+            summary["done"].append(item["id"])
+        heartbeat_thread.join()
+        longest = max(longest, time.time() - item_start)
+    summary["walltime"] = time.time() - start
+    summary["counts"] = queue.counts()
+    return summary
@@ -10,6 +10,7 @@ INSTALLDIR=$8
 BUILDDIR=$9
 TARBALLNAME=${10}
 EXECUTALBE_THREADS=${11}
+MAKE_JOBS=${12}
 # setup with analysis clone if needed
 set -o pipefail
 set -e
@@ -25,7 +26,12 @@ fi
 # use a fourth of the machine for compiling
 THREADS_AVAILABLE=$(grep -c ^processor /proc/cpuinfo)
 THREADS=$(( THREADS_AVAILABLE / 4 ))
+# the number of compile jobs assigned by the build slot allocator of KingMaker
+if [[ ! -z "${MAKE_JOBS}" ]]; then
+	THREADS=$MAKE_JOBS
+fi
 echo "Using $THREADS threads for the compilation"
+source $(dirname "$0")/compiler_cache.sh
 which cmake
 
 if cmake $CROWNFOLDER \
@@ -37,6 +43,7 @@ if cmake $CROWNFOLDER \
 	 -DSHIFTS=$SHIFTS \
 	 -DTHREADS=$EXECUTALBE_THREADS \
 	 -DINSTALLDIR=$INSTALLDIR \
+	 $LAUNCHER_ARGS \
 	 -DPRODUCTION=True \
 	 -B$BUILDDIR 2>&1 |tee $BUILDDIR/cmake.log; then
 echo "CMake finished successfully"
@@ -49,5 +56,12 @@ else
 fi
 cd $BUILDDIR
 echo "Finished preparing the compilation and starting to compile"
-make install -j $THREADS 2>&1 |tee $BUILDDIR/build.log
+compiler_cache_stats $BUILDDIR/compiler_cache_stats_before.txt
+# the jobserver of the build slot allocator of KingMaker adapts the compile jobs while make runs
+if [[ "${MAKEFLAGS}" == *jobserver* ]]; then
+	make install 2>&1 |tee $BUILDDIR/build.log
+else
+	make install -j $THREADS 2>&1 |tee $BUILDDIR/build.log
+fi
+compiler_cache_stats $BUILDDIR/compiler_cache_stats_after.txt
 echo "Finished the compilation"
@@ -10,6 +10,7 @@ INSTALLDIR=$8
 BUILDDIR=$9
 TARBALLNAME=${10}
 QUANTITIESMAP=${11}
+MAKE_JOBS=${12}
 # setup with analysis clone if needed
 set -o pipefail
 set -e
@@ -26,8 +27,18 @@ fi
 THREADS_AVAILABLE=$(grep -c ^processor /proc/cpuinfo)
 # THREADS=$(( THREADS_AVAILABLE / 4 ))
 THREADS=2
+# the number of compile jobs assigned by the build slot allocator of KingMaker
+if [[ ! -z "${MAKE_JOBS}" ]]; then
+	THREADS=$MAKE_JOBS
+fi
 echo "Using $THREADS threads for the compilation"
+source $(dirname "$0")/compiler_cache.sh
 which cmake
+# quantities maps in the compact format of KingMaker are expanded to the format read by CROWN
+if python3 $(dirname "$0")/../helpers/CompactQuantitiesMap.py --input $QUANTITIESMAP --check; then
+	python3 $(dirname "$0")/../helpers/CompactQuantitiesMap.py --input $QUANTITIESMAP --output $BUILDDIR/quantities_map_expanded.json
+	QUANTITIESMAP=$BUILDDIR/quantities_map_expanded.json
+fi
 
 if cmake $CROWNFOLDER \
 	-DANALYSIS=$ANALYSIS \
@@ -37,6 +48,7 @@ if cmake $CROWNFOLDER \
 	-DSCOPES=$SCOPE \
 	-DSHIFTS=$SHIFTS \
 	-DINSTALLDIR=$INSTALLDIR \
+	$LAUNCHER_ARGS \
 	-DPRODUCTION=True \
 	-DFRIENDS=true \
 	-DQUANTITIESMAP=$QUANTITIESMAP \
@@ -52,7 +64,19 @@ fi
 
 cd $BUILDDIR
 echo "Finished preparing the compilation and starting to compile"
-make install -j $THREADS 2>&1 |tee $BUILDDIR/build.log
+compiler_cache_stats $BUILDDIR/compiler_cache_stats_before.txt
+# the jobserver of the build slot allocator of KingMaker adapts the compile jobs while make runs
+if [[ "${MAKEFLAGS}" == *jobserver* ]]; then
+	make install 2>&1 |tee $BUILDDIR/build.log
+else
+	make install -j $THREADS 2>&1 |tee $BUILDDIR/build.log
+fi
+compiler_cache_stats $BUILDDIR/compiler_cache_stats_after.txt
+# combined builds are packed per sample type and era afterwards
+if [[ "$TARBALLNAME" == "none" ]]; then
+	echo "Finished the compilation"
+	exit 0
+fi
 echo "Finished the compilation and starting to make the *.tar.gz archive"
 cd $INSTALLDIR
 touch $TARBALLNAME
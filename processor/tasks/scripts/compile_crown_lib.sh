@@ -2,6 +2,7 @@
 CROWNFOLDER=$1
 INSTALLDIR=$2
 BUILDDIR=$3
+MAKE_JOBS=$4
 
 echo "Crown folder: $CROWNFOLDER"
 echo "Install dir: $INSTALLDIR"
@@ -21,12 +22,18 @@ fi
 # use a fourth of the machine for compiling
 THREADS_AVAILABLE=$(grep -c ^processor /proc/cpuinfo)
 THREADS=$(( THREADS_AVAILABLE / 4 ))
+# the number of compile jobs assigned by the build slot allocator of KingMaker
+if [[ ! -z "${MAKE_JOBS}" ]]; then
+	THREADS=$MAKE_JOBS
+fi
 echo "Using $THREADS threads for the compilation"
+source $(dirname "$0")/compiler_cache.sh
 which cmake
 
 if cmake $CROWNFOLDER \
 	 -DBUILD_CROWNLIB_ONLY=ON \
 	 -DINSTALLDIR=$INSTALLDIR \
+	 $LAUNCHER_ARGS \
 	 -B$BUILDDIR 2>&1 |tee $BUILDDIR/cmake.log; then
 echo "CMake finished successfully"
 else
@@ -38,5 +45,12 @@ else
 fi
 cd $BUILDDIR
 echo "Finished preparing the compilation and starting to compile"
-make install -j $THREADS 2>&1 |tee $BUILDDIR/build.log
+compiler_cache_stats $BUILDDIR/compiler_cache_stats_before.txt
+# the jobserver of the build slot allocator of KingMaker adapts the compile jobs while make runs
+if [[ "${MAKEFLAGS}" == *jobserver* ]]; then
+	make install 2>&1 |tee $BUILDDIR/build.log
+else
+	make install -j $THREADS 2>&1 |tee $BUILDDIR/build.log
+fi
+compiler_cache_stats $BUILDDIR/compiler_cache_stats_after.txt
 echo "Finished the compilation crownlib build successfully"
\ No newline at end of file
@@ -0,0 +1,24 @@
+#! /bin/bash
+# optional compiler cache, configured by KingMaker via $COMPILER_LAUNCHER (ccache or sccache)
+# and the cache directory and size variables of the launcher, sourced by the compile scripts
+if [[ ! -z "${COMPILER_LAUNCHER}" ]] && ! command -v $COMPILER_LAUNCHER >/dev/null; then
+	echo "Compiler launcher $COMPILER_LAUNCHER not found, compiling without cache"
+	COMPILER_LAUNCHER=""
+fi
+if [[ ! -z "${COMPILER_LAUNCHER}" ]]; then
+	echo "Using $COMPILER_LAUNCHER as compiler launcher"
+fi
+# an empty launcher also removes a launcher from a previous configuration of the build directory
+LAUNCHER_ARGS="-DCMAKE_C_COMPILER_LAUNCHER=$COMPILER_LAUNCHER -DCMAKE_CXX_COMPILER_LAUNCHER=$COMPILER_LAUNCHER"
+
+# write the statistics of the cache to the given file, the hit rate is reported by KingMaker
+compiler_cache_stats() {
+	if [[ -z "${COMPILER_LAUNCHER}" ]]; then
+		return 0
+	fi
+	if [[ "$COMPILER_LAUNCHER" == "sccache" ]]; then
+		sccache --show-stats --stats-format=json >$1 || true
+	else
+		ccache --print-stats >$1 || true
+	fi
+}
@@ -0,0 +1,219 @@
+"""
+Opt-in tracing of the scheduling of tasks. If the environment variable KINGMAKER_TRACE is set to a
+directory, the calls of the requires, workflow_requires, create_branch_map, output and complete
+methods of all tasks and workflows, and all remote file system operations, are recorded and written
+to a trace file in the Chrome trace event format when the process exits. The file can be opened
+with https://ui.perfetto.dev or chrome://tracing. Only the submitting process is traced.
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+TRACE_DIR = os.getenv("KINGMAKER_TRACE")
+TRACED_METHODS = (
+    "requires",
+    "workflow_requires",
+    "create_branch_map",
+    "output",
+    "complete",
+)
+FS_OPERATIONS = (
+    "stat",
+    "exists",
+    "isdir",
+    "isfile",
+    "listdir",
+    "glob",
+    "mkdir",
+    "remove",
+    "chmod",
+    "copy",
+    "move",
+    "open",
+)
+
+
+class Tracer(object):
+    """
+    Collects complete ("X") events of timed calls and counter ("C") events of the remote file system
+    operations, nested calls of the same thread are shown stacked.
+    """
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+        self.events = []
+        self.fs_operations = Counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def timestamp(self):
+        return (time.perf_counter() - self.start) * 1e6
+
+    def record(self, name, category, begin, args=None):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": begin,
+            "dur": self.timestamp() - begin,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    def count(self, operation, begin):
+        with self.lock:
+            self.fs_operations[operation] += 1
+            self.events.append(
+                {
+                    "name": "remote fs operations",
+                    "ph": "C",
+                    "ts": begin,
+                    "pid": self.pid,
+                    "args": {"total": sum(self.fs_operations.values())},
+                }
+            )
+
+    def dump(self):
+        # forked worker processes inherit the tracer, but only the submitting process writes it
+        if os.getpid() != self.pid:
+            return
+        os.makedirs(os.path.dirname(self.trace_file), exist_ok=True)
+        with self.lock:
+            trace = {
+                "traceEvents": self.events,
+                "displayTimeUnit": "ms",
+                "otherData": {"fs_operations": dict(self.fs_operations)},
+            }
+            with open(self.trace_file, "w") as f:
+                json.dump(trace, f)
+        # imported here, as the framework imports this module
+        from framework import console
+
+        console.log(f"Trace of {len(self.events)} events written to {self.trace_file}")
+
+
+tracer = None
+if TRACE_DIR:
+    tracer = Tracer(
+        os.path.join(
+            os.path.abspath(os.path.expandvars(TRACE_DIR)),
+            "trace_{}_{}.json".format(time.strftime("%Y_%m_%d_%H_%M_%S"), os.getpid()),
+        )
+    )
+    atexit.register(tracer.dump)
+
+
+def traced_method(func, category, name_fn):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        begin = tracer.timestamp()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            name, args_ = name_fn(self)
+            tracer.record(name, category, begin, args_)
+
+    wrapper._traced = True
+    return wrapper
+
+
+def task_name(method):
+    def name_fn(task):
+        return f"{task.__class__.__name__}.{method}", {"task_id": task.task_id}
+
+    return name_fn
+
+
+def proxy_name(method):
+    def name_fn(proxy):
+        return (
+            f"{proxy.task.__class__.__name__}.{method} (workflow)",
+            {"task_id": proxy.task.task_id},
+        )
+
+    return name_fn
+
+
+def traced_fs_operation(func, operation):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        # only the outermost operation is counted, e.g. exists calls stat
+        depth = getattr(tracer.local, "fs_depth", 0)
+        tracer.local.fs_depth = depth + 1
+        begin = tracer.timestamp()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            tracer.local.fs_depth = depth
+            if depth == 0:
+                path = str(args[0]) if args else ""
+                tracer.record(
+                    f"{self.__class__.__name__}.{operation}",
+                    "fs",
+                    begin,
+                    {"path": path},
+                )
+                tracer.count(operation, begin)
+
+    wrapper._traced = True
+    return wrapper
+
+
+def instrument_task_class(cls):
+    """
+    The function `instrument_task_class` wraps the traced methods defined by a task class, if
+    tracing is enabled. Inherited methods are traced by the class defining them.
+
+    :param cls: The task class
+    """
+    if tracer is None:
+        return
+    for method in TRACED_METHODS:
+        func = cls.__dict__.get(method)
+        if func is None or getattr(func, "_traced", False) or not callable(func):
+            continue
+        setattr(cls, method, traced_method(func, "task", task_name(method)))
+
+
+def instrument_base_task(cls):
+    """
+    The function `instrument_base_task` wraps the traced methods of a base task class, including
+    the ones it inherits from law and luigi, and the methods of the workflow proxies and the remote
+    file systems of law, if tracing is enabled.
+
+    :param cls: The base task class
+    """
+    if tracer is None:
+        return
+    from law.workflow.base import BaseWorkflowProxy
+    from law.workflow.remote import BaseRemoteWorkflowProxy
+    from law.target.remote.base import RemoteFileSystem
+
+    for method in TRACED_METHODS:
+        func = getattr(cls, method, None)
+        if func is not None and not getattr(func, "_traced", False):
+            setattr(cls, method, traced_method(func, "task", task_name(method)))
+    for proxy_cls in [BaseWorkflowProxy, BaseRemoteWorkflowProxy]:
+        for method in ["requires", "output", "complete"]:
+            func = proxy_cls.__dict__.get(method)
+            if func is not None and not getattr(func, "_traced", False):
+                setattr(
+                    proxy_cls,
+                    method,
+                    traced_method(func, "workflow", proxy_name(method)),
+                )
+    for operation in FS_OPERATIONS:
+        func = RemoteFileSystem.__dict__.get(operation)
+        if func is not None and not getattr(func, "_traced", False):
+            setattr(RemoteFileSystem, operation, traced_fs_operation(func, operation))
@@ -2,29 +2,57 @@ import os
 from rich.table import Table
 from rich import print as rprint
 from rich.live import Live
-from rich.console import Console
+from rich.console import Console, Group
 from datetime import datetime
+import argparse
+import csv
+import json
 import time
 import sys
 import shlex
 
+# the tasks to show the status of, for each task that can be monitored
+detailed_mapping = {
+    "ProduceSamples": "CROWNRun",
+    "ProduceFriends": "CROWNFriends",
+    "ProduceMultiFriends": "CROWNMultiFriends",
+}
+
 
 def parse_args_from_law():
     """
     The function `parse_args_from_law` parses command line arguments for a script with specific
-    requirements related to a "law" command.
-    :return: The function `parse_args_from_law` returns a tuple containing two elements:
+    requirements related to a "law" command. Options of the monitor itself are given in front of the
+    law command.
+    :return: The function `parse_args_from_law` returns a tuple containing three elements:
     1. `args_dict`: a dictionary containing the arguments passed to the script in the format of
     key-value pairs where the key is the argument name (without the leading "--") and the value is the
     argument value.
-    2. `arguments[3]`: the fourth argument passed to the script which is the name of the law task to run.
+    2. the name of the law task to run.
+    3. the options of the monitor.
     """
-    arguments = sys.argv
-    if arguments[1] != "law" or arguments[2] != "run" or len(arguments) < 4:
+    parser = argparse.ArgumentParser(
+        usage="monitor_production [--window SECONDS] [--export FILE] <your_full_law_command>"
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=3600,
+        help="sliding window (s) the processing rates are computed over",
+    )
+    parser.add_argument(
+        "--export",
+        default=None,
+        help="file the time series of the sample status is appended to, as csv if it ends with .csv, json lines otherwise",
+    )
+    start = sys.argv.index("law") if "law" in sys.argv else len(sys.argv)
+    options = parser.parse_args(sys.argv[1:start])
+    arguments = sys.argv[start - 1 :]
+    if len(arguments) < 4 or arguments[1] != "law" or arguments[2] != "run":
         rprint(
             """
         Wrong usage of script, to run it, just add <monitor_production> in front of your law command.
-        Usage: monitor_production <your_full_law_command>
+        Usage: monitor_production [--window SECONDS] [--export FILE] <your_full_law_command>
         Example: monitor_production law run ProduceSamples --analysis tau --config config --sample-list samples_18.txt --production-tag best_samples_eu --workers 100 --scopes mt --shifts None
         """
         )
@@ -33,7 +61,7 @@ def parse_args_from_law():
     for i in range(1, len(arguments)):
         if arguments[i].startswith("--"):
             args_dict[arguments[i].replace("--", "")] = arguments[i + 1]
-    return args_dict, arguments[3]
+    return args_dict, arguments[3], options
 
 
 def parse_law(arguments, task):
@@ -49,11 +77,6 @@ def parse_law(arguments, task):
     for each sample, respectively.
     """
     # build the law command
-    detailed_mapping = {
-        "ProduceSamples": "CROWNRun",
-        "ProduceFriends": "CROWNFriends",
-        "ProduceMultiFriends": "CROWNMultifriends",
-    }
     argument = [f"--{key} {value}" for key, value in arguments.items()]
 
     law_cmd = f"law run {task} {' '.join(argument)} --print-status -1"
@@ -81,7 +104,294 @@ def parse_law(arguments, task):
     return data
 
 
-def build_table(new_data, old_data=None, skip_finished=True):
+def status_index_file(arguments):
+    """
+    The function `status_index_file` returns the path of the status index of the production, that is
+    filled by the HTCondor workflows, see HTCondorWorkflow.register_status in framework.py.
+
+    :param arguments: The arguments of the law command
+    :return: the path of the index, or None if no production tag is given
+    """
+    from law.config import Config
+
+    if "production-tag" not in arguments:
+        return None
+    job_file_dir = Config.instance().get_expanded("job", "job_file_dir")
+    return os.path.join(
+        os.path.dirname(job_file_dir),
+        "logs",
+        arguments["production-tag"],
+        "status_index.json",
+    )
+
+
+def list_directory(remote, directory):
+    """
+    The function `list_directory` returns the file names in an output directory, an empty list if
+    it does not exist yet. Other errors, e.g. of the storage, are raised.
+    """
+    import law
+
+    if remote:
+        law.contrib.load("wlcg")
+        target = law.wlcg.WLCGDirectoryTarget(directory)
+        if not target.exists():
+            return []
+        return target.listdir()
+    try:
+        return os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+
+def parse_index(index, task, readers):
+    """
+    The function `parse_index` returns the status of the samples from the status index of the
+    production. Only the output directories of workflows, whose jobs finished since the last call,
+    are listed, instead of checking all outputs with law.
+
+    :param index: The ProductionStatusIndex of the production
+    :param task: The name of the law task
+    :param readers: The event log readers, kept between calls to read the logs incrementally
+    :return: a dictionary mapping the sample names to the number of done and total branches, and of
+    running and idle jobs
+    """
+    return index.refresh(list_directory, readers, task=detailed_mapping[task])
+
+
+class LawStatus(object):
+    """
+    Status of the samples determined with law, used for the samples, whose workflows are not in the
+    status index, as they did not start yet or were already complete when the production started.
+    law is only run again after the refresh interval, while one of these samples is not done.
+    """
+
+    def __init__(self, arguments, task, refresh=600):
+        self.arguments = arguments
+        self.task = task
+        self.refresh = refresh
+        self.data = None
+        self.updated = 0
+
+    def merge(self, data):
+        """
+        The function `merge` adds the samples missing in the status from the status index.
+
+        :param data: The status of the samples, as returned by `parse_index`
+        :return: the status of all samples, the job counts of the added samples are zero
+        """
+        if self.data is None or (
+            time.time() - self.updated > self.refresh
+            and any(
+                status["done"] < status["total"]
+                for sample, status in self.data.items()
+                if sample not in data
+            )
+        ):
+            self.data = parse_law(self.arguments, self.task)
+            self.updated = time.time()
+        merged = dict(data)
+        for sample, status in self.data.items():
+            if sample not in merged:
+                merged[sample] = dict(status, running=0, idle=0, failing=0)
+        return merged
+
+
+def load_sample_events(task):
+    """
+    The function `load_sample_events` reads the number of events of each sample from the dataset
+    database configured for the task.
+
+    :param task: The name of the law task
+    :return: a dictionary mapping the sample names to their number of events, empty if the database
+    is not available
+    """
+    import luigi
+
+    database = luigi.configuration.get_config().get(task, "dataset_database", None)
+    if database is None or not os.path.exists(database):
+        return {}
+    with open(database, "r") as stream:
+        sample_db = json.load(stream)
+    return {
+        nick: sample_data["nevents"]
+        for nick, sample_data in sample_db.items()
+        if "nevents" in sample_data
+    }
+
+
+class ProductionAnalytics(object):
+    """
+    Tracks the progress of the samples between the refreshes of the monitor. The processing rates
+    are computed over a sliding window, the events are estimated from the number of events of each
+    sample, assuming they are spread evenly over its branches. Each status is appended to the export
+    file, if one is given.
+    """
+
+    def __init__(self, window=3600, events=None, export=None):
+        self.window = window
+        self.events = events or {}
+        self.export = export
+        self.history = []
+
+    def update(self, data, now=None):
+        """
+        The function `update` adds the status of the samples at the given time.
+
+        :param data: A dictionary mapping the sample names to their status, as returned by
+        `parse_index` or `parse_law`
+        :param now: The time of the status, defaults to the current time
+        """
+        now = now if now is not None else time.time()
+        self.history.append((now, data))
+        # keep the last status before the window, to compute the rates over the full window
+        while len(self.history) > 2 and self.history[1][0] <= now - self.window:
+            self.history.pop(0)
+        if self.export:
+            self.write(now, data)
+
+    @staticmethod
+    def done(data, sample=None):
+        """
+        The function `done` returns the number of done branches of a sample in a status.
+
+        :param data: The status of the samples
+        :param sample: The sample name, all samples are summed if not given
+        :return: the number of done branches, or None if the sample is not in the status
+        """
+        if sample is None:
+            return sum(status["done"] for status in data.values())
+        if sample not in data:
+            return None
+        return data[sample]["done"]
+
+    def rate(self, sample=None):
+        """
+        The function `rate` returns the number of branches processed per hour within the window.
+
+        :param sample: The sample name, all samples are summed if not given
+        :return: the rate, or None if there is no earlier status of the sample
+        """
+        now, latest = self.history[-1]
+        for then, earlier in self.history[:-1]:
+            done = self.done(earlier, sample)
+            if now - then > 0 and done is not None:
+                progress = self.done(latest, sample) - done
+                return max(0.0, progress / (now - then) * 3600)
+        return None
+
+    def event_rate(self, sample, rate):
+        """
+        The function `event_rate` estimates the number of events processed per hour of a sample.
+        """
+        data = self.history[-1][1]
+        if rate is None or sample not in self.events or not data[sample]["total"]:
+            return None
+        return rate * self.events[sample] / data[sample]["total"]
+
+    @staticmethod
+    def eta(done, total, rate):
+        """
+        The function `eta` returns the expected remaining time in hours, None if nothing progresses.
+        """
+        if done >= total:
+            return 0.0
+        if not rate:
+            return None
+        return (total - done) / rate
+
+    def write(self, now, data):
+        rows = []
+        for sample, status in data.items():
+            rate = self.rate(sample)
+            rows.append(
+                {
+                    "time": datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+                    "sample": sample,
+                    "done": status["done"],
+                    "total": status["total"],
+                    "running": status.get("running"),
+                    "idle": status.get("idle"),
+                    "failing": status.get("failing"),
+                    "branches_per_hour": rate,
+                    "events_per_hour": self.event_rate(sample, rate),
+                }
+            )
+        new_file = not os.path.exists(self.export)
+        with open(self.export, "a") as f:
+            if self.export.endswith(".csv"):
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else [])
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+
+
+def format_rate(rate):
+    return "-" if rate is None else f"{rate:.1f}"
+
+
+def format_eta(hours):
+    if hours is None:
+        return "stalled"
+    if hours == 0:
+        return "done"
+    return f"{int(hours)}h{int(hours % 1 * 60):02d}m"
+
+
+def build_summary(data, analytics, n_samples=5):
+    """
+    The function `build_summary` creates a table of the samples, that would finish last at their
+    current rate, and of the samples with the most branches, whose latest job failed.
+
+    :param data: The status of the samples
+    :param analytics: The ProductionAnalytics of the production
+    :param n_samples: The number of samples shown in each category
+    :return: a Table object
+    """
+    table = Table(title="Samples needing attention", highlight=True)
+    table.add_column("Sample", justify="right")
+    table.add_column("Reason", justify="left")
+    table.add_column("Done", justify="right")
+    table.add_column("Total", justify="right")
+    table.add_column("Branches/h", justify="right")
+    table.add_column("ETA", justify="right")
+    etas = {}
+    for sample, status in data.items():
+        if status["done"] < status["total"]:
+            etas[sample] = analytics.eta(
+                status["done"], status["total"], analytics.rate(sample)
+            )
+    # stalled samples first, then the ones with the longest remaining time
+    slowest = sorted(
+        etas, key=lambda sample: float("inf") if etas[sample] is None else etas[sample]
+    )[::-1][:n_samples]
+    failing = sorted(
+        [sample for sample in data if data[sample].get("failing")],
+        key=lambda sample: data[sample]["failing"],
+        reverse=True,
+    )[:n_samples]
+    for reason, samples in [("slowest", slowest), ("failing", failing)]:
+        for sample in samples:
+            status = data[sample]
+            label = reason
+            if reason == "failing":
+                label = f"{status['failing']} failing branches"
+            table.add_row(
+                sample,
+                label,
+                str(status["done"]),
+                str(status["total"]),
+                format_rate(analytics.rate(sample)),
+                format_eta(etas.get(sample, 0.0)),
+                style="red" if reason != "slowest" else None,
+            )
+    return table
+
+
+def build_table(new_data, old_data=None, skip_finished=True, analytics=None):
     """
     The `build_table` function creates a table displaying sample status information, with an option to
     skip showing finished samples.
@@ -97,6 +407,8 @@ def build_table(new_data, old_data=None, skip_finished=True):
     to skip showing samples that are already marked as done. If `skip_finished` is set to `True`, only
     samples that are not done yet will be displayed in the table. If it is set to `False`, all, defaults
     to True (optional)
+    :param analytics: The ProductionAnalytics of the production, adds the processing rates and the
+    expected remaining time of each sample, if given (optional)
     :return: The function `build_table` returns a Table object that displays the status of samples,
     including information such as sample name, done count, total count, and completion percentage. The
     table also includes a total row showing the overall progress of all samples.
@@ -116,6 +428,15 @@ def build_table(new_data, old_data=None, skip_finished=True):
     table.add_column("Done", justify="right")
     table.add_column("Total", justify="right")
     table.add_column("Percent", justify="right")
+    # the job counts are only known from the status index
+    with_jobs = all("running" in new_data[sample] for sample in new_data)
+    if with_jobs:
+        table.add_column("Running", justify="right")
+        table.add_column("Idle", justify="right")
+    if analytics is not None:
+        table.add_column("Branches/h", justify="right")
+        table.add_column("Events/h", justify="right")
+        table.add_column("ETA", justify="right")
     # add a total row at the end with the sum of all percentual completion
     total_done = sum((new_data[sample]["done"] for sample in new_data))
     total_total = sum((new_data[sample]["total"] for sample in new_data))
@@ -127,13 +448,28 @@ def build_table(new_data, old_data=None, skip_finished=True):
     else:
         style = None
 
-    table.add_row(
+    total_row = [
         "Total (including finished samples)",
         str(total_done),
         str(total_total),
         percent_total,
-        style=style,
-    )
+    ]
+    if with_jobs:
+        total_row += [
+            str(sum(new_data[sample][key] for sample in new_data))
+            for key in ["running", "idle"]
+        ]
+    if analytics is not None:
+        rate = analytics.rate()
+        event_rates = [
+            analytics.event_rate(sample, analytics.rate(sample)) for sample in new_data
+        ]
+        total_row += [
+            format_rate(rate),
+            format_rate(sum(r for r in event_rates if r is not None) or None),
+            format_eta(analytics.eta(total_done, total_total, rate)),
+        ]
+    table.add_row(*total_row, style=style)
 
     for sample in new_data:
         done = new_data[sample]["done"]
@@ -149,29 +485,63 @@ def build_table(new_data, old_data=None, skip_finished=True):
         else:
             style = None
 
-        table.add_row(sample, str(done), str(total), str(percent) + "%", style=style)
+        row = [sample, str(done), str(total), str(percent) + "%"]
+        if with_jobs:
+            row += [str(new_data[sample]["running"]), str(new_data[sample]["idle"])]
+        if analytics is not None:
+            rate = analytics.rate(sample)
+            row += [
+                format_rate(rate),
+                format_rate(analytics.event_rate(sample, rate)),
+                format_eta(analytics.eta(done, total, rate)),
+            ]
+        table.add_row(*row, style=style)
     return table
 
 
 if __name__ == "__main__":
-    args_dict, taskname = parse_args_from_law()
+    args_dict, taskname, options = parse_args_from_law()
     live = True
     skip = True
     console = Console()
+    # use the status index of the production for the workflows registered in it, and law, which
+    # builds the task graph and checks all outputs, only for the other samples
+    index_file = status_index_file(args_dict)
+    readers = {}
+    get_status = lambda: parse_law(args_dict, taskname)
+    if index_file is not None:
+        from helpers.StatusIndex import ProductionStatusIndex
+
+        index = ProductionStatusIndex(index_file)
+        law_status = LawStatus(args_dict, taskname)
+        get_status = lambda: law_status.merge(parse_index(index, taskname, readers))
+    analytics = ProductionAnalytics(
+        window=options.window,
+        events=load_sample_events(taskname),
+        export=options.export,
+    )
+
+    def render(data, previous_data=None):
+        analytics.update(data)
+        return Group(
+            build_table(data, previous_data, skip, analytics),
+            build_summary(data, analytics),
+        )
+
     if live:
         rprint("Getting live updates...")
-        previous_data = parse_law(args_dict, taskname)
+        previous_data = get_status()
         with Live(
-            build_table(parse_law(args_dict, taskname), previous_data, skip),
+            render(get_status(), previous_data),
             auto_refresh=False,
             console=console,
             screen=True,
         ) as live:
             while True:
                 live.update(
-                    build_table(parse_law(args_dict, taskname), previous_data, skip),
+                    render(get_status(), previous_data),
                     refresh=True,
                 )
                 time.sleep(30)
     else:
-        rprint(build_table(parse_law(args_dict, taskname)), skip)
+        rprint(build_table(get_status()), skip)
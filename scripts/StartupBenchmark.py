@@ -0,0 +1,225 @@
+import argparse
+import configparser
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from rich.console import Console
+from rich.table import Table
+
+# imported by every law command and job before any task module
+BASELINE = "law, luigi"
+
+
+def modules_from_config(law_config):
+    """
+    The function `modules_from_config` reads the task modules from the [modules] section of the law
+    config.
+
+    :param law_config: The path of the law config
+    :return: a list of module names
+    """
+    parser = configparser.ConfigParser(allow_no_value=True, delimiters=(":", "="))
+    parser.optionxform = str
+    parser.read(law_config)
+    if not parser.has_section("modules"):
+        return []
+    return list(parser["modules"].keys())
+
+
+def parse_importtime(stderr):
+    """
+    The function `parse_importtime` parses the output of python -X importtime. The modules are
+    listed after their own imports, so the imports are assigned to the next module imported directly
+    by the command.
+
+    :param stderr: The standard error of the python process
+    :return: a dictionary mapping the modules imported directly by the command to their cumulative
+    import time (s) and a Counter of the self time (s) per top level package of their imports
+    """
+    modules = {}
+    packages = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        parts = line.replace("import time:", "|", 1).split("|")
+        _, self_us, cumulative_us, name = parts
+        packages[name.strip().split(".")[0]] += int(self_us) / 1e6
+        # only the modules imported directly by the command are not indented
+        if not name[1:].startswith(" "):
+            modules[name.strip()] = (int(cumulative_us) / 1e6, packages)
+            packages = Counter()
+    return modules
+
+
+def benchmark_command(command, repeat, env):
+    """
+    The function `benchmark_command` runs a command repeatedly in fresh processes and measures the
+    wall time of each run.
+
+    :param command: The command to run
+    :param repeat: The number of runs
+    :param env: The environment of the runs
+    :return: a list of the wall times (s) and a list of the standard error of the runs
+    """
+    times = []
+    stderrs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            command,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        times.append(time.perf_counter() - start)
+        stderrs.append(result.stderr)
+        if result.returncode != 0:
+            raise Exception(f"{' '.join(command)} failed:\n{result.stderr}")
+    return times, stderrs
+
+
+def benchmark_import(module, repeat, env):
+    """
+    The function `benchmark_import` measures the startup of a python process importing a module.
+    law and luigi are imported first in the same process, so that the import time of the module
+    only contains the cost beyond them, which is not affected by the noise between processes.
+
+    :param module: The module to import, None to only import law and luigi
+    :param repeat: The number of runs
+    :param env: The environment of the runs
+    :return: a dictionary with the results
+    """
+    code = f"import {BASELINE}" + (f"; import {module}" if module else "")
+    times, stderrs = benchmark_command(
+        [sys.executable, "-X", "importtime", "-c", code], repeat, env
+    )
+    import_times = []
+    module_times = []
+    packages = Counter()
+    for stderr in stderrs:
+        modules = parse_importtime(stderr)
+        import_times.append(sum(seconds for seconds, _ in modules.values()))
+        if module:
+            seconds, module_packages = modules.get(module, (0.0, Counter()))
+            module_times.append(seconds)
+            packages.update(module_packages)
+    return {
+        "name": module or BASELINE,
+        "wall_s": statistics.median(times),
+        "wall_min_s": min(times),
+        "import_s": statistics.median(import_times),
+        "module_s": statistics.median(module_times) if module else None,
+        "top_packages": [
+            [package, round(seconds / repeat, 4)]
+            for package, seconds in packages.most_common(5)
+        ],
+    }
+
+
+def benchmark_law_run(task, repeat, env):
+    """
+    The function `benchmark_law_run` measures `law run <task> --help`, which resolves the task from
+    the law index, imports its module and parses the parameters, without running anything.
+
+    :param task: The task family
+    :param repeat: The number of runs
+    :param env: The environment of the runs
+    :return: a dictionary with the results
+    """
+    times, _ = benchmark_command(["law", "run", task, "--help"], repeat, env)
+    return {
+        "name": f"law run {task} --help",
+        "wall_s": statistics.median(times),
+        "wall_min_s": min(times),
+        "import_s": None,
+        "module_s": None,
+        "top_packages": [],
+    }
+
+
+def format_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1e3:.0f} ms"
+
+
+def build_table(results):
+    table = Table(title="Startup benchmark", highlight=True)
+    table.add_column("Command", justify="left")
+    table.add_column("Wall (median)", justify="right")
+    table.add_column("Wall (min)", justify="right")
+    table.add_column("Imports", justify="right")
+    table.add_column("Beyond law/luigi", justify="right")
+    table.add_column("Slowest imports beyond law/luigi", justify="left")
+    for result in results:
+        table.add_row(
+            result["name"],
+            format_ms(result["wall_s"]),
+            format_ms(result["wall_min_s"]),
+            format_ms(result["import_s"]),
+            format_ms(result["module_s"]),
+            ", ".join(
+                f"{package} {format_ms(seconds)}"
+                for package, seconds in result["top_packages"]
+            ),
+        )
+    return table
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of law commands and jobs, which import the task "
+        "modules in a fresh python process each. Run it after sourcing setup.sh."
+    )
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        help="Task modules to import, defaults to the [modules] of the law config",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of runs of each command"
+    )
+    parser.add_argument(
+        "--law-run",
+        nargs="*",
+        default=[],
+        metavar="TASK",
+        help="Tasks to additionally measure `law run <task> --help` for",
+    )
+    parser.add_argument(
+        "--export", default=None, help="Write the results to this JSON file"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    console = Console()
+    modules = args.modules
+    if not modules:
+        law_config = os.getenv("LAW_CONFIG_FILE")
+        if not law_config:
+            raise Exception("No modules given and LAW_CONFIG_FILE is not set")
+        modules = modules_from_config(law_config)
+    env = dict(os.environ)
+    results = []
+    with console.status("Measuring import of law and luigi ..."):
+        results.append(benchmark_import(None, args.repeat, env))
+    for module in modules:
+        with console.status(f"Measuring import of {module} ..."):
+            results.append(benchmark_import(module, args.repeat, env))
+    for task in args.law_run:
+        with console.status(f"Measuring law run {task} ..."):
+            results.append(benchmark_law_run(task, args.repeat, env))
+    console.print(build_table(results))
+    if args.export:
+        with open(args.export, "w") as f:
+            json.dump(results, f, indent=4)
+        console.print(f"Results written to {args.export}")
+
+
+if __name__ == "__main__":
+    main()
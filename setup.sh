@@ -234,8 +234,10 @@ action() {
     _addpy "${BASE_DIR}/processor"
     _addpy "${BASE_DIR}/processor/tasks"
 
-    # Create law index for workflow if not previously done
-    if [[ ! -f "${LAW_HOME}/index" ]]; then
+    # Create law index for workflow if not previously done, or recreate it if a task module or the
+    # law config changed since. law run only imports the module of the task found in the index.
+    if [[ ! -f "${LAW_HOME}/index" ]] || [[ -n "$(find "${BASE_DIR}/processor" "${LAW_CONFIG_FILE}" \
+        \( -name "*.py" -o -name "*.cfg" \) -newer "${LAW_HOME}/index" -print -quit)" ]]; then
         law index --verbose
         if [[ "$?" -eq "1" ]]; then
             echo "Law index failed."
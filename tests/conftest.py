@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the tasks and helpers are imported the same way the law tasks import them
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo, "processor"))
+sys.path.insert(0, os.path.join(repo, "processor", "tasks"))
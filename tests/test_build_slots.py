@@ -0,0 +1,83 @@
+import os
+import subprocess
+import pytest
+from helpers.BuildSlots import BuildSlotAllocator, MakeJobServer
+
+
+@pytest.fixture
+def allocator(tmp_path):
+    return BuildSlotAllocator(tmp_path / "slots.json", 8, poll_interval=0.01)
+
+
+@pytest.fixture
+def other_build():
+    # the entries of processes, that no longer exist, are removed, so other builds need a living pid
+    process = subprocess.Popen(["sleep", "60"])
+    yield str(process.pid)
+    process.kill()
+    process.wait()
+
+
+def test_single_build_uses_all_slots(allocator):
+    assert allocator.acquire(log=lambda message: None) == 8
+    allocator.release()
+    with allocator._locked_state() as state:
+        assert state == {}
+
+
+def test_shares_of_builds(allocator):
+    state = {"1": 0, "2": 0, "3": 0}
+    # the remainder is given to the first builds
+    assert [allocator.allowance(state, pid) for pid in sorted(state)] == [3, 3, 2]
+    # slots held by other builds are not taken away
+    state = {"1": 0, "2": 7}
+    assert allocator.allowance(state, "1") == 1
+    state = {"1": 0, "2": 8}
+    assert allocator.allowance(state, "1") == 0
+    # every build gets at least one slot, more builds than slots have to wait
+    state = {str(pid): 0 for pid in range(10)}
+    assert allocator.allowance(state, "0") == 1
+
+
+def test_rebalance_running_build(allocator, other_build):
+    jobserver = MakeJobServer(allocator.acquire(log=lambda message: None))
+    try:
+        assert jobserver.jobs == 8
+        # another build starts, make gave back all tokens, so the build shrinks to its share
+        with allocator._locked_state() as state:
+            state[other_build] = 0
+        allocator.rebalance(jobserver, log=lambda message: None)
+        assert jobserver.jobs == 4
+        with allocator._locked_state() as state:
+            assert state[str(os.getpid())] == 4
+        # the other build finished, the build grows again
+        allocator.release(pid=other_build)
+        allocator.rebalance(jobserver, log=lambda message: None)
+        assert jobserver.jobs == 8
+    finally:
+        jobserver.close()
+        allocator.release()
+
+
+def test_removes_killed_builds(allocator):
+    process = subprocess.Popen(["true"])
+    process.wait()
+    with allocator._locked_state() as state:
+        state[str(process.pid)] = 8
+    assert allocator.acquire(log=lambda message: None) == 8
+    allocator.release()
+
+
+def test_jobserver_tokens():
+    jobserver = MakeJobServer(3)
+    try:
+        # make runs one job without a token
+        assert len(os.read(jobserver.read_fd, 16)) == 2
+        # tokens held by make can not be taken back
+        jobserver.shrink(1, timeout=0.01)
+        assert jobserver.jobs == 3
+        jobserver.grow(4)
+        assert len(os.read(jobserver.read_fd, 16)) == 1
+        assert "--jobserver-fds" in jobserver.environment()[0]
+    finally:
+        jobserver.close()
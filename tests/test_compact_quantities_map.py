@@ -0,0 +1,79 @@
+import subprocess
+import sys
+from helpers.CompactQuantitiesMap import CompactQuantitiesMap
+
+STANDARD = {
+    "2018": {
+        "dy": {
+            "mt": {
+                "nominal": ["pt_1", "pt_2", "m_vis"],
+                "tauEsUp": ["pt_2", "m_vis"],
+            },
+            "et": {"nominal": ["pt_1", "m_vis"]},
+        }
+    },
+    "2017": {"ttbar": {"mt": {"nominal": ["pt_1"]}}},
+}
+
+
+def test_standard_round_trip():
+    quantities_map = CompactQuantitiesMap.from_dict(STANDARD)
+    # the quantities are exported sorted
+    expected = {
+        "2018": {
+            "dy": {
+                "mt": {
+                    "nominal": ["m_vis", "pt_1", "pt_2"],
+                    "tauEsUp": ["m_vis", "pt_2"],
+                },
+                "et": {"nominal": ["m_vis", "pt_1"]},
+            }
+        },
+        "2017": {"ttbar": {"mt": {"nominal": ["pt_1"]}}},
+    }
+    assert quantities_map.to_dict() == expected
+    # every quantity name is stored once
+    assert sorted(quantities_map.quantities) == ["m_vis", "pt_1", "pt_2"]
+
+
+def test_compact_file_round_trip(tmp_path):
+    filename = str(tmp_path / "quantities_map.json")
+    CompactQuantitiesMap.from_dict(STANDARD).dump(filename)
+    assert CompactQuantitiesMap.is_compact(filename)
+    loaded = CompactQuantitiesMap.load(filename)
+    assert loaded.to_dict() == CompactQuantitiesMap.from_dict(STANDARD).to_dict()
+    CompactQuantitiesMap.from_dict(STANDARD).dump(filename, compact=False)
+    assert not CompactQuantitiesMap.is_compact(filename)
+    assert CompactQuantitiesMap.load(filename).to_dict() == loaded.to_dict()
+
+
+def test_update_merges_shifts():
+    quantities_map = CompactQuantitiesMap.from_dict(
+        {"2018": {"dy": {"mt": {"nominal": ["pt_1"]}}}}
+    )
+    other = CompactQuantitiesMap.from_dict(
+        {"2018": {"dy": {"mt": {"nominal": ["pt_2", "pt_1"], "tauEsUp": ["pt_2"]}}}}
+    )
+    quantities_map.update(other)
+    quantities_map.update({"2017": {"dy": {"mt": {"nominal": ["m_vis"]}}}})
+    assert quantities_map.to_dict() == {
+        "2018": {"dy": {"mt": {"nominal": ["pt_1", "pt_2"], "tauEsUp": ["pt_2"]}}},
+        "2017": {"dy": {"mt": {"nominal": ["m_vis"]}}},
+    }
+
+
+def test_expand_script(tmp_path):
+    compact = str(tmp_path / "compact.json")
+    expanded = str(tmp_path / "expanded.json")
+    CompactQuantitiesMap.from_dict(STANDARD).dump(compact)
+    script = sys.modules[CompactQuantitiesMap.__module__].__file__
+    check = subprocess.run([sys.executable, script, "--input", compact, "--check"])
+    assert check.returncode == 0
+    subprocess.run(
+        [sys.executable, script, "--input", compact, "--output", expanded], check=True
+    )
+    assert not CompactQuantitiesMap.is_compact(expanded)
+    assert (
+        CompactQuantitiesMap.load(expanded).to_dict()
+        == CompactQuantitiesMap.load(compact).to_dict()
+    )
@@ -0,0 +1,86 @@
+from helpers.HTCondorEventLog import (
+    FAILED,
+    FINISHED,
+    PENDING,
+    RUNNING,
+    HTCondorEventLogReader,
+    HTCondorEventLogWriter,
+)
+from helpers.JobLogs import rotate_log
+
+
+def statuses(states):
+    return {job_id: state["status"] for job_id, state in states.items()}
+
+
+def test_incremental_updates(tmp_path):
+    log = str(tmp_path / "CROWNRun.txt")
+    writer = HTCondorEventLogWriter(log, 12)
+    reader = HTCondorEventLogReader([log])
+    writer.submit(0)
+    writer.submit(1)
+    assert statuses(reader.update()) == {"12.0": PENDING, "12.1": PENDING}
+    writer.execute(0, host="10.0.0.1")
+    writer.execute(1)
+    writer.terminate(0, memory=1500, cpu_s=3600, cpus=4)
+    writer.terminate(1, return_value=2)
+    states = reader.update()
+    assert statuses(states) == {"12.0": FINISHED, "12.1": FAILED}
+    assert states["12.1"]["error"] == "non-zero exit code 2"
+    extra = states["12.0"]["extra"]
+    assert extra["remote_host"] == "<10.0.0.1:9618>"
+    assert extra["mem_peak_mb"] == 1500
+    assert extra["cpu_s"] == 3600
+    assert extra["cpus_requested"] == 4
+    assert "wall_s" in extra
+
+
+def test_incomplete_event_is_read_again(tmp_path):
+    log = str(tmp_path / "CROWNRun.txt")
+    writer = HTCondorEventLogWriter(log, 12)
+    reader = HTCondorEventLogReader([log])
+    writer.submit(0)
+    reader.update()
+    offset = reader.offsets[log]
+    # the schedd is still writing the event
+    with open(log, "a") as f:
+        f.write("001 (012.000.000) 2024-01-31 12:00:00 Job executing on host: <h:1>\n")
+    assert statuses(reader.update()) == {"12.0": PENDING}
+    assert reader.offsets[log] == offset
+    with open(log, "a") as f:
+        f.write("...\n")
+    assert statuses(reader.update()) == {"12.0": RUNNING}
+
+
+def test_held_and_released_jobs(tmp_path):
+    log = str(tmp_path / "CROWNRun.txt")
+    writer = HTCondorEventLogWriter(log, 12)
+    reader = HTCondorEventLogReader([log])
+    writer.submit(0)
+    writer.execute(0)
+    writer.hold(0, reason="memory limit exceeded")
+    state = reader.update()["12.0"]
+    assert state["status"] == FAILED
+    assert state["error"] == "job held: memory limit exceeded"
+    writer.release(0)
+    assert statuses(reader.update()) == {"12.0": PENDING}
+
+
+def test_rotated_log(tmp_path):
+    log = str(tmp_path / "CROWNRun.txt")
+    writer = HTCondorEventLogWriter(log, 12)
+    reader = HTCondorEventLogReader([log])
+    writer.submit(0)
+    writer.submit(1)
+    writer.execute(0)
+    reader.update()
+    rotated = rotate_log(log, 0)
+    assert rotated.endswith(".txt.gz")
+    # the schedd starts a new log, which may get the inode of the compressed old one
+    writer.terminate(0)
+    states = reader.update()
+    assert statuses(states) == {"12.0": FINISHED, "12.1": PENDING}
+    # the rotated log and the new one are read in order by a new reader
+    states = HTCondorEventLogReader([rotated, log]).update()
+    assert statuses(states) == {"12.0": FINISHED, "12.1": PENDING}
+    assert "wall_s" in states["12.0"]["extra"]
@@ -0,0 +1,43 @@
+import json
+import subprocess
+import time
+import pytest
+from helpers.IdleJobBudget import IdleJobBudget
+
+
+@pytest.fixture
+def budget(tmp_path):
+    return IdleJobBudget(tmp_path / "idle_jobs.json", 100)
+
+
+def test_allowance_is_shared(budget):
+    assert budget.allowance("workflow_a", 0) == 100
+    # the new jobs of the first workflow count as idle right away
+    assert budget.allowance("workflow_b", 0) == 0
+    # 60 jobs of the first workflow started running, it may submit 60 new ones
+    assert budget.allowance("workflow_a", 40) == 60
+    assert budget.allowance("workflow_b", 0) == 0
+    budget.release("workflow_a")
+    assert budget.allowance("workflow_b", 30) == 70
+    assert budget.allowance("workflow_a", 0) == 0
+
+
+def test_idle_jobs_beyond_the_cap(budget):
+    assert budget.allowance("workflow_a", 150) == 0
+    assert budget.allowance("workflow_b", 0) == 0
+
+
+def test_removes_stale_and_killed_workflows(budget):
+    process = subprocess.Popen(["true"])
+    process.wait()
+    with open(budget.state_file, "w") as f:
+        json.dump(
+            {
+                "killed": {"idle": 100, "pid": process.pid, "time": time.time()},
+                "stale": {"idle": 100, "pid": 1, "time": time.time() - 7200},
+            },
+            f,
+        )
+    assert budget.allowance("workflow_a", 0) == 100
+    with open(budget.state_file, "r") as f:
+        assert list(json.load(f)) == ["workflow_a"]
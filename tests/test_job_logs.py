@@ -0,0 +1,64 @@
+import os
+from helpers.JobLogs import JobLogIndex, compress_log, enforce_retention, rotate_log
+
+
+def write(path, content="log\n"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def job_entry(tmp_path, subdir, job_num, branches):
+    return {
+        "task": "CROWNRun",
+        "subdir": subdir,
+        "job_num": job_num,
+        "branches": branches,
+        "stdout": write(str(tmp_path / "Output" / subdir / f"{job_num}.txt")),
+        "stderr": write(str(tmp_path / "Error" / subdir / f"{job_num}.txt")),
+    }
+
+
+def test_find_branch(tmp_path):
+    index = JobLogIndex(tmp_path / "logs" / "index.jsonl")
+    assert index.find("CROWNRun", 0) == []
+    index.append(
+        [
+            job_entry(tmp_path, "dy", 1, [0, 1]),
+            job_entry(tmp_path, "dy", 2, [2]),
+            job_entry(tmp_path, "ttbar", 1, [0]),
+        ]
+    )
+    assert [entry["subdir"] for entry in index.find("CROWNRun", 0)] == ["dy", "ttbar"]
+    found = index.find("CROWNRun", 1, subdir="dy")
+    assert [entry["job_num"] for entry in found] == [1]
+    assert found[0]["stdout"] == str(tmp_path / "Output" / "dy" / "1.txt")
+    assert index.find("CROWNFriends", 0) == []
+
+
+def test_find_resubmissions_and_compressed_logs(tmp_path):
+    index = JobLogIndex(tmp_path / "logs" / "index.jsonl")
+    first = job_entry(tmp_path, "dy", 1, [0])
+    index.append([first])
+    compress_log(first["stdout"])
+    os.remove(first["stderr"])
+    index.append([job_entry(tmp_path, "dy_retry", 1, [0])])
+    found = index.find("CROWNRun", 0)
+    # the latest submission is last
+    assert [entry["subdir"] for entry in found] == ["dy", "dy_retry"]
+    assert found[0]["stdout"] == f"{first['stdout']}.gz"
+    assert found[0]["stderr"] is None
+
+
+def test_rotation_and_retention(tmp_path):
+    log = write(str(tmp_path / "Log" / "CROWNRun.txt"), "x" * 100)
+    assert rotate_log(log, 1000) is None
+    rotated = rotate_log(log, 10)
+    assert os.path.exists(rotated)
+    assert not os.path.exists(log)
+    running = write(str(tmp_path / "Log" / "CROWNRun.txt"), "x" * 100)
+    # compressed logs are removed, until the limit is met, logs of running jobs are kept
+    assert enforce_retention([str(tmp_path / "Log")], 0) == 1
+    assert not os.path.exists(rotated)
+    assert os.path.exists(running)
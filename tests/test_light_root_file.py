@@ -0,0 +1,73 @@
+import array
+import pytest
+from helpers.LightROOTFile import (
+    ENTRIES_RESHUFFLED,
+    LightROOTFile,
+    UnsupportedROOTFile,
+    read_string_vector_map,
+)
+
+# compression settings of the test files: ZLIB, LZMA and ZSTD
+COMPRESSIONS = {"zlib": 101, "lzma": 207, "zstd": 505}
+
+
+def write_ntuple(filename, compression, entries=1000):
+    ROOT = pytest.importorskip("ROOT")
+    rfile = ROOT.TFile(filename, "RECREATE", "", compression)
+    tree = ROOT.TTree("ntuple", "ntuple")
+    event = array.array("i", [0])
+    pt = array.array("f", [0.0])
+    tree.Branch("event", event, "event/I")
+    tree.Branch("pt_1", pt, "pt_1/F")
+    for i in range(entries):
+        event[0] = i
+        pt[0] = 0.5 * i
+        tree.Fill()
+    tree.SetBit(ROOT.TTree.EStatusBits.kEntriesReshuffled)
+    tree.Write()
+    quantities = ROOT.std.map("std::string", "std::vector<std::string>")()
+    for shift, names in {"nominal": ["pt_1", "event"], "tauEsUp": ["pt_1"]}.items():
+        vector = ROOT.std.vector("std::string")()
+        for name in names:
+            vector.push_back(name)
+        quantities[shift] = vector
+    rfile.WriteObject(quantities, "shift_quantities_map")
+    rfile.Close()
+
+
+@pytest.mark.parametrize("compression", sorted(COMPRESSIONS))
+def test_reset_tree_bit(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    filename = str(tmp_path / "ntuple.root")
+    write_ntuple(filename, COMPRESSIONS[compression])
+    assert LightROOTFile(filename).reset_tree_bit("ntuple", ENTRIES_RESHUFFLED) == 1
+    # the bit is already reset
+    assert LightROOTFile(filename).reset_tree_bit("ntuple", ENTRIES_RESHUFFLED) == 0
+    ROOT = pytest.importorskip("ROOT")
+    rfile = ROOT.TFile.Open(filename)
+    tree = rfile.Get("ntuple")
+    assert not tree.TestBit(ROOT.TTree.EStatusBits.kEntriesReshuffled)
+    assert tree.GetEntries() == 1000
+    tree.GetEntry(999)
+    assert tree.event == 999
+    assert tree.pt_1 == pytest.approx(499.5)
+    rfile.Close()
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_read_string_vector_map(tmp_path, compression):
+    filename = str(tmp_path / "ntuple.root")
+    write_ntuple(filename, COMPRESSIONS[compression])
+    assert read_string_vector_map(filename, "shift_quantities_map") == {
+        "nominal": ["pt_1", "event"],
+        "tauEsUp": ["pt_1"],
+    }
+
+
+def test_not_a_root_file(tmp_path):
+    filename = str(tmp_path / "ntuple.root")
+    with open(filename, "wb") as f:
+        f.write(b"\0" * 128)
+    with pytest.raises(UnsupportedROOTFile):
+        LightROOTFile(filename)
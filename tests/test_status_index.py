@@ -0,0 +1,103 @@
+import os
+import pytest
+from helpers.HTCondorEventLog import HTCondorEventLogWriter
+from helpers.StatusIndex import ProductionStatusIndex
+
+
+class Lister(object):
+    """
+    Lists local directories and counts the listings.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, remote, directory):
+        self.calls.append(directory)
+        return os.listdir(directory) if os.path.isdir(directory) else []
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "a").close()
+
+
+@pytest.fixture
+def index(tmp_path):
+    return ProductionStatusIndex(tmp_path / "status" / "index.json")
+
+
+def branch_outputs(tmp_path, nick, branches):
+    return {
+        branch: [
+            str(tmp_path / "out" / nick / "mt" / f"{nick}_{branch}.root"),
+            str(tmp_path / "out" / nick / "et" / f"{nick}_{branch}.root"),
+        ]
+        for branch in range(branches)
+    }
+
+
+def test_refresh_lists_each_directory_once(tmp_path, index):
+    outputs = branch_outputs(tmp_path, "dy", 3)
+    index.register("run_dy", "CROWNRun", "dy", False, outputs)
+    # branch 0 is done, branch 1 only has one of its outputs
+    for path in outputs[0] + outputs[1][:1]:
+        touch(path)
+    index.set_failing("run_dy", [1, 2])
+    lister = Lister()
+    status = index.refresh(lister, {})
+    assert status == {
+        "dy": {"done": 1, "total": 3, "running": 0, "idle": 0, "failing": 2}
+    }
+    assert sorted(lister.calls) == sorted(
+        {os.path.dirname(path) for path in outputs[0]}
+    )
+    assert list(index.load()["run_dy"]["pending"]) == ["1", "2"]
+    # without finished jobs, the workflow is not listed again
+    touch(outputs[1][1])
+    status = index.refresh(lister, {})
+    assert status["dy"]["done"] == 1
+    assert len(lister.calls) == 2
+    status = index.refresh(lister, {}, full_refresh=-1)
+    assert status["dy"] == {
+        "done": 2,
+        "total": 3,
+        "running": 0,
+        "idle": 0,
+        "failing": 1,
+    }
+
+
+def test_refresh_after_finished_jobs(tmp_path, index):
+    event_log = str(tmp_path / "logs" / "CROWNRun.txt")
+    writer = HTCondorEventLogWriter(event_log, 7)
+    for process in range(2):
+        writer.submit(process)
+    writer.execute(0)
+    outputs = branch_outputs(tmp_path, "dy", 2)
+    index.register("run_dy", "CROWNRun", "dy", False, outputs, event_log=event_log)
+    readers = {}
+    lister = Lister()
+    status = index.refresh(lister, readers)
+    assert status["dy"]["running"] == 1
+    assert status["dy"]["idle"] == 1
+    assert status["dy"]["done"] == 0
+    for path in outputs[0]:
+        touch(path)
+    writer.terminate(0)
+    status = index.refresh(lister, readers)
+    assert status["dy"]["done"] == 1
+    assert status["dy"]["running"] == 0
+    assert list(index.load()["run_dy"]["pending"]) == ["1"]
+
+
+def test_refresh_of_one_task(tmp_path, index):
+    index.register("run_dy", "CROWNRun", "dy", False, branch_outputs(tmp_path, "a", 2))
+    index.register(
+        "friends_dy", "CROWNFriends", "dy", False, branch_outputs(tmp_path, "b", 1)
+    )
+    assert index.refresh(Lister(), {})["dy"]["total"] == 3
+    assert index.refresh(Lister(), {}, task="CROWNFriends")["dy"]["total"] == 1
+    # registering again resets the workflow
+    index.register("run_dy", "CROWNRun", "dy", False, branch_outputs(tmp_path, "a", 4))
+    assert index.refresh(Lister(), {}, task="CROWNRun")["dy"]["total"] == 4
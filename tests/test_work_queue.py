@@ -0,0 +1,99 @@
+import os
+import time
+import pytest
+from helpers.WorkQueue import FileWorkQueue, LocalWorkQueue, run_worker
+
+
+@pytest.fixture(params=["file", "local"])
+def queue(request, tmp_path):
+    if request.param == "file":
+        return FileWorkQueue(tmp_path / "queue", max_attempts=2)
+    return LocalWorkQueue(max_attempts=2)
+
+
+def age_claim(queue, item, seconds):
+    # pretend, that the last heartbeat of the claim is `seconds` ago
+    if isinstance(queue, FileWorkQueue):
+        path = queue._item_path("claimed", item["id"])
+        past = time.time() - seconds
+        os.utime(path, (past, past))
+    else:
+        queue.items["claimed"][item["id"]]["claimed_at"] -= seconds
+
+
+def test_put_skips_known_items(queue):
+    assert queue.put("a", {"branch": 0})
+    assert not queue.put("a", {"branch": 1})
+    item = queue.claim("w1")
+    queue.complete(item)
+    assert not queue.put("a", {"branch": 0})
+    assert queue.counts() == {"pending": 0, "claimed": 0, "done": 1, "failed": 0}
+
+
+def test_claim_in_order_until_empty(queue):
+    for item_id in ["b", "a", "c"]:
+        queue.put(item_id, {"id": item_id})
+    claimed = [queue.claim("w1")["id"] for _ in range(3)]
+    assert claimed == ["a", "b", "c"]
+    assert queue.claim("w1") is None
+    assert queue.counts()["claimed"] == 3
+
+
+def test_item_is_claimed_once_by_concurrent_workers(tmp_path):
+    first = FileWorkQueue(tmp_path / "queue")
+    second = FileWorkQueue(tmp_path / "queue")
+    first.put("a", {})
+    assert first.claim("w1")["worker"] == "w1"
+    assert second.claim("w2") is None
+
+
+def test_release_fails_after_max_attempts(queue):
+    queue.put("a", {})
+    assert queue.release(queue.claim("w1"), error="crash") == "pending"
+    item = queue.claim("w1")
+    assert item["attempts"] == 1
+    assert queue.release(item, error="crash") == "failed"
+    assert queue.claim("w1") is None
+    assert queue.retry_failed() == ["a"]
+    assert queue.claim("w1")["attempts"] == 0
+
+
+def test_requeue_stale_claims(queue):
+    queue.put("a", {})
+    queue.put("b", {})
+    stale = queue.claim("w1")
+    alive = queue.claim("w2")
+    age_claim(queue, stale, 120)
+    age_claim(queue, alive, 120)
+    # the heartbeat keeps the claim of the running item
+    queue.heartbeat(alive)
+    assert queue.requeue_stale(60) == ["a"]
+    assert queue.counts()["pending"] == 1
+    assert queue.claim("w3")["errors"] == ["claim expired after 60 s"]
+
+
+def test_complete_after_requeue_of_the_claim(queue):
+    queue.put("a", {})
+    item = queue.claim("w1")
+    age_claim(queue, item, 120)
+    queue.requeue_stale(60)
+    # the worker finished the item after its claim was released
+    assert queue.complete(item)
+    assert queue.counts()["done"] == 1
+    assert queue.claim("w2") is None
+
+
+def test_run_worker_processes_queue(queue):
+    for i in range(3):
+        queue.put(f"item{i}", {"fail": i == 1})
+
+    def run_item(payload):
+        if payload["fail"]:
+            raise Exception("failed")
+
+    summary = run_worker(queue, run_item, walltime=60, log=lambda message: None)
+    assert summary["done"] == ["item0", "item2"]
+    # the failed item is retried once more, before it is failed
+    assert summary["failed"] == ["item1", "item1"]
+    assert summary["counts"]["failed"] == 1
+    assert not summary["exhausted"]